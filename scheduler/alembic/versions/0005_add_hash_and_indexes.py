@@ -0,0 +1,49 @@
+"""Promote hash to a column on tasks, and add indexes for queue and task
+lookups
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2023-03-01 09:12:44.512047
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "0005"
+down_revision = "0004"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table("tasks", schema=None) as batch_op:
+        batch_op.add_column(sa.Column("hash", sa.String(), nullable=True))
+
+    # Backfill the hash from the prioritized item of the task
+    op.execute("UPDATE tasks SET hash = p_item->>'hash' WHERE hash IS NULL")
+
+    op.create_index("ix_tasks_hash_created_at", "tasks", ["hash", "created_at"], unique=False)
+    op.create_index("ix_tasks_scheduler_id_created_at", "tasks", ["scheduler_id", "created_at"], unique=False)
+    op.create_index(
+        "ix_items_scheduler_id_hash_created_at",
+        "items",
+        ["scheduler_id", "hash", "created_at"],
+        unique=False,
+    )
+    op.create_index(
+        "ix_items_scheduler_id_priority_created_at",
+        "items",
+        ["scheduler_id", "priority", "created_at"],
+        unique=False,
+    )
+
+
+def downgrade():
+    op.drop_index("ix_items_scheduler_id_priority_created_at", table_name="items")
+    op.drop_index("ix_items_scheduler_id_hash_created_at", table_name="items")
+    op.drop_index("ix_tasks_scheduler_id_created_at", table_name="tasks")
+    op.drop_index("ix_tasks_hash_created_at", table_name="tasks")
+
+    with op.batch_alter_table("tasks", schema=None) as batch_op:
+        batch_op.drop_column("hash")
@@ -0,0 +1,79 @@
+"""Use JSONB for items.data and tasks.p_item, and add indexes for the
+commonly filtered paths
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2023-03-06 14:21:09.118342
+
+"""
+import sqlalchemy as sa
+from alembic import op
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = "0006"
+down_revision = "0005"
+branch_labels = None
+depends_on = None
+
+# Paths in the data of prioritized items that are commonly used in filters,
+# e.g. by specialised runners that pop items for a specific boefje.
+FILTER_PATHS = {
+    "boefje_id": "{boefje,id}",
+    "input_ooi": "{input_ooi}",
+    "organization": "{organization}",
+    "normalizer_id": "{normalizer,id}",
+}
+
+
+def upgrade():
+    op.alter_column(
+        "items",
+        "data",
+        existing_type=sa.JSON(),
+        type_=postgresql.JSONB(astext_type=sa.Text()),
+        existing_nullable=False,
+        postgresql_using="data::jsonb",
+    )
+    op.alter_column(
+        "tasks",
+        "p_item",
+        existing_type=sa.JSON(),
+        type_=postgresql.JSONB(astext_type=sa.Text()),
+        existing_nullable=False,
+        postgresql_using="p_item::jsonb",
+    )
+
+    # NOTE: the expressions need to match the expressions that are created
+    # for filters on string values, see
+    # scheduler/repositories/sqlalchemy/filters.py
+    for name, path in FILTER_PATHS.items():
+        op.execute(
+            f"CREATE INDEX ix_items_data_{name} ON items " f"(scheduler_id, CAST((data #>> '{path}') AS VARCHAR))"
+        )
+
+        data_path = "{data," + path[1:]
+        op.execute(f"CREATE INDEX ix_tasks_p_item_data_{name} ON tasks (CAST((p_item #>> '{data_path}') AS VARCHAR))")
+
+
+def downgrade():
+    for name in FILTER_PATHS:
+        op.drop_index(f"ix_tasks_p_item_data_{name}", table_name="tasks")
+        op.drop_index(f"ix_items_data_{name}", table_name="items")
+
+    op.alter_column(
+        "tasks",
+        "p_item",
+        existing_type=postgresql.JSONB(astext_type=sa.Text()),
+        type_=sa.JSON(),
+        existing_nullable=False,
+        postgresql_using="p_item::json",
+    )
+    op.alter_column(
+        "items",
+        "data",
+        existing_type=postgresql.JSONB(astext_type=sa.Text()),
+        type_=sa.JSON(),
+        existing_nullable=False,
+        postgresql_using="data::json",
+    )
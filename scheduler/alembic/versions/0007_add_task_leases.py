@@ -0,0 +1,35 @@
+"""Add lease deadline to tasks
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2023-03-14 10:21:37.204118
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "0007"
+down_revision = "0006"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table("tasks", schema=None) as batch_op:
+        batch_op.add_column(sa.Column("lease_expires_at", sa.DateTime(timezone=True), nullable=True))
+
+    op.create_index(
+        "ix_tasks_scheduler_id_lease_expires_at",
+        "tasks",
+        ["scheduler_id", "lease_expires_at"],
+        unique=False,
+        postgresql_where=sa.text("lease_expires_at IS NOT NULL"),
+    )
+
+
+def downgrade():
+    op.drop_index("ix_tasks_scheduler_id_lease_expires_at", table_name="tasks")
+
+    with op.batch_alter_table("tasks", schema=None) as batch_op:
+        batch_op.drop_column("lease_expires_at")
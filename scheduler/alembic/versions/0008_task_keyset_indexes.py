@@ -0,0 +1,31 @@
+"""Add indexes on tasks for keyset pagination on (created_at, id)
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2023-03-20 11:04:52.731620
+
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "0008"
+down_revision = "0007"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index("ix_tasks_created_at_id", "tasks", ["created_at", "id"], unique=False)
+    op.create_index(
+        "ix_tasks_scheduler_id_created_at_id",
+        "tasks",
+        ["scheduler_id", "created_at", "id"],
+        unique=False,
+    )
+    op.drop_index("ix_tasks_scheduler_id_created_at", table_name="tasks")
+
+
+def downgrade():
+    op.create_index("ix_tasks_scheduler_id_created_at", "tasks", ["scheduler_id", "created_at"], unique=False)
+    op.drop_index("ix_tasks_scheduler_id_created_at_id", table_name="tasks")
+    op.drop_index("ix_tasks_created_at_id", table_name="tasks")
@@ -0,0 +1,114 @@
+"""Partition the tasks table by month on created_at
+
+Only PostgreSQL supports partitioning, on other databases this is a no-op.
+The partitions of the upcoming months are created by the TaskRetention job
+of the scheduler, tasks outside of the created partitions end up in the
+default partition.
+
+Revision ID: 0009
+Revises: 0008
+Create Date: 2023-03-27 15:42:18.906513
+
+"""
+import datetime
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "0009"
+down_revision = "0008"
+branch_labels = None
+depends_on = None
+
+# NOTE: these need to match the paths of migration 0006
+FILTER_PATHS = {
+    "boefje_id": "{boefje,id}",
+    "input_ooi": "{input_ooi}",
+    "organization": "{organization}",
+    "normalizer_id": "{normalizer,id}",
+}
+
+
+def _next_month(dt: datetime.datetime) -> datetime.datetime:
+    if dt.month == 12:
+        return dt.replace(year=dt.year + 1, month=1)
+
+    return dt.replace(month=dt.month + 1)
+
+
+def _create_indexes():
+    op.create_index("ix_tasks_hash_created_at", "tasks", ["hash", "created_at"], unique=False)
+    op.create_index("ix_tasks_created_at_id", "tasks", ["created_at", "id"], unique=False)
+    op.create_index(
+        "ix_tasks_scheduler_id_created_at_id",
+        "tasks",
+        ["scheduler_id", "created_at", "id"],
+        unique=False,
+    )
+    op.create_index(
+        "ix_tasks_scheduler_id_lease_expires_at",
+        "tasks",
+        ["scheduler_id", "lease_expires_at"],
+        unique=False,
+        postgresql_where=sa.text("lease_expires_at IS NOT NULL"),
+    )
+
+    for name, path in FILTER_PATHS.items():
+        data_path = "{data," + path[1:]
+        op.execute(f"CREATE INDEX ix_tasks_p_item_data_{name} ON tasks (CAST((p_item #>> '{data_path}') AS VARCHAR))")
+
+
+def upgrade():
+    bind = op.get_bind()
+    if bind.dialect.name != "postgresql":
+        return
+
+    op.execute("ALTER TABLE tasks RENAME TO tasks_unpartitioned")
+    op.execute("ALTER TABLE tasks_unpartitioned RENAME CONSTRAINT tasks_pkey TO tasks_unpartitioned_pkey")
+
+    # NOTE: the primary key of a partitioned table needs to include the
+    # partition key.
+    op.execute(
+        "CREATE TABLE tasks (LIKE tasks_unpartitioned INCLUDING DEFAULTS INCLUDING CONSTRAINTS) "
+        "PARTITION BY RANGE (created_at)"
+    )
+    op.execute("ALTER TABLE tasks ADD PRIMARY KEY (id, created_at)")
+
+    # Create the monthly partitions from the oldest task up until two months
+    # from now.
+    now = datetime.datetime.now(datetime.timezone.utc)
+    oldest = bind.execute(sa.text("SELECT min(created_at) FROM tasks_unpartitioned")).scalar() or now
+    oldest = oldest.astimezone(datetime.timezone.utc)
+
+    start = datetime.datetime(oldest.year, oldest.month, 1, tzinfo=datetime.timezone.utc)
+    end = _next_month(_next_month(_next_month(datetime.datetime(now.year, now.month, 1, tzinfo=datetime.timezone.utc))))
+    while start < end:
+        op.execute(
+            f"CREATE TABLE tasks_p{start.year:04d}_{start.month:02d} PARTITION OF tasks "
+            f"FOR VALUES FROM ('{start.isoformat()}') TO ('{_next_month(start).isoformat()}')"
+        )
+        start = _next_month(start)
+
+    op.execute("CREATE TABLE tasks_default PARTITION OF tasks DEFAULT")
+
+    op.execute("INSERT INTO tasks SELECT * FROM tasks_unpartitioned")
+    op.execute("DROP TABLE tasks_unpartitioned")
+
+    _create_indexes()
+
+
+def downgrade():
+    bind = op.get_bind()
+    if bind.dialect.name != "postgresql":
+        return
+
+    op.execute("ALTER TABLE tasks RENAME TO tasks_partitioned")
+    op.execute("CREATE TABLE tasks (LIKE tasks_partitioned INCLUDING DEFAULTS INCLUDING CONSTRAINTS)")
+    op.execute("INSERT INTO tasks SELECT * FROM tasks_partitioned")
+
+    # NOTE: dropping the partitioned table drops its partitions and indexes
+    op.execute("DROP TABLE tasks_partitioned")
+    op.execute("ALTER TABLE tasks ADD PRIMARY KEY (id)")
+
+    _create_indexes()
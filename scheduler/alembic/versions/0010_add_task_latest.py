@@ -0,0 +1,60 @@
+"""Add the task_latest table with the latest task of every hash
+
+Revision ID: 0010
+Revises: 0009
+Create Date: 2023-04-03 09:12:44.518203
+
+"""
+import sqlalchemy as sa
+from alembic import op
+from sqlalchemy.dialects import postgresql
+
+import scheduler
+
+# revision identifiers, used by Alembic.
+revision = "0010"
+down_revision = "0009"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "task_latest",
+        sa.Column("hash", sa.String(), nullable=False),
+        sa.Column("task_id", scheduler.utils.datastore.GUID(), nullable=False),
+        sa.Column(
+            "status",
+            sa.Enum(
+                "PENDING", "QUEUED", "DISPATCHED", "RUNNING", "COMPLETED", "FAILED", name="taskstatus"
+            ).with_variant(postgresql.ENUM(name="taskstatus", create_type=False), "postgresql"),
+            nullable=False,
+        ),
+        sa.Column("run_count", sa.Integer(), nullable=False),
+        sa.Column("created_at", sa.DateTime(timezone=True), nullable=False),
+        sa.Column("modified_at", sa.DateTime(timezone=True), nullable=False),
+        sa.PrimaryKeyConstraint("hash"),
+    )
+
+    # Backfill with the latest task, and the number of tasks, of every hash.
+    # NOTE: the WHERE clause is needed by SQLite to parse the ON CONFLICT
+    # clause of an INSERT ... SELECT.
+    op.execute(
+        """
+        INSERT INTO task_latest (hash, task_id, status, run_count, created_at, modified_at)
+        SELECT t.hash, t.id, t.status, c.run_count, t.created_at, t.modified_at
+        FROM tasks t
+        JOIN (
+            SELECT hash, max(created_at) AS created_at, count(*) AS run_count
+            FROM tasks
+            WHERE hash IS NOT NULL
+            GROUP BY hash
+        ) c ON t.hash = c.hash AND t.created_at = c.created_at
+        WHERE t.hash IS NOT NULL
+        ON CONFLICT (hash) DO NOTHING
+        """
+    )
+
+
+def downgrade():
+    op.drop_table("task_latest")
@@ -2,11 +2,13 @@ import logging
 import os
 import threading
 import time
-from typing import Any, Callable, Dict
+from datetime import timedelta
+from typing import Any, Callable, Dict, List
 
 from scheduler import context, queues, rankers, schedulers, server
 from scheduler.connectors import listeners
 from scheduler.models import BoefjeTask, NormalizerTask, Organisation
+from scheduler.repositories import memory, sqlalchemy
 from scheduler.utils import thread
 
 
@@ -50,8 +52,10 @@ class App:
         # Initialize schedulers
         self.schedulers: Dict[str, schedulers.Scheduler] = {}
 
-        self.initialize_boefje_schedulers()
-        self.initialize_normalizer_schedulers()
+        with self.ctx.startup.phase("schedulers"):
+            orgs = self.ctx.services.katalogus.get_organisations()
+            self.initialize_boefje_schedulers(orgs)
+            self.initialize_normalizer_schedulers(orgs)
 
         # Initialize listeners
         self.listeners: Dict[str, listeners.Listener] = {}
@@ -69,6 +73,16 @@ class App:
         for t in self.threads.values():
             t.join(5)
 
+        for listener in (
+            self.ctx.services.scan_profile_mutation,
+            self.ctx.services.raw_data,
+            self.ctx.services.normalizer_meta,
+        ):
+            listener.stop()
+
+        if isinstance(self.ctx.pq_store, memory.PriorityQueueStore):
+            self.ctx.pq_store.stop()
+
         self.logger.info("Shutdown complete")
 
         # We're calling this here, because we want to issue a shutdown from
@@ -99,20 +113,24 @@ class App:
         )
         self.threads[name].start()
 
-    def initialize_boefje_schedulers(self) -> None:
+    def initialize_boefje_schedulers(self, orgs: List[Organisation]) -> None:
         """Initialize the schedulers for the Boefje tasks. We will create
         schedulers for all organisations in the Katalogus service.
+
+        Args:
+            orgs: The organisations in the Katalogus service.
         """
-        orgs = self.ctx.services.katalogus.get_organisations()
         for org in orgs:
             s = self.create_boefje_scheduler(org)
             self.schedulers[s.scheduler_id] = s
 
-    def initialize_normalizer_schedulers(self) -> None:
+    def initialize_normalizer_schedulers(self, orgs: List[Organisation]) -> None:
         """Initialize the schedulers for the Normalizer tasks. We will create
         schedulers for all organisations in the Katalogus service.
+
+        Args:
+            orgs: The organisations in the Katalogus service.
         """
-        orgs = self.ctx.services.katalogus.get_organisations()
         for org in orgs:
             s = self.create_normalizer_scheduler(org)
             self.schedulers[s.scheduler_id] = s
@@ -175,6 +193,15 @@ class App:
 
         return scheduler
 
+    def notify_push(self, scheduler_id: str) -> None:
+        """Wake up the callers waiting to pop from the queue of a scheduler,
+        when items are pushed onto it by another scheduler instance."""
+        s = self.schedulers.get(scheduler_id)
+        if s is None:
+            return
+
+        s.notify_push()
+
     def monitor_organisations(self) -> None:
         """Monitor the organisations in the Katalogus service, and add/remove
         organisations from the schedulers.
@@ -199,6 +226,9 @@ class App:
             self.schedulers[scheduler_id].stop()
             self.schedulers.pop(scheduler_id)
 
+        for org_id in removals:
+            self.ctx.services.katalogus.remove_snapshot(org_id)
+
         if removals:
             self.logger.info(
                 "Removed %s organisations from scheduler [org_ids=%s]",
@@ -242,8 +272,33 @@ class App:
             self.run_in_thread(name=f"listener_{name}", func=listener.listen)
 
         # Start the schedulers
-        for scheduler in self.schedulers.values():
-            scheduler.run()
+        with self.ctx.startup.phase("run_schedulers"):
+            for scheduler in self.schedulers.values():
+                scheduler.run()
+
+        # Listen for items pushed by other scheduler instances that share
+        # the database, this is only supported on PostgreSQL.
+        if isinstance(self.ctx.pq_store, sqlalchemy.PriorityQueueStore) and self.ctx.pq_store.notify:
+            push_listener = sqlalchemy.PushListener(self.ctx.datastore, callback=self.notify_push)
+            self.run_in_thread(name="push_listener", func=push_listener.listen)
+
+        # Maintain the task history, this creates the partitions of the
+        # upcoming months and removes the tasks outside of the retention
+        # period.
+        retention = sqlalchemy.TaskRetention(
+            self.ctx.datastore,
+            max_age=(
+                timedelta(days=self.ctx.config.tasks_retention_days)
+                if self.ctx.config.tasks_retention_days > 0
+                else None
+            ),
+            archive_dir=self.ctx.config.tasks_archive_dir,
+        )
+        self.run_in_thread(
+            name="task_retention",
+            func=retention.run,
+            interval=self.ctx.config.tasks_retention_interval,
+        )
 
         # Start monitors
         self.run_in_thread(
@@ -252,6 +307,16 @@ class App:
             interval=self.ctx.config.monitor_organisations_interval,
         )
 
+        # Probe the health of the external services, the health endpoint
+        # serves the result of the last probe
+        self.run_in_thread(
+            name="health",
+            func=self.server.health_checker.run,
+            interval=self.ctx.config.health_interval,
+        )
+
+        self.ctx.startup.finish()
+
         # Main thread
         while not self.stop_event.is_set():
             time.sleep(0.01)
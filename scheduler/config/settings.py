@@ -1,5 +1,6 @@
 import os
 from pathlib import Path
+from typing import Optional
 
 from pydantic import BaseSettings, Field
 
@@ -22,21 +23,43 @@ class Settings(BaseSettings):
     boefje_populate: bool = Field(False, env="SCHEDULER_BOEFJE_POPULATE")
     normalizer_populate: bool = Field(True, env="SCHEDULER_NORMALIZER_POPULATE")
     monitor_organisations_interval: int = Field(60, env="SCHEDULER_MONITOR_ORGANISATIONS_INTERVAL")
+    health_interval: int = Field(10, env="SCHEDULER_HEALTH_INTERVAL")
+    startup_timeout: int = Field(120, env="SCHEDULER_STARTUP_TIMEOUT")
 
     # External services settings
     host_katalogus: str = Field(..., env="KATALOGUS_API")
     host_bytes: str = Field(..., env="BYTES_API")
     host_bytes_user: str = Field(..., env="BYTES_USERNAME")
     host_bytes_password: str = Field(..., env="BYTES_PASSWORD")
+    host_bytes_max_concurrency: int = Field(10, env="SCHEDULER_BYTES_MAX_CONCURRENCY")
     host_octopoes: str = Field(..., env="OCTOPOES_API")
     host_mutation: str = Field(..., env="SCHEDULER_RABBITMQ_DSN")
     host_raw_data: str = Field(..., env="SCHEDULER_RABBITMQ_DSN")
     host_normalizer_meta: str = Field(..., env="SCHEDULER_RABBITMQ_DSN")
+    rabbitmq_prefetch_count: int = Field(100, env="SCHEDULER_RABBITMQ_PREFETCH_COUNT")
+    rabbitmq_connections: int = Field(1, env="SCHEDULER_RABBITMQ_CONNECTIONS")
 
     # Queue settings (0 is infinite)
     pq_maxsize: int = Field(1000, env="SCHEDULER_PQ_MAXSIZE")
     pq_populate_interval: int = Field(60, env="SCHEDULER_PQ_INTERVAL")
     pq_populate_grace_period: int = Field(86400, env="SCHEDULER_PQ_GRACE")
+    pq_size_reconcile_interval: int = Field(60, env="SCHEDULER_PQ_SIZE_RECONCILE_INTERVAL")
+    pq_pop_max_wait: int = Field(60, env="SCHEDULER_PQ_POP_MAX_WAIT")
+    pq_pop_max_waiters: int = Field(100, env="SCHEDULER_PQ_POP_MAX_WAITERS")
+    pq_lease_duration: int = Field(0, env="SCHEDULER_PQ_LEASE_DURATION")
+    pq_lease_sweep_interval: int = Field(10, env="SCHEDULER_PQ_LEASE_SWEEP_INTERVAL")
+    pq_populate_concurrency: int = Field(8, env="SCHEDULER_PQ_POPULATE_CONCURRENCY")
 
     # Database settings
     database_dsn: str = Field(..., env="SCHEDULER_DB_DSN")
+
+    # Task history settings, tasks older than the retention period are
+    # removed (0 keeps tasks forever), after they're archived to the archive
+    # directory when it is set
+    tasks_retention_days: int = Field(0, env="SCHEDULER_TASKS_RETENTION_DAYS")
+    tasks_retention_interval: int = Field(3600, env="SCHEDULER_TASKS_RETENTION_INTERVAL")
+    tasks_archive_dir: Optional[str] = Field(None, env="SCHEDULER_TASKS_ARCHIVE_DIR")
+
+    # Priority queue datastore, when not set the queues are stored in the
+    # database (e.g. memory+journal:///var/lib/kat/mula)
+    pq_dsn: Optional[str] = Field(None, env="SCHEDULER_PQ_DSN")
@@ -1,7 +1,7 @@
 import logging
 import socket
 import time
-from typing import Callable
+from typing import Callable, Optional
 
 import requests
 
@@ -10,6 +10,10 @@ class Connector:
     def __init__(self):
         self.logger = logging.getLogger(self.__class__.__name__)
 
+        # A time.monotonic() time after which `retry` gives up, e.g. the
+        # deadline of the startup of the scheduler.
+        self.deadline: Optional[float] = None
+
     def is_host_available(self, hostname: str, port: int) -> bool:
         """Check if the host is available.
 
@@ -17,8 +21,8 @@ class Connector:
             A boolean
         """
         try:
-            socket.create_connection((hostname, port))
-            return True
+            with socket.create_connection((hostname, port), timeout=5):
+                return True
         except socket.error:
             return False
 
@@ -37,7 +41,8 @@ class Connector:
             return False
 
     def retry(self, func: Callable, *args, **kwargs) -> bool:
-        """Retry a function until it returns True.
+        """Retry a function until it returns True, at most 10 times and not
+        after the deadline of the connector.
 
         Args:
             func: A python callable that needs to be retried.
@@ -66,6 +71,19 @@ class Connector:
                 kwargs,
             )
 
-            time.sleep(10)
+            wait = 10.0
+            if self.deadline is not None:
+                wait = min(wait, self.deadline - time.monotonic())
+                if wait <= 0:
+                    self.logger.warning(
+                        "Function %s, failed before the deadline [name=%s, args=%s, kwargs=%s]",
+                        func.__name__,
+                        func.__name__,
+                        args,
+                        kwargs,
+                    )
+                    break
+
+            time.sleep(wait)
 
         return False
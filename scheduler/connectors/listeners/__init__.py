@@ -1,3 +1,4 @@
+from .connection import BrokerConnection, ConnectionManager, Consumer
 from .listeners import Listener, RabbitMQ
 from .normalizer_meta import NormalizerMeta
 from .raw_data import RawData
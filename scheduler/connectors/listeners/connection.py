@@ -0,0 +1,406 @@
+import functools
+import logging
+import queue as _queue
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import pika
+
+
+class Consumer:
+    """A consumer of a RabbitMQ queue, on its own channel of a connection
+    that is maintained by a BrokerConnection. The messages the broker
+    delivers are buffered until they are taken. Taken messages are
+    acknowledged when they've been processed, so a message that wasn't
+    processed is delivered again.
+
+    The broker doesn't deliver more than `prefetch_count` unacknowledged
+    messages on the channel, which bounds the buffer.
+
+    Attributes:
+        logger:
+            The logger for the class.
+        queue:
+            The name of the queue to consume.
+        prefetch_count:
+            The maximum number of unacknowledged messages.
+        buffer:
+            A queue.Queue of the delivered messages that weren't taken yet.
+        connection:
+            The pika.BlockingConnection the channel of the consumer belongs
+            to, None when the consumer isn't consuming.
+        channel:
+            The channel the queue is consumed on.
+        callbacks:
+            A list of functions that are called when a message is delivered,
+            e.g. to wake up the thread that processes the messages.
+    """
+
+    def __init__(self, queue: str, prefetch_count: int = 100) -> None:
+        self.logger: logging.Logger = logging.getLogger(__name__)
+        self.queue: str = queue
+        self.prefetch_count: int = prefetch_count
+
+        self.buffer: _queue.Queue = _queue.Queue(maxsize=prefetch_count)
+
+        self.connection: Optional[pika.BlockingConnection] = None
+        self.channel: Optional[pika.adapters.blocking_connection.BlockingChannel] = None
+
+        # The (channel, delivery tag) of the last taken message that hasn't
+        # been acknowledged yet.
+        self.taken: Optional[Tuple[Any, int]] = None
+        self.lock: threading.Lock = threading.Lock()
+
+        self.callbacks: List[Callable[[], None]] = []
+
+    def add_callback(self, callback: Callable[[], None]) -> None:
+        """Call a function every time a message is delivered.
+
+        NOTE: the function is called from the thread of the connection, it
+        should return quickly.
+        """
+        self.callbacks.append(callback)
+
+    def open(self, connection: pika.BlockingConnection) -> None:
+        """Open a channel on the connection, and start consuming the queue.
+
+        NOTE: this needs to be called from the thread of the connection.
+        """
+        channel = connection.channel()
+        channel.basic_qos(prefetch_count=self.prefetch_count)
+        channel.basic_consume(self.queue, on_message_callback=self.on_message)
+
+        with self.lock:
+            self.connection, self.channel = connection, channel
+
+        self.logger.debug("Consuming queue %s [queue=%s]", self.queue, self.queue)
+
+    def close(self) -> None:
+        """Stop consuming the queue, and close the channel when it is still
+        open.
+
+        NOTE: this needs to be called from the thread of the connection.
+        """
+        with self.lock:
+            channel, self.connection, self.channel, self.taken = self.channel, None, None, None
+
+            # NOTE: the messages that were delivered on the closed channel
+            # can't be acknowledged anymore, they're delivered again.
+            while not self.buffer.empty():
+                self.buffer.get_nowait()
+
+        if channel is not None and channel.is_open:
+            try:
+                channel.close()
+            except pika.exceptions.AMQPError:
+                pass
+
+    def on_message(
+        self,
+        channel: pika.channel.Channel,
+        method: pika.spec.Basic.Deliver,
+        _properties: pika.spec.BasicProperties,
+        body: bytes,
+    ) -> None:
+        try:
+            self.buffer.put_nowait((channel, method.delivery_tag, body))
+        except _queue.Full:
+            channel.basic_nack(method.delivery_tag, requeue=True)
+
+        for callback in self.callbacks:
+            callback()
+
+    def get(self, n: int = 1) -> List[bytes]:
+        """Take at most `n` buffered messages, without waiting for messages
+        to be delivered.
+
+        Returns:
+            The bodies of the messages.
+        """
+        bodies: List[bytes] = []
+        with self.lock:
+            while len(bodies) < n:
+                try:
+                    channel, delivery_tag, body = self.buffer.get_nowait()
+                except _queue.Empty:
+                    break
+
+                self.taken = (channel, delivery_tag)
+                bodies.append(body)
+
+        return bodies
+
+    def ack(self) -> None:
+        """Acknowledge all taken messages."""
+        self._settle(lambda channel, delivery_tag: channel.basic_ack(delivery_tag, multiple=True))
+
+    def nack(self) -> None:
+        """Return all taken messages to the queue."""
+        self._settle(lambda channel, delivery_tag: channel.basic_nack(delivery_tag, multiple=True, requeue=True))
+
+    def _settle(self, settle: Callable[[Any, int], None]) -> None:
+        with self.lock:
+            if self.taken is None or self.connection is None:
+                return
+
+            channel, delivery_tag = self.taken
+            self.taken = None
+
+            # NOTE: a BlockingConnection isn't thread safe, the thread of the
+            # connection sends the acknowledgement.
+            try:
+                self.connection.add_callback_threadsafe(
+                    functools.partial(self._settle_on_channel, settle, channel, delivery_tag)
+                )
+            except pika.exceptions.AMQPError as exc:
+                self.logger.warning(
+                    "Could not settle messages of queue %s [queue=%s, exc=%s]",
+                    self.queue,
+                    self.queue,
+                    exc,
+                )
+
+    def _settle_on_channel(self, settle: Callable[[Any, int], None], channel: Any, delivery_tag: int) -> None:
+        # NOTE: the channel can be closed in the meantime, that shouldn't
+        # bring down the connection that is shared with other consumers.
+        if not channel.is_open:
+            return
+
+        try:
+            settle(channel, delivery_tag)
+        except pika.exceptions.AMQPError as exc:
+            self.logger.warning(
+                "Could not settle messages of queue %s [queue=%s, exc=%s]",
+                self.queue,
+                self.queue,
+                exc,
+            )
+
+
+class BrokerConnection:
+    """A connection to RabbitMQ that is shared by several consumers, every
+    consumer gets its own channel on the connection. The connection is
+    driven by its own thread, and is reopened with an exponential backoff
+    when it fails.
+
+    Attributes:
+        logger:
+            The logger for the class.
+        dsn:
+            A string defining the data source name of the RabbitMQ host to
+            connect to.
+        min_backoff:
+            Number of seconds to wait before reconnecting after the first
+            failure, this doubles on every failed attempt.
+        max_backoff:
+            Maximum number of seconds to wait before reconnecting.
+        consumers:
+            A dict of the Consumer instances on this connection, keyed by
+            queue.
+        connection:
+            The open pika.BlockingConnection, None while disconnected.
+        stop_event:
+            A threading.Event used to stop the connection.
+    """
+
+    def __init__(self, dsn: str, name: str, min_backoff: float = 1, max_backoff: float = 60) -> None:
+        self.logger: logging.Logger = logging.getLogger(__name__)
+        self.dsn: str = dsn
+        self.min_backoff: float = min_backoff
+        self.max_backoff: float = max_backoff
+
+        self.consumers: Dict[str, Consumer] = {}
+        self.connection: Optional[pika.BlockingConnection] = None
+        self.lock: threading.Lock = threading.Lock()
+
+        self.stop_event: threading.Event = threading.Event()
+        self.thread: threading.Thread = threading.Thread(target=self.run, name=name, daemon=True)
+
+    def start(self) -> None:
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.stop_event.set()
+
+    def add(self, consumer: Consumer) -> None:
+        """Add a consumer, its channel is opened when the connection is
+        open."""
+        with self.lock:
+            self.consumers[consumer.queue] = consumer
+            connection = self.connection
+
+        if connection is not None:
+            self._call(connection, functools.partial(self._open, consumer))
+
+    def remove(self, consumer: Consumer) -> None:
+        """Remove a consumer, and close its channel."""
+        with self.lock:
+            if self.consumers.get(consumer.queue) is consumer:
+                del self.consumers[consumer.queue]
+
+            connection = self.connection
+
+        if connection is not None:
+            self._call(connection, consumer.close)
+
+    def run(self) -> None:
+        """Keep the connection open until stopped."""
+        backoff = self.min_backoff
+        while not self.stop_event.is_set():
+            try:
+                connection = self.connect()
+                backoff = self.min_backoff
+
+                while not self.stop_event.is_set():
+                    connection.process_data_events(time_limit=1)
+            except pika.exceptions.AMQPError as exc:
+                self.logger.warning(
+                    "Connection to RabbitMQ failed, reconnecting in %s seconds [name=%s, backoff=%s, exc=%s]",
+                    backoff,
+                    self.thread.name,
+                    backoff,
+                    exc,
+                )
+            finally:
+                self.close()
+
+            self.stop_event.wait(backoff)
+            backoff = min(backoff * 2, self.max_backoff)
+
+    def connect(self) -> pika.BlockingConnection:
+        """Open the connection, and the channels of the consumers.
+
+        Returns:
+            The opened connection.
+        """
+        connection = pika.BlockingConnection(pika.URLParameters(self.dsn))
+
+        # NOTE: consumers that are added after this are opened by `add`
+        with self.lock:
+            self.connection = connection
+            consumers = list(self.consumers.values())
+
+        for consumer in consumers:
+            self._open(consumer)
+
+        return connection
+
+    def close(self) -> None:
+        with self.lock:
+            connection, self.connection = self.connection, None
+            consumers = list(self.consumers.values())
+
+        for consumer in consumers:
+            consumer.close()
+
+        if connection is not None and connection.is_open:
+            try:
+                connection.close()
+            except pika.exceptions.AMQPError:
+                pass
+
+    def _open(self, consumer: Consumer) -> None:
+        with self.lock:
+            connection = self.connection
+            if connection is None or self.consumers.get(consumer.queue) is not consumer:
+                return
+
+        try:
+            consumer.open(connection)
+        except (pika.exceptions.ChannelClosed, pika.exceptions.ChannelWrongStateError) as exc:
+            # NOTE: e.g. the queue doesn't exist (yet), this only closes the
+            # channel of the consumer, the other consumers on the connection
+            # keep consuming.
+            self.logger.warning(
+                "Could not consume queue %s, retrying in %s seconds [queue=%s, exc=%s]",
+                consumer.queue,
+                self.max_backoff,
+                consumer.queue,
+                exc,
+            )
+            consumer.close()
+            connection.call_later(self.max_backoff, functools.partial(self._open, consumer))
+
+    def _call(self, connection: pika.BlockingConnection, callback: Callable[[], None]) -> None:
+        """Run a callback on the thread of the connection."""
+        try:
+            connection.add_callback_threadsafe(callback)
+        except pika.exceptions.AMQPError:
+            # The connection is closing, the consumers are opened on the next
+            # connect.
+            pass
+
+
+class ConnectionManager:
+    """Multiplexes the consumers of all queues over a small pool of
+    connections to RabbitMQ, instead of a connection per queue. Consumers
+    are added when a queue is consumed for the first time, and removed when
+    e.g. the organisation of the queue is removed.
+
+    Attributes:
+        dsn:
+            A string defining the data source name of the RabbitMQ host to
+            connect to.
+        prefetch_count:
+            The maximum number of unacknowledged messages per queue.
+        connections:
+            A list of BrokerConnection instances, consumers are spread over
+            these connections.
+        consumers:
+            A dict of the consumers and the connection they're on, keyed by
+            queue.
+    """
+
+    def __init__(self, dsn: str, prefetch_count: int = 100, pool_size: int = 1) -> None:
+        self.dsn: str = dsn
+        self.prefetch_count: int = prefetch_count
+
+        self.connections: List[BrokerConnection] = [
+            BrokerConnection(dsn, name=f"rabbitmq_connection_{i}") for i in range(max(pool_size, 1))
+        ]
+        self.consumers: Dict[str, Tuple[Consumer, BrokerConnection]] = {}
+        self.lock: threading.Lock = threading.Lock()
+
+    def consumer(self, queue: str) -> Consumer:
+        """Return the consumer of a queue, and add it to the connection with
+        the fewest consumers when it doesn't exist yet."""
+        with self.lock:
+            if queue in self.consumers:
+                return self.consumers[queue][0]
+
+            connection = min(self.connections, key=lambda c: len(c.consumers))
+            if connection.thread.ident is None:
+                connection.start()
+
+            consumer = Consumer(queue, prefetch_count=self.prefetch_count)
+            connection.add(consumer)
+            self.consumers[queue] = (consumer, connection)
+
+            return consumer
+
+    def get_consumer(self, queue: str) -> Optional[Consumer]:
+        """Return the consumer of a queue, or None when the queue isn't
+        consumed (anymore)."""
+        with self.lock:
+            if queue not in self.consumers:
+                return None
+
+            return self.consumers[queue][0]
+
+    def remove(self, queue: str) -> None:
+        """Stop consuming a queue."""
+        with self.lock:
+            if queue not in self.consumers:
+                return
+
+            consumer, connection = self.consumers.pop(queue)
+
+        connection.remove(consumer)
+
+    def stop(self) -> None:
+        """Stop consuming all queues, and close the connections."""
+        with self.lock:
+            self.consumers.clear()
+
+        for connection in self.connections:
+            connection.stop()
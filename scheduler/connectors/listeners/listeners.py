@@ -1,11 +1,12 @@
 import json
 import logging
 import urllib.parse
-from typing import Dict, Optional
+from typing import Callable, Dict, Optional
 
 import pika
 
 from ..connector import Connector
+from .connection import ConnectionManager
 
 
 class Listener(Connector):
@@ -34,22 +35,36 @@ class RabbitMQ(Listener):
     channel and procedure that needs to be dispatched when receiving messages
     from a RabbitMQ queue.
 
+    Messages are received by a Consumer per queue, that is started on the
+    first `get` from that queue. The consumers share the connections of a
+    ConnectionManager. Messages that were taken with `get` need to be
+    acknowledged with `ack` once they're processed.
+
     Attibutes:
         dsn:
             A string defining the data source name of the RabbitMQ host to
             connect to.
+        manager:
+            The ConnectionManager the queues are consumed with.
     """
 
-    def __init__(self, dsn: str):
+    def __init__(self, dsn: str, prefetch_count: int = 100, manager: Optional[ConnectionManager] = None):
         """Initialize the RabbitMQ Listener
 
         Args:
             dsn:
                 A string defining the data source name of the RabbitMQ host to
                 connect to.
+            prefetch_count:
+                The maximum number of unacknowledged messages per queue, when
+                the listener creates its own ConnectionManager.
+            manager:
+                A ConnectionManager that is shared with other listeners of
+                the same RabbitMQ host.
         """
         super().__init__()
         self.dsn = dsn
+        self.manager: ConnectionManager = manager or ConnectionManager(dsn, prefetch_count=prefetch_count)
 
     def dispatch(self, body: bytes) -> None:
         """Dispatch a message without a return value"""
@@ -62,17 +77,44 @@ class RabbitMQ(Listener):
         channel.start_consuming()
 
     def get(self, queue: str) -> Optional[Dict[str, object]]:
-        connection = pika.BlockingConnection(pika.URLParameters(self.dsn))
-        channel = connection.channel()
-        method, properties, body = channel.basic_get(queue)
-
-        if body is None:
+        """Take a message from the queue, without waiting for a message to be
+        delivered. The message needs to be acknowledged with `ack`."""
+        bodies = self.manager.consumer(queue).get(1)
+        if not bodies:
             return None
 
-        response = json.loads(body)
-        channel.basic_ack(method.delivery_tag)
+        return json.loads(bodies[0])
+
+    def add_callback(self, queue: str, callback: Callable[[], None]) -> None:
+        """Start consuming the queue, and call a function every time a
+        message is delivered on it."""
+        self.manager.consumer(queue).add_callback(callback)
 
-        return response
+    def ack(self, queue: str) -> None:
+        """Acknowledge the messages that were taken from the queue.
+
+        NOTE: this doesn't start consuming a queue that was removed in the
+        meantime, its messages are delivered again.
+        """
+        consumer = self.manager.get_consumer(queue)
+        if consumer is not None:
+            consumer.ack()
+
+    def nack(self, queue: str) -> None:
+        """Return the messages that were taken from the queue, but couldn't
+        be processed, to the queue."""
+        consumer = self.manager.get_consumer(queue)
+        if consumer is not None:
+            consumer.nack()
+
+    def remove(self, queue: str) -> None:
+        """Stop consuming a queue, e.g. when its organisation is removed.
+        Messages that were taken but not acknowledged are delivered again."""
+        self.manager.remove(queue)
+
+    def stop(self) -> None:
+        """Stop consuming all queues."""
+        self.manager.stop()
 
     def callback(
         self,
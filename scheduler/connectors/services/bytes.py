@@ -1,6 +1,7 @@
 import typing
+from concurrent import futures
 from functools import wraps
-from typing import Any, Callable, Dict, Optional
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
 import requests
 from requests.models import HTTPError
@@ -28,15 +29,39 @@ def retry_with_login(function: ClientSessionMethod) -> ClientSessionMethod:
 
 
 class Bytes(HTTPService):
+    """Connector for bytes.
+
+    Attributes:
+        credentials: The credentials to request a token with.
+        executor:
+            A bounded thread pool on which batched lookups make their
+            requests concurrently, over the pooled connections of the
+            session.
+    """
+
     name = "bytes"
 
-    def __init__(self, host: str, source: str, user: str, password: str, timeout: int = 5):
+    def __init__(
+        self,
+        host: str,
+        source: str,
+        user: str,
+        password: str,
+        timeout: int = 5,
+        max_concurrency: int = 10,
+        deadline: Optional[float] = None,
+    ):
         self.credentials: Dict[str, str] = {
             "username": user,
             "password": password,
         }
 
-        super().__init__(host=host, source=source, timeout=timeout)
+        super().__init__(host=host, source=source, timeout=timeout, pool_size=max_concurrency, deadline=deadline)
+
+        self.executor: futures.ThreadPoolExecutor = futures.ThreadPoolExecutor(
+            max_workers=max_concurrency,
+            thread_name_prefix="bytes",
+        )
 
     def login(self) -> None:
         self.headers.update({"Authorization": f"bearer {self._get_token()}"})
@@ -60,6 +85,51 @@ class Bytes(HTTPService):
     @retry_with_login
     @exception_handler
     def get_last_run_boefje(self, boefje_id: str, input_ooi: str, organization_id: str) -> Optional[BoefjeMeta]:
+        return self._get_last_run_boefje(boefje_id, input_ooi, organization_id)
+
+    @exception_handler
+    def get_last_run_boefjes(self, keys: List[Tuple[str, Optional[str], str]]) -> List[Optional[BoefjeMeta]]:
+        """Get the last run of a batch of boefjes.
+
+        Bytes doesn't have an endpoint to look up the last runs of multiple
+        boefjes at once, so the lookups are made concurrently. When the token
+        has expired we login once for the whole batch, and only repeat the
+        lookups that were unauthorized.
+
+        Args:
+            keys: A list of (boefje_id, input_ooi, organization_id) tuples.
+
+        Returns:
+            The last run of every key, in the order of the keys. None when a
+            boefje didn't run yet.
+        """
+        results: Dict[int, Optional[BoefjeMeta]] = {}
+
+        pending = list(range(len(keys)))
+        for attempt in range(2):
+            lookups = {i: self.executor.submit(self._get_last_run_boefje, *keys[i]) for i in pending}
+            futures.wait(lookups.values())
+
+            pending = []
+            for i, lookup in lookups.items():
+                try:
+                    results[i] = lookup.result()
+                except HTTPError as error:
+                    if error.response.status_code != 401 or attempt > 0:
+                        raise error
+
+                    pending.append(i)
+
+            if not pending:
+                break
+
+            self.login()
+
+        return [results[i] for i in range(len(keys))]
+
+    def _get_last_run_boefje(
+        self, boefje_id: str, input_ooi: Optional[str], organization_id: str
+    ) -> Optional[BoefjeMeta]:
         url = f"{self.host}/bytes/boefje_meta"
         response = self.get(
             url=url,
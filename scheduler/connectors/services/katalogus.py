@@ -1,70 +1,251 @@
-from typing import List
+import functools
+import threading
+import time
+from concurrent import futures
+from typing import Dict, List, Optional, Set
 
+import requests
+
+from scheduler import utils
 from scheduler.connectors.errors import exception_handler
 from scheduler.models import Boefje, Organisation, Plugin
-from scheduler.utils import dict_utils
 
 from .services import HTTPService
 
 
+class PluginSnapshot:
+    """The plugins of an organisation at one point in time, indexed by id,
+    and by the object types the boefjes and normalizers consume. All indexes
+    are built from a single fetch of the plugins, so they're consistent with
+    each other.
+
+    Attributes:
+        plugins: A dict of the plugins, keyed by plugin id.
+        boefjes_by_type: A dict of the boefjes consuming an object type.
+        normalizers_by_type: A dict of the normalizers consuming a mime type.
+        etag: The ETag header of the response the plugins were fetched with.
+        last_modified:
+            The Last-Modified header of the response the plugins were fetched
+            with.
+        fetched_at:
+            The time.monotonic() time at which the snapshot was fetched, or
+            was last confirmed to be up to date.
+    """
+
+    def __init__(
+        self,
+        plugins: List[Plugin],
+        etag: Optional[str] = None,
+        last_modified: Optional[str] = None,
+    ) -> None:
+        self.plugins: Dict[str, Plugin] = {plugin.id: plugin for plugin in plugins}
+        self.boefjes_by_type: Dict[str, List[Plugin]] = {}
+        self.normalizers_by_type: Dict[str, List[Plugin]] = {}
+        self.etag: Optional[str] = etag
+        self.last_modified: Optional[str] = last_modified
+        self.fetched_at: float = time.monotonic()
+
+        for plugin in plugins:
+            if plugin.type == "boefje":
+                # NOTE: backwards compatability, when it is a boefje the
+                # consumes field is a string field.
+                consumes = [plugin.consumes] if isinstance(plugin.consumes, str) else plugin.consumes
+                for type_ in consumes:
+                    self.boefjes_by_type.setdefault(type_, []).append(plugin)
+            elif plugin.type == "normalizer":
+                for type_ in plugin.consumes:
+                    self.normalizers_by_type.setdefault(type_, []).append(plugin)
+
+
 class Katalogus(HTTPService):
+    """The Katalogus service. The plugins of every organisation are kept in
+    a PluginSnapshot, that is refreshed in the background when it is older
+    than `cache_ttl` seconds (stale-while-revalidate). Lookups are served
+    from the snapshot, and don't wait for the refresh.
+
+    Attributes:
+        cache_ttl:
+            Number of seconds after which a snapshot is refreshed. Also the
+            number of seconds an organisation of which the plugins couldn't
+            be fetched is remembered, before trying again.
+        snapshots:
+            A utils.Cache of the PluginSnapshot of every organisation, keyed
+            by organisation id.
+        refreshing:
+            The ids of the organisations of which the snapshot is being
+            refreshed.
+        executor:
+            A ThreadPoolExecutor the snapshots are refreshed on.
+    """
+
     name = "katalogus"
 
-    def __init__(self, host: str, source: str, timeout: int = 5):
-        super().__init__(host, source, timeout)
+    def __init__(
+        self,
+        host: str,
+        source: str,
+        timeout: int = 5,
+        cache_ttl: int = 30,
+        refresh_concurrency: int = 4,
+        deadline: Optional[float] = None,
+    ):
+        super().__init__(host, source, timeout, deadline=deadline)
 
-        self.organisations_plugin_cache: dict_utils.ExpiringDict = dict_utils.ExpiringDict(lifetime=30)
-        self.organisations_boefje_type_cache: dict_utils.ExpiringDict = dict_utils.ExpiringDict(lifetime=30)
-        self.organisations_normalizer_type_cache: dict_utils.ExpiringDict = dict_utils.ExpiringDict(lifetime=30)
+        self.cache_ttl: int = cache_ttl
+        # NOTE: snapshots don't expire, a stale snapshot is served while it
+        # is refreshed. Organisations without plugins are negatively cached.
+        self.snapshots: utils.Cache = utils.Cache(ttl=None, negative_ttl=cache_ttl)
+        self.refreshing: Set[str] = set()
+        self.lock: threading.Lock = threading.Lock()
+        self.executor: futures.ThreadPoolExecutor = futures.ThreadPoolExecutor(
+            max_workers=refresh_concurrency,
+            thread_name_prefix="katalogus_refresh",
+        )
 
-        self._flush_organisations_plugin_cache()
-        self._flush_organisations_normalizer_type_cache()
-        self._flush_organisations_boefje_type_cache()
+    def warm_up(self) -> futures.Future:
+        """Fetch the plugins of all organisations in the background, so the
+        first lookups of an organisation don't have to wait for them.
 
-    def _flush_organisations_plugin_cache(self) -> None:
-        self.logger.debug("flushing plugin cache [cache=%s]", self.organisations_plugin_cache.cache)
-        orgs = self.get_organisations()
+        Returns:
+            A Future that is done when the refreshes of all organisations
+            have been started.
+        """
+        return self.executor.submit(self._warm_up)
+
+    def _warm_up(self) -> None:
+        try:
+            orgs = self.get_organisations()
+        except Exception as exc:
+            # NOTE: the plugins are fetched on the first lookup instead
+            self.logger.warning("Could not warm up the plugins of the organisations [exc=%s]", exc)
+            return
 
         for org in orgs:
-            self.organisations_plugin_cache[org.id] = {
-                plugin.id: plugin for plugin in self.get_plugins_by_organisation(org.id)
-            }
+            with self.lock:
+                if org.id in self.refreshing:
+                    continue
 
-    def _flush_organisations_boefje_type_cache(self) -> None:
-        """boefje.consumes -> plugin type boefje"""
-        self.logger.debug("flushing boefje cache [cache=%s]", self.organisations_boefje_type_cache.cache)
-        orgs = self.get_organisations()
+                self.refreshing.add(org.id)
 
-        for org in orgs:
-            self.organisations_boefje_type_cache[org.id] = {}
+            self.executor.submit(self._refresh_in_background, org.id)
 
-            for plugin in self.get_plugins_by_organisation(org.id):
-                if plugin.type != "boefje":
-                    continue
+    def get_snapshot(self, organisation_id: str) -> PluginSnapshot:
+        """Return the plugin snapshot of an organisation. A stale snapshot is
+        returned as is, and refreshed in the background. Only the first
+        lookup of an organisation waits for its plugins to be fetched."""
+        snapshot = self.snapshots.get_or_load(organisation_id, functools.partial(self._load_snapshot, organisation_id))
+        if snapshot is None:
+            # NOTE: e.g. the organisation doesn't exist (anymore), it has no
+            # plugins.
+            return PluginSnapshot(plugins=[])
 
-                # NOTE: backwards compatability, when it is a boefje the
-                # consumes field is a string field.
-                if isinstance(plugin.consumes, str):
-                    self.organisations_boefje_type_cache[org.id].setdefault(plugin.consumes, []).append(plugin)
-                    continue
+        if time.monotonic() - snapshot.fetched_at > self.cache_ttl:
+            with self.lock:
+                refresh = organisation_id not in self.refreshing
+                self.refreshing.add(organisation_id)
 
-                for type_ in plugin.consumes:
-                    self.organisations_boefje_type_cache[org.id].setdefault(type_, []).append(plugin)
+            if refresh:
+                self.executor.submit(self._refresh_in_background, organisation_id)
 
-    def _flush_organisations_normalizer_type_cache(self) -> None:
-        """normalizer.consumes -> plugin type normalizer"""
-        self.logger.debug("flushing normalizer cache [cache=%s]", self.organisations_normalizer_type_cache.cache)
-        orgs = self.get_organisations()
+        return snapshot
 
-        for org in orgs:
-            self.organisations_normalizer_type_cache[org.id] = {}
+    def _load_snapshot(self, organisation_id: str) -> Optional[PluginSnapshot]:
+        try:
+            return self.refresh_snapshot(organisation_id)
+        except requests.exceptions.HTTPError as exc:
+            self.logger.warning(
+                "Could not fetch plugins of organisation %s [organisation_id=%s, exc=%s]",
+                organisation_id,
+                organisation_id,
+                exc,
+            )
+            return None
 
-            for plugin in self.get_plugins_by_organisation(org.id):
-                if plugin.type != "normalizer":
-                    continue
+    def _refresh_in_background(self, organisation_id: str) -> None:
+        try:
+            self.refresh_snapshot(organisation_id)
+        except Exception as exc:
+            # NOTE: the stale snapshot is kept, and is refreshed again on the
+            # next lookup.
+            self.logger.warning(
+                "Could not refresh plugins of organisation %s [organisation_id=%s, exc=%s]",
+                organisation_id,
+                organisation_id,
+                exc,
+            )
+        finally:
+            with self.lock:
+                self.refreshing.discard(organisation_id)
 
-                for type_ in plugin.consumes:
-                    self.organisations_normalizer_type_cache[org.id].setdefault(type_, []).append(plugin)
+    def refresh_snapshot(self, organisation_id: str) -> PluginSnapshot:
+        """Fetch the plugins of an organisation, and replace its snapshot.
+
+        The request is conditional on the ETag and Last-Modified headers of
+        the current snapshot. When Katalogus responds that the plugins
+        weren't modified, the current snapshot is kept. Concurrent refreshes
+        of the same organisation share one refresh.
+        """
+        return self.single_flight.do(("snapshot", organisation_id), self._refresh_snapshot, organisation_id)
+
+    @exception_handler
+    def _refresh_snapshot(self, organisation_id: str) -> PluginSnapshot:
+        current = self.snapshots.get(organisation_id)
+
+        headers: Dict[str, str] = {}
+        if current is not None and current.etag is not None:
+            headers["If-None-Match"] = current.etag
+        if current is not None and current.last_modified is not None:
+            headers["If-Modified-Since"] = current.last_modified
+
+        url = f"{self.host}/v1/organisations/{organisation_id}/plugins"
+        response = self.get(url, headers=headers)
+
+        if current is not None and response.status_code == 304:
+            current.fetched_at = time.monotonic()
+            self.logger.debug(
+                "Plugins of organisation %s not modified [organisation_id=%s]",
+                organisation_id,
+                organisation_id,
+            )
+            return current
+
+        self._verify_response(response)
+
+        snapshot = PluginSnapshot(
+            plugins=[Plugin(**plugin) for plugin in response.json()],
+            etag=response.headers.get("ETag"),
+            last_modified=response.headers.get("Last-Modified"),
+        )
+
+        # NOTE: the snapshot is only stored when the snapshot the refresh
+        # started from is still the registered one, so a refresh that was in
+        # flight while the snapshot was removed doesn't bring it back.
+        with self.lock:
+            if self.snapshots.get(organisation_id) is not current:
+                self.logger.debug(
+                    "Discarded refresh of plugins of organisation %s, its snapshot was replaced or removed "
+                    "[organisation_id=%s]",
+                    organisation_id,
+                    organisation_id,
+                )
+                return snapshot
+
+            self.snapshots.set(organisation_id, snapshot)
+
+        self.logger.debug(
+            "Refreshed plugins of organisation %s [organisation_id=%s, plugins=%d]",
+            organisation_id,
+            organisation_id,
+            len(snapshot.plugins),
+        )
+
+        return snapshot
+
+    def remove_snapshot(self, organisation_id: str) -> None:
+        """Remove the plugin snapshot of an organisation, e.g. when the
+        organisation was removed."""
+        with self.lock:
+            self.snapshots.delete(organisation_id)
 
     @exception_handler
     def get_boefjes(self) -> List[Boefje]:
@@ -91,27 +272,13 @@ class Katalogus(HTTPService):
         return [Organisation(**organisation) for organisation in response.json().values()]
 
     def get_plugins_by_organisation(self, organisation_id: str) -> List[Plugin]:
-        url = f"{self.host}/v1/organisations/{organisation_id}/plugins"
-        response = self.get(url)
-        return [Plugin(**plugin) for plugin in response.json()]
+        return list(self.get_snapshot(organisation_id).plugins.values())
 
-    def get_plugin_by_id_and_org_id(self, plugin_id: str, organisation_id: str) -> Plugin:
-        try:
-            return dict_utils.deep_get(self.organisations_plugin_cache, [organisation_id, plugin_id])
-        except dict_utils.ExpiredError:
-            self._flush_organisations_plugin_cache()
-            return dict_utils.deep_get(self.organisations_plugin_cache, [organisation_id, plugin_id])
+    def get_plugin_by_id_and_org_id(self, plugin_id: str, organisation_id: str) -> Optional[Plugin]:
+        return self.get_snapshot(organisation_id).plugins.get(plugin_id)
 
-    def get_boefjes_by_type_and_org_id(self, boefje_type: str, organisation_id: str) -> List[Plugin]:
-        try:
-            return dict_utils.deep_get(self.organisations_boefje_type_cache, [organisation_id, boefje_type])
-        except dict_utils.ExpiredError:
-            self._flush_organisations_boefje_type_cache()
-            return dict_utils.deep_get(self.organisations_boefje_type_cache, [organisation_id, boefje_type])
+    def get_boefjes_by_type_and_org_id(self, boefje_type: str, organisation_id: str) -> Optional[List[Plugin]]:
+        return self.get_snapshot(organisation_id).boefjes_by_type.get(boefje_type)
 
-    def get_normalizers_by_org_id_and_type(self, organisation_id: str, normalizer_type: str) -> List[Plugin]:
-        try:
-            return dict_utils.deep_get(self.organisations_normalizer_type_cache, [organisation_id, normalizer_type])
-        except dict_utils.ExpiredError:
-            self._flush_organisations_normalizer_type_cache()
-            return dict_utils.deep_get(self.organisations_normalizer_type_cache, [organisation_id, normalizer_type])
+    def get_normalizers_by_org_id_and_type(self, organisation_id: str, normalizer_type: str) -> Optional[List[Plugin]]:
+        return self.get_snapshot(organisation_id).normalizers_by_type.get(normalizer_type)
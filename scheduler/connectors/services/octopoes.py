@@ -1,4 +1,4 @@
-from typing import List
+from typing import List, Optional
 
 from scheduler.connectors.errors import exception_handler
 from scheduler.models import OOI, Organisation
@@ -10,9 +10,9 @@ class Octopoes(HTTPService):
     name = "octopoes"
     health_endpoint = None
 
-    def __init__(self, host: str, source: str, orgs: List[Organisation]):
+    def __init__(self, host: str, source: str, orgs: List[Organisation], deadline: Optional[float] = None):
         self.orgs: List[Organisation] = orgs
-        super().__init__(host, source)
+        super().__init__(host, source, deadline=deadline)
 
     @exception_handler
     def get_objects(self, organisation_id: str) -> List[OOI]:
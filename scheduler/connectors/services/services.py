@@ -4,6 +4,7 @@ from typing import Any, Dict, Optional
 
 import requests
 from requests.adapters import HTTPAdapter, Retry
+from scheduler import utils
 
 from ..connector import Connector
 
@@ -33,12 +34,26 @@ class HTTPService(Connector):
             determine whether a host is healthy.
         timeout:
             An integer defining the timeout of requests.
+        pool_size:
+            An integer defining the maximum number of connections to the
+            host that are kept open, for concurrent requests.
+        single_flight:
+            A SingleFlight instance that coalesces concurrent identical GET
+            requests into one request.
     """
 
     name: Optional[str] = None
     health_endpoint: Optional[str] = "/health"
 
-    def __init__(self, host: str, source: str, timeout: int = 5, retries: int = 5):
+    def __init__(
+        self,
+        host: str,
+        source: str,
+        timeout: int = 5,
+        retries: int = 5,
+        pool_size: int = 10,
+        deadline: Optional[float] = None,
+    ):
         """Initializer of the HTTPService class. During initialization the
         host will be checked if it is available and healthy.
 
@@ -54,6 +69,12 @@ class HTTPService(Connector):
             retries:
                 An integer defining the number of retries to make before
                 giving up.
+            pool_size:
+                An integer defining the maximum number of connections to the
+                host that are kept open, for concurrent requests.
+            deadline:
+                A time.monotonic() time after which the checks of the host
+                give up, None to retry the checks 10 times.
         """
         super().__init__()
 
@@ -63,14 +84,17 @@ class HTTPService(Connector):
         self.timeout: int = timeout
         self.retries = retries
         self.source: str = source
+        self.pool_size: int = pool_size
+        self.single_flight: utils.SingleFlight = utils.SingleFlight()
+        self.deadline = deadline
 
         max_retries = Retry(
             total=self.retries,
             backoff_factor=0.1,
             status_forcelist=[500, 502, 503, 504],
         )
-        self.session.mount("http://", HTTPAdapter(max_retries=max_retries))
-        self.session.mount("https://", HTTPAdapter(max_retries=max_retries))
+        self.session.mount("http://", HTTPAdapter(max_retries=max_retries, pool_maxsize=self.pool_size))
+        self.session.mount("https://", HTTPAdapter(max_retries=max_retries, pool_maxsize=self.pool_size))
 
         self.headers: Dict[str, str] = {
             "Accept": "application/json",
@@ -97,12 +121,33 @@ class HTTPService(Connector):
             params:
                 A dict to set the query paramaters for the request
 
+        Concurrent identical requests share one request, and its response
+        or error.
+
         Returns:
             A request.Response object
         """
+        request_headers = {**self.headers, **headers} if headers else dict(self.headers)
+        key = (
+            "GET",
+            url,
+            repr(payload),
+            tuple(sorted(request_headers.items())),
+            tuple(sorted((params or {}).items())),
+        )
+
+        return self.single_flight.do(key, self._get, url, payload, request_headers, params)
+
+    def _get(
+        self,
+        url: str,
+        payload: Optional[Dict[str, Any]],
+        headers: Dict[str, Any],
+        params: Optional[Dict[str, Any]],
+    ) -> requests.Response:
         response = self.session.get(
             url,
-            headers=self.headers.update(headers) if headers else self.headers,
+            headers=headers,
             params=params,
             data=payload,
             timeout=self.timeout,
@@ -114,6 +159,9 @@ class HTTPService(Connector):
             url,
         )
 
+        # NOTE: the body is pre-read so coalesced callers can share it.
+        _ = response.content
+
         return response
 
     def post(
@@ -136,7 +184,7 @@ class HTTPService(Connector):
         """
         response = self.session.post(
             url,
-            headers=self.headers.update(headers) if headers else self.headers,
+            headers={**self.headers, **headers} if headers else self.headers,
             params=params,
             data=payload,
             timeout=self.timeout,
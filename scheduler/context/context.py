@@ -1,12 +1,16 @@
 import json
 import logging.config
 import threading
+import time
+from concurrent import futures
 from types import SimpleNamespace
+from typing import Any, Callable, Dict
 
 import scheduler
+from scheduler import utils
 from scheduler.config import settings
 from scheduler.connectors import listeners, services
-from scheduler.repositories import sqlalchemy, stores
+from scheduler.repositories import memory, sqlalchemy, stores
 
 
 class AppContext:
@@ -24,6 +28,9 @@ class AppContext:
         datastore:
             A SQLAlchemy.SQLAlchemy object used for storing and retrieving
             tasks.
+        startup:
+            A utils.PhaseTimer with the duration of the phases of the
+            startup of the scheduler.
     """
 
     def __init__(self) -> None:
@@ -34,36 +41,68 @@ class AppContext:
         with open(self.config.log_cfg, "rt", encoding="utf-8") as f:
             logging.config.dictConfig(json.load(f))
 
-        # Services
-        katalogus_service = services.Katalogus(
-            host=self.config.host_katalogus,
-            source=f"scheduler/{scheduler.__version__}",
-        )
+        # Services, the checks of the hosts of the services run concurrently
+        # and give up at the deadline of the startup.
+        self.startup: utils.PhaseTimer = utils.PhaseTimer("startup")
+        deadline = time.monotonic() + self.config.startup_timeout
 
-        bytes_service = services.Bytes(
-            host=self.config.host_bytes,
-            user=self.config.host_bytes_user,
-            password=self.config.host_bytes_password,
-            source=f"scheduler/{scheduler.__version__}",
-        )
+        with futures.ThreadPoolExecutor(max_workers=3, thread_name_prefix="startup") as executor:
+            katalogus_future = executor.submit(
+                self._start_phase,
+                "katalogus",
+                services.Katalogus,
+                host=self.config.host_katalogus,
+                source=f"scheduler/{scheduler.__version__}",
+                deadline=deadline,
+            )
 
-        octopoes_service = services.Octopoes(
-            host=self.config.host_octopoes,
-            source=f"scheduler/{scheduler.__version__}",
-            orgs=katalogus_service.get_organisations(),
-        )
+            bytes_future = executor.submit(
+                self._start_phase,
+                "bytes",
+                services.Bytes,
+                host=self.config.host_bytes,
+                user=self.config.host_bytes_user,
+                password=self.config.host_bytes_password,
+                source=f"scheduler/{scheduler.__version__}",
+                max_concurrency=self.config.host_bytes_max_concurrency,
+                deadline=deadline,
+            )
+
+            # NOTE: the health of octopoes is checked per organisation, so it
+            # starts when the organisations are fetched from katalogus.
+            octopoes_future = executor.submit(self._start_octopoes, katalogus_future, deadline)
+
+            katalogus_service = katalogus_future.result()
+            bytes_service = bytes_future.result()
+            octopoes_service = octopoes_future.result()
+
+        # The plugins of the organisations are fetched in the background
+        katalogus_service.warm_up()
+
+        # Listeners, the listeners of the same RabbitMQ host share its
+        # connections
+        connection_managers: Dict[str, listeners.ConnectionManager] = {}
+        for dsn in (self.config.host_mutation, self.config.host_raw_data, self.config.host_normalizer_meta):
+            if dsn not in connection_managers:
+                connection_managers[dsn] = listeners.ConnectionManager(
+                    dsn=dsn,
+                    prefetch_count=self.config.rabbitmq_prefetch_count,
+                    pool_size=self.config.rabbitmq_connections,
+                )
 
-        # Listeners
         mutations_listener = listeners.ScanProfileMutation(
             dsn=self.config.host_mutation,
+            manager=connection_managers[self.config.host_mutation],
         )
 
         raw_data_listener = listeners.RawData(
             dsn=self.config.host_raw_data,
+            manager=connection_managers[self.config.host_raw_data],
         )
 
         normalizer_meta_listener = listeners.NormalizerMeta(
             dsn=self.config.host_normalizer_meta,
+            manager=connection_managers[self.config.host_normalizer_meta],
         )
 
         # Register external services, SimpleNamespace allows us to use dot
@@ -82,6 +121,41 @@ class AppContext:
         self.stop_event: threading.Event = threading.Event()
 
         # Repositories
-        datastore = sqlalchemy.SQLAlchemy(self.config.database_dsn)
-        self.task_store: stores.TaskStorer = sqlalchemy.TaskStore(datastore)
-        self.pq_store: stores.PriorityQueueStorer = sqlalchemy.PriorityQueueStore(datastore)
+        with self.startup.phase("datastore"):
+            self.datastore: sqlalchemy.SQLAlchemy = sqlalchemy.SQLAlchemy(self.config.database_dsn)
+            self.task_store: stores.TaskStorer = sqlalchemy.TaskStore(self.datastore)
+            self.pq_store: stores.PriorityQueueStorer
+            if self.config.pq_dsn is not None and memory.Journal.is_journal_dsn(self.config.pq_dsn):
+                self.pq_store = memory.PriorityQueueStore(
+                    memory.Journal(self.config.pq_dsn),
+                    task_store=self.task_store,
+                )
+            elif self.config.pq_dsn is not None:
+                raise ValueError(f"Unsupported priority queue datastore: {self.config.pq_dsn}")
+            else:
+                self.pq_store = sqlalchemy.PriorityQueueStore(
+                    self.datastore,
+                    size_reconcile_interval=self.config.pq_size_reconcile_interval,
+                )
+
+    def _start_octopoes(self, katalogus_future: futures.Future, deadline: float) -> services.Octopoes:
+        """Fetch the organisations once katalogus is started, and start
+        octopoes with them."""
+        katalogus_service = katalogus_future.result()
+
+        with self.startup.phase("organisations"):
+            orgs = katalogus_service.get_organisations()
+
+        return self._start_phase(
+            "octopoes",
+            services.Octopoes,
+            host=self.config.host_octopoes,
+            source=f"scheduler/{scheduler.__version__}",
+            orgs=orgs,
+            deadline=deadline,
+        )
+
+    def _start_phase(self, name: str, func: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        """Call `func(*args, **kwargs)` as a phase of the startup."""
+        with self.startup.phase(name):
+            return func(*args, **kwargs)
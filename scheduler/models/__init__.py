@@ -2,11 +2,12 @@ from .base import Base
 from .boefje import Boefje, BoefjeMeta
 from .events import NormalizerMetaReceivedEvent, RawData, RawDataReceivedEvent
 from .filter import Filter
-from .health import ServiceHealth
+from .health import ServiceHealth, Startup, StartupPhase
 from .normalizer import Normalizer
 from .ooi import OOI, MutationOperationType, ScanProfile, ScanProfileMutation
 from .organisation import Organisation
+from .pagination import CountMode
 from .plugin import Plugin
-from .queue import PrioritizedItem, PrioritizedItemORM, Queue
+from .queue import PrioritizedItem, PrioritizedItemORM, PushResult, PushStatus, Queue
 from .scheduler import Scheduler
-from .tasks import BoefjeTask, NormalizerTask, Task, TaskORM, TaskStatus
+from .tasks import BoefjeTask, NormalizerTask, Task, TaskLatest, TaskLatestORM, TaskORM, TaskStatus
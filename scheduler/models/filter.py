@@ -1,13 +1,17 @@
 import datetime
 from typing import List, Literal, Union
 
-from pydantic import BaseModel
+from pydantic import BaseModel, StrictBool, StrictFloat, StrictInt
+
+# NOTE: the strict types come before str, otherwise pydantic would coerce
+# numbers to strings, and we would lose the type of the value.
+FilterValue = Union[StrictBool, StrictInt, StrictFloat, str, datetime.date]
 
 
 class Filter(BaseModel):
     field: str
     operator: Literal["eq", "ne", "lt", "le", "gt", "ge", "in_", "notin_"]
-    value: Union[str, int, datetime.date]
+    value: Union[FilterValue, List[FilterValue]]
 
     def get_field(self) -> List[str]:
         return self.field.split("__")
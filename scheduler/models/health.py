@@ -1,3 +1,4 @@
+from datetime import datetime
 from typing import Any, Dict, List, Optional
 
 from pydantic import BaseModel
@@ -14,6 +15,27 @@ class ServiceHealth(BaseModel):
     additional: Any = None
     results: List["ServiceHealth"] = []
     externals: Dict[str, bool] = {}
+    checked_at: Optional[datetime] = None
 
 
 ServiceHealth.update_forward_refs()
+
+
+class StartupPhase(BaseModel):
+    name: str
+    started_at: datetime
+    duration: Optional[float] = None
+    error: Optional[str] = None
+
+
+class Startup(BaseModel):
+    """Startup is used as response model for the startup endpoint of the
+    server.Server, it reports the duration of the startup phases of the
+    scheduler.
+    """
+
+    name: str
+    started_at: datetime
+    finished_at: Optional[datetime] = None
+    duration: float
+    phases: List[StartupPhase] = []
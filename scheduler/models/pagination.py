@@ -0,0 +1,15 @@
+from enum import Enum as _Enum
+
+
+class CountMode(str, _Enum):
+    """How the total number of results of a paginated listing is counted."""
+
+    # Count the results exactly, this scans every matching row
+    EXACT = "exact"
+
+    # Estimate the number of results from the planner statistics of the
+    # database, when supported by the database
+    ESTIMATE = "estimate"
+
+    # Don't count the results
+    NONE = "none"
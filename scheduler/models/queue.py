@@ -1,9 +1,11 @@
 import uuid
 from datetime import datetime, timezone
-from typing import Dict, List, Optional
+from enum import Enum as _Enum
+from typing import Dict, Optional
 
 from pydantic import BaseModel, Field
-from sqlalchemy import JSON, Column, DateTime, Integer, String
+from sqlalchemy import JSON, Column, DateTime, Index, Integer, String
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.sql import func
 
 from scheduler.utils import GUID
@@ -43,13 +45,17 @@ class PrioritizedItemORM(Base):
     """
 
     __tablename__ = "items"
+    __table_args__ = (
+        Index("ix_items_scheduler_id_hash_created_at", "scheduler_id", "hash", "created_at"),
+        Index("ix_items_scheduler_id_priority_created_at", "scheduler_id", "priority", "created_at"),
+    )
 
     id = Column(GUID, primary_key=True)
     scheduler_id = Column(String)
     hash = Column(String)
 
     priority = Column(Integer)
-    data = Column(JSON, nullable=False)
+    data = Column(JSON().with_variant(JSONB(), "postgresql"), nullable=False)
 
     created_at = Column(
         DateTime(timezone=True),
@@ -77,4 +83,25 @@ class Queue(BaseModel):
     allow_replace: bool
     allow_updates: bool
     allow_priority_updates: bool
-    pq: List[PrioritizedItem]
+    min_priority: Optional[int]
+    max_priority: Optional[int]
+
+
+class PushStatus(str, _Enum):
+    """Outcome of pushing an item onto a priority queue."""
+
+    CREATED = "created"
+    UPDATED = "updated"
+    NOT_ALLOWED = "not_allowed"
+    QUEUE_FULL = "queue_full"
+    INVALID = "invalid"
+
+
+class PushResult(BaseModel):
+    """Representation of the outcome of pushing a single item onto a
+    priority queue, as part of a batch of items.
+    """
+
+    status: PushStatus
+    p_item: Optional[PrioritizedItem]
+    detail: Optional[str] = None
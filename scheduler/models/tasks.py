@@ -5,7 +5,8 @@ from typing import ClassVar, List, Optional
 
 import mmh3
 from pydantic import BaseModel, Field
-from sqlalchemy import JSON, Column, DateTime, Enum, String
+from sqlalchemy import JSON, Column, DateTime, Enum, Index, Integer, String, text
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.sql import func
 
 from scheduler.utils import GUID
@@ -32,9 +33,17 @@ class Task(BaseModel):
     id: uuid.UUID
     scheduler_id: str
     type: str
+
+    # The unique identifier of the object contained in the prioritized item
+    hash: Optional[str]
+
     p_item: PrioritizedItem
     status: TaskStatus
 
+    # The deadline of the lease on a popped task, when the lease expires
+    # before the task is acknowledged the task is put back on the queue.
+    lease_expires_at: Optional[datetime] = None
+
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
     modified_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
@@ -47,17 +56,38 @@ class TaskORM(Base):
     """A SQLAlchemy datastore model respresentation of a Task"""
 
     __tablename__ = "tasks"
+    __table_args__ = (
+        Index("ix_tasks_hash_created_at", "hash", "created_at"),
+        # The id is part of the indexes on created_at, so that the keyset
+        # pagination on (created_at, id) is served by the index.
+        Index("ix_tasks_created_at_id", "created_at", "id"),
+        Index("ix_tasks_scheduler_id_created_at_id", "scheduler_id", "created_at", "id"),
+        # Only tasks with a lease are indexed, so sweeping expired leases
+        # doesn't depend on the total number of tasks.
+        Index(
+            "ix_tasks_scheduler_id_lease_expires_at",
+            "scheduler_id",
+            "lease_expires_at",
+            postgresql_where=text("lease_expires_at IS NOT NULL"),
+            sqlite_where=text("lease_expires_at IS NOT NULL"),
+        ),
+    )
 
+    # NOTE: on PostgreSQL the primary key of the partitioned table is
+    # (id, created_at), see migration 0009 and TaskRetention.
     id = Column(GUID, primary_key=True)
     scheduler_id = Column(String)
     type = Column(String)
-    p_item = Column(JSON, nullable=False)
+    hash = Column(String)
+    p_item = Column(JSON().with_variant(JSONB(), "postgresql"), nullable=False)
     status = Column(
         Enum(TaskStatus),
         nullable=False,
         default=TaskStatus.PENDING,
     )
 
+    lease_expires_at = Column(DateTime(timezone=True), nullable=True)
+
     created_at = Column(
         DateTime(timezone=True),
         nullable=False,
@@ -71,6 +101,38 @@ class TaskORM(Base):
     )
 
 
+class TaskLatest(BaseModel):
+    """Summary of the most recently created task with a hash, and the number
+    of tasks that were created with that hash."""
+
+    hash: str
+    task_id: uuid.UUID
+    status: TaskStatus
+    run_count: int = 1
+
+    created_at: datetime
+    modified_at: datetime
+
+    class Config:
+        orm_mode = True
+
+
+class TaskLatestORM(Base):
+    """A SQLAlchemy datastore model respresentation of the latest task of a
+    hash. It is kept up to date on every write of a task, so looking up the
+    last run of a task doesn't depend on how often it has run."""
+
+    __tablename__ = "task_latest"
+
+    hash = Column(String, primary_key=True)
+    task_id = Column(GUID, nullable=False)
+    status = Column(Enum(TaskStatus), nullable=False)
+    run_count = Column(Integer, nullable=False, default=1)
+
+    created_at = Column(DateTime(timezone=True), nullable=False)
+    modified_at = Column(DateTime(timezone=True), nullable=False)
+
+
 class NormalizerTask(BaseModel):
     """NormalizerTask represent data needed for a Normalizer to run."""
 
@@ -1,8 +1,11 @@
 from __future__ import annotations
 
 import abc
+import datetime
 import logging
-from typing import Any, Dict, List, Optional
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
 
 import pydantic
 from scheduler import models, repositories
@@ -42,6 +45,11 @@ class PriorityQueue(abc.ABC):
         pq_store:
             A PriorityQueueStore instance that will be used to store the items
             in a persistent way.
+        space_condition:
+            A threading.Condition that is notified when items are removed
+            from the queue, used to wake up callers waiting for space.
+        pop_count:
+            The number of times items have been removed from the queue.
     """
 
     def __init__(
@@ -87,23 +95,94 @@ class PriorityQueue(abc.ABC):
         self.allow_priority_updates: bool = allow_priority_updates
         self.pq_store: repositories.stores.PriorityQueueStorer = pq_store
 
-    def pop(self, filters: Optional[List[models.Filter]] = None) -> Optional[models.PrioritizedItem]:
+        self.space_condition: threading.Condition = threading.Condition()
+        self.pop_count: int = 0
+
+    def pop(
+        self,
+        filters: Optional[List[models.Filter]] = None,
+        lease_expires_at: Optional[datetime.datetime] = None,
+    ) -> Optional[models.PrioritizedItem]:
         """Remove and return the highest priority item from the queue.
 
+        The item is removed from the queue by the pq_store in the same
+        transaction it is selected in, so we don't need to remove it
+        afterwards.
+
+        Args:
+            filters: A list of filters the item needs to match.
+            lease_expires_at: When given, the task of the item is leased until
+                this time, after which it is put back on the queue unless it
+                has been acknowledged.
+
         Raises:
             QueueEmptyError: If the queue is empty.
         """
-        if self.empty():
-            raise QueueEmptyError(f"Queue {self.pq_id} is empty.")
+        item = self.pq_store.pop(self.pq_id, filters, lease_expires_at)
 
-        item = self.pq_store.pop(self.pq_id, filters)
-        if item is None:
-            return None
+        # Only when we weren't able to pop an item we check whether the
+        # queue is empty, or that the filters didn't match any item.
+        if item is None and self.empty():
+            raise QueueEmptyError(f"Queue {self.pq_id} is empty.")
 
-        self.remove(item)
+        if item is not None:
+            self.notify_space()
 
         return item
 
+    def pop_many(
+        self,
+        n: int,
+        filters: Optional[List[models.Filter]] = None,
+        lease_expires_at: Optional[datetime.datetime] = None,
+    ) -> List[models.PrioritizedItem]:
+        """Remove and return up to `n` of the highest priority items from the
+        queue, ordered by priority.
+
+        Args:
+            n: The maximum number of items to pop.
+            filters: A list of filters the items need to match.
+            lease_expires_at: When given, the tasks of the items are leased
+                until this time.
+
+        Raises:
+            QueueEmptyError: If the queue is empty.
+        """
+        items = self.pq_store.pop_many(self.pq_id, n, filters, lease_expires_at)
+
+        if not items and self.empty():
+            raise QueueEmptyError(f"Queue {self.pq_id} is empty.")
+
+        if items:
+            self.notify_space()
+
+        return items
+
+    def requeue(self, item_id: str) -> bool:
+        """Release the lease of a popped item, and put it back on the queue
+        with its original priority.
+
+        Args:
+            item_id: The id of the popped item.
+
+        Returns:
+            True when the item was leased, False otherwise.
+        """
+        return self.pq_store.requeue(self.pq_id, item_id)
+
+    def requeue_expired(self, expired_before: datetime.datetime, limit: int) -> int:
+        """Put popped items of which the lease expired before `expired_before`
+        back on the queue with their original priority.
+
+        Args:
+            expired_before: The time before which the leases expired.
+            limit: The maximum number of leases to release.
+
+        Returns:
+            The number of released leases.
+        """
+        return self.pq_store.requeue_expired(self.pq_id, expired_before, limit)
+
     def push(self, p_item: models.PrioritizedItem) -> Optional[models.PrioritizedItem]:
         """Push an item onto the queue.
 
@@ -134,34 +213,13 @@ class PriorityQueue(abc.ABC):
         # and we might need to update that.
         item_on_queue = self.get_p_item_by_identifier(p_item)
 
-        item_changed = (
-            False if not item_on_queue or p_item.data == item_on_queue.data else True  # FIXM: checking json/dicts here
-        )
-
-        priority_changed = False if not item_on_queue or p_item.priority == item_on_queue.priority else True
+        self._check_push_allowed(p_item, item_on_queue)
 
-        allowed = False
-        if item_on_queue and self.allow_replace:
-            allowed = True
-        elif self.allow_updates and item_changed and item_on_queue:
-            allowed = True
-        elif self.allow_priority_updates and priority_changed and item_on_queue:
-            allowed = True
-        elif not item_on_queue:
-            allowed = True
-
-        if not allowed:
-            raise NotAllowedError(
-                f"[item_on_queue={item_on_queue}, item_changed={item_changed}, priority_changed={priority_changed}, "
-                f"allow_replace={self.allow_replace}, allow_updates={self.allow_updates}, "
-                f"allow_priority_updates={self.allow_priority_updates}]"
-            )
+        p_item.hash = self.create_hash(p_item)
 
         # If already on queue update the item, else create a new one
         item_db = None
         if not item_on_queue:
-            identifier = self.create_hash(p_item)
-            p_item.hash = identifier
             item_db = self.pq_store.push(self.pq_id, p_item)
         else:
             self.pq_store.update(self.pq_id, p_item)
@@ -172,6 +230,128 @@ class PriorityQueue(abc.ABC):
 
         return item_db
 
+    def push_many(self, p_items: List[models.PrioritizedItem]) -> List[models.PushResult]:
+        """Push a batch of items onto the queue.
+
+        The items are validated and checked against the items that are
+        already on the queue, by their identifier, in one go. New items are
+        created in a single batch, and items that are already on the queue
+        are updated when this is allowed by the queue.
+
+        Args:
+            p_items: The items to be pushed onto the queue.
+
+        Returns:
+            A list of PushResult objects, one for every item in `p_items`
+            in the same order, describing whether the item was pushed.
+        """
+        results: List[Optional[models.PushResult]] = [None] * len(p_items)
+
+        # Validate the items, and create their identifiers
+        identifiers: Dict[int, str] = {}
+        for i, p_item in enumerate(p_items):
+            if not isinstance(p_item, models.PrioritizedItem):
+                results[i] = models.PushResult(
+                    status=models.PushStatus.INVALID,
+                    p_item=None,
+                    detail="The item is not a PrioritizedItem",
+                )
+                continue
+
+            if not self._is_valid_item(p_item.data):
+                results[i] = models.PushResult(
+                    status=models.PushStatus.INVALID,
+                    p_item=p_item,
+                    detail=f"PrioritizedItem must be of type {self.item_type}",
+                )
+                continue
+
+            identifiers[i] = self.create_hash(p_item)
+
+        # Get the items that are already on the queue, with one lookup
+        items_on_queue: Dict[str, models.PrioritizedItem] = {}
+        for item in self.pq_store.get_items_by_hashes(self.pq_id, list(set(identifiers.values()))):
+            items_on_queue.setdefault(str(item.hash), item)
+
+        # NOTE: maxsize 0 means unlimited
+        available = None
+        if self.maxsize is not None and self.maxsize != 0:
+            available = self.maxsize - self.qsize()
+
+        seen = set()
+        created: List[models.PrioritizedItem] = []
+        updated: List[models.PrioritizedItem] = []
+        for i, identifier in identifiers.items():
+            p_item = p_items[i]
+
+            if identifier in seen:
+                results[i] = models.PushResult(
+                    status=models.PushStatus.NOT_ALLOWED,
+                    p_item=p_item,
+                    detail="Item is already part of this batch",
+                )
+                continue
+
+            seen.add(identifier)
+
+            if available is not None and available <= 0:
+                results[i] = models.PushResult(
+                    status=models.PushStatus.QUEUE_FULL,
+                    p_item=p_item,
+                    detail=f"Queue {self.pq_id} is full.",
+                )
+                continue
+
+            item_on_queue = items_on_queue.get(str(identifier))
+
+            try:
+                self._check_push_allowed(p_item, item_on_queue)
+            except NotAllowedError as exc:
+                results[i] = models.PushResult(
+                    status=models.PushStatus.NOT_ALLOWED,
+                    p_item=p_item,
+                    detail=str(exc),
+                )
+                continue
+
+            p_item.hash = identifier
+
+            if item_on_queue is None:
+                created.append(p_item)
+                results[i] = models.PushResult(status=models.PushStatus.CREATED, p_item=p_item)
+
+                if available is not None:
+                    available -= 1
+            else:
+                updated.append(p_item)
+                results[i] = models.PushResult(status=models.PushStatus.UPDATED, p_item=p_item)
+
+        if created:
+            self.pq_store.push_many(self.pq_id, created)
+
+        for p_item in updated:
+            self.pq_store.update(self.pq_id, p_item)
+
+        return [result for result in results if result is not None]
+
+    def get_items(
+        self,
+        limit: int,
+        after: Optional[Tuple[int, datetime.datetime, str]] = None,
+    ) -> List[models.PrioritizedItem]:
+        """Return a page of items on the queue, ordered by priority, without
+        removing them.
+
+        Args:
+            limit: The maximum number of items to return.
+            after: The (priority, created_at, id) of the last item of the
+                previous page, the page starts after that item.
+
+        Returns:
+            A list of at most `limit` PrioritizedItem instances.
+        """
+        return self.pq_store.get_items(self.pq_id, limit, after)
+
     def peek(self, index: int) -> Optional[models.PrioritizedItem]:
         """Return the item at index without removing it.
 
@@ -188,6 +368,48 @@ class PriorityQueue(abc.ABC):
         """
         self.pq_store.remove(self.pq_id, str(p_item.id))
 
+        self.notify_space()
+
+    def notify_space(self) -> None:
+        """Signal that items have been removed from the queue, this wakes up
+        the callers that are waiting for space on the queue."""
+        with self.space_condition:
+            self.pop_count += 1
+            self.space_condition.notify_all()
+
+    def wait_for_space(self, n: int = 1, timeout: float = 1) -> bool:
+        """Wait up to `timeout` seconds for the queue to have space for `n`
+        items. The queue is checked again every time items are removed from
+        it.
+
+        NOTE: items that are removed by another scheduler instance that
+        shares the pq_store don't wake up the waiting callers, they only
+        notice that on timeout.
+
+        Args:
+            n: The number of items that need to fit on the queue.
+            timeout: The maximum number of seconds to wait.
+
+        Returns:
+            True when the queue has space for `n` items, False on timeout.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            # NOTE: we take the pop count before checking the size, so a pop
+            # that happens in between checking and waiting isn't missed.
+            pop_count = self.pop_count
+
+            # NOTE: maxsize 0 means unlimited
+            if self.maxsize == 0 or self.maxsize - self.qsize() >= n:
+                return True
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+
+            with self.space_condition:
+                self.space_condition.wait_for(lambda: self.pop_count != pop_count, remaining)
+
     def empty(self) -> bool:
         """Return True if the queue is empty, False otherwise."""
         return self.pq_store.empty(self.pq_id)
@@ -220,17 +442,20 @@ class PriorityQueue(abc.ABC):
 
         return True
 
-    def is_item_on_queue_by_hash(self, hash: str) -> bool:
-        """Check if an item is on the queue by its hash.
+    def get_p_items_by_hashes(self, hashes: List[str]) -> List[models.PrioritizedItem]:
+        """Get the items on the queue with any of the hashes, in a single
+        lookup.
 
         Args:
-            hash: The hash of the item to be checked.
+            hashes: The hashes of the items.
 
         Returns:
-            True if the item is on the queue, False otherwise.
+            The items on the queue with one of the hashes.
         """
-        item = self.pq_store.get_item_by_hash(self.pq_id, hash)
-        return item is not None
+        if not hashes:
+            return []
+
+        return self.pq_store.get_items_by_hashes(self.pq_id, hashes)
 
     def get_p_item_by_identifier(self, p_item: models.PrioritizedItem) -> Optional[models.PrioritizedItem]:
         """Get an item from the queue by its identifier.
@@ -245,6 +470,42 @@ class PriorityQueue(abc.ABC):
         item = self.pq_store.get_item_by_hash(self.pq_id, identifier)
         return item
 
+    def _check_push_allowed(
+        self, p_item: models.PrioritizedItem, item_on_queue: Optional[models.PrioritizedItem]
+    ) -> None:
+        """Check whether an item is allowed to be pushed onto the queue, given
+        the item that is already on the queue with the same identifier.
+
+        Args:
+            p_item: The item to be pushed onto the queue.
+            item_on_queue: The item on the queue with the same identifier.
+
+        Raises:
+            NotAllowedError: If the item is not allowed to be pushed.
+        """
+        item_changed = (
+            False if not item_on_queue or p_item.data == item_on_queue.data else True  # FIXM: checking json/dicts here
+        )
+
+        priority_changed = False if not item_on_queue or p_item.priority == item_on_queue.priority else True
+
+        allowed = False
+        if item_on_queue and self.allow_replace:
+            allowed = True
+        elif self.allow_updates and item_changed and item_on_queue:
+            allowed = True
+        elif self.allow_priority_updates and priority_changed and item_on_queue:
+            allowed = True
+        elif not item_on_queue:
+            allowed = True
+
+        if not allowed:
+            raise NotAllowedError(
+                f"[item_on_queue={item_on_queue}, item_changed={item_changed}, priority_changed={priority_changed}, "
+                f"allow_replace={self.allow_replace}, allow_updates={self.allow_updates}, "
+                f"allow_priority_updates={self.allow_priority_updates}]"
+            )
+
     def _is_valid_item(self, item: Any) -> bool:
         """Validate the item to be pushed into the queue.
 
@@ -262,7 +523,13 @@ class PriorityQueue(abc.ABC):
         return True
 
     def dict(self) -> Dict[str, Any]:
-        """Return a dictionary representation of the queue."""
+        """Return a dictionary representation of the queue.
+
+        NOTE: this is a summary of the queue, and doesn't contain the items
+        on the queue. Use `get_items` to retrieve the items page by page.
+        """
+        min_priority, max_priority = self.pq_store.get_priority_range(self.pq_id)
+
         return {
             "id": self.pq_id,
             "size": self.qsize(),
@@ -271,7 +538,8 @@ class PriorityQueue(abc.ABC):
             "allow_replace": self.allow_replace,
             "allow_updates": self.allow_updates,
             "allow_priority_updates": self.allow_priority_updates,
-            "pq": self.pq_store.get_items_by_scheduler_id(self.pq_id),
+            "min_priority": min_priority,
+            "max_priority": max_priority,
         }
 
     @abc.abstractmethod
@@ -31,8 +31,9 @@ class BoefjeRanker(Ranker):
         Since we want to have a lower bound of a priority of 3, we will use
         an exponential decay function in decreasing form.
         """
-        # New tasks that have not yet run before
-        if obj.prior_tasks is None or not obj.prior_tasks:
+        # New tasks that have not yet run before, `latest` is the summary of
+        # the latest task with the same hash (models.TaskLatest).
+        if obj.latest is None:
             return 2
 
         max_priority = self.MAX_PRIORITY
@@ -43,7 +44,7 @@ class BoefjeRanker(Ranker):
         max_days = self.MAX_DAYS * (60 * 60 * 24)
 
         # Check how long since the grace period has passed
-        run_since_grace_period = ((datetime.now(timezone.utc) - obj.prior_tasks[0].modified_at) - grace_period).seconds
+        run_since_grace_period = ((datetime.now(timezone.utc) - obj.latest.modified_at) - grace_period).seconds
 
         # Makes sure that we don't have tasks that are still in the grace
         # period
@@ -0,0 +1,2 @@
+from .datastore import Journal
+from .pq_store import PriorityQueueStore
@@ -0,0 +1,152 @@
+import contextlib
+import json
+import os
+import shutil
+import threading
+from typing import Any, Dict, Iterable, Iterator, TextIO
+from urllib.parse import urlparse
+
+from ..stores import Datastore
+
+
+class Journal(Datastore):
+    """Append-only journal datastore, used to persist the state of in-memory
+    stores.
+
+    Every change to the state of a store is appended as a JSON record to the
+    journal file. Periodically the complete state of the store is written to
+    a snapshot file: the journal is rotated when the state is copied, and
+    the rotated journal is removed when the snapshot is written. On startup
+    the state is restored by loading the snapshot and replaying the rotated
+    journal and the journal on top of it, so the records should be
+    idempotent.
+
+    The dsn is of the form `memory+journal:///var/lib/kat/mula`, where the
+    path is the directory in which the snapshot and journal files are kept.
+
+    Attributes:
+        path: The directory containing the snapshot and journal files.
+        fsync: Whether to fsync the journal after every append.
+        lock: A threading.Lock that guards writing to the journal.
+    """
+
+    SCHEME = "memory+journal"
+
+    SNAPSHOT_FILE = "snapshot.ndjson"
+    JOURNAL_FILE = "journal.ndjson"
+    ROTATED_JOURNAL_FILE = "journal.ndjson.1"
+
+    def __init__(self, dsn: str, fsync: bool = False) -> None:
+        super().__init__()
+
+        parsed = urlparse(dsn)
+        if parsed.scheme != self.SCHEME or not parsed.path:
+            raise ValueError(f"Invalid journal dsn: {dsn}")
+
+        self.path: str = parsed.path
+        self.fsync: bool = fsync
+        self.lock: threading.Lock = threading.Lock()
+
+        os.makedirs(self.path, exist_ok=True)
+
+        # NOTE: the journal file is kept open for appending, and closed by
+        # `stop`.
+        self._files: contextlib.ExitStack = contextlib.ExitStack()
+        self._journal: TextIO = self._open_journal()
+
+    def _open_journal(self) -> TextIO:
+        return self._files.enter_context(open(self.journal_path, "a", encoding="utf-8"))
+
+    @classmethod
+    def is_journal_dsn(cls, dsn: str) -> bool:
+        return dsn.startswith(f"{cls.SCHEME}://")
+
+    @property
+    def snapshot_path(self) -> str:
+        return os.path.join(self.path, self.SNAPSHOT_FILE)
+
+    @property
+    def journal_path(self) -> str:
+        return os.path.join(self.path, self.JOURNAL_FILE)
+
+    @property
+    def rotated_journal_path(self) -> str:
+        return os.path.join(self.path, self.ROTATED_JOURNAL_FILE)
+
+    def append(self, record: Dict[str, Any]) -> None:
+        """Append a record to the journal."""
+        line = json.dumps(record, default=str)
+
+        with self.lock:
+            self._journal.write(line + "\n")
+            self._journal.flush()
+
+            if self.fsync:
+                os.fsync(self._journal.fileno())
+
+    def load(self) -> Iterator[Dict[str, Any]]:
+        """Yield the records of the snapshot, followed by the records of the
+        rotated journal and the journal."""
+        for path in (self.snapshot_path, self.rotated_journal_path, self.journal_path):
+            if not os.path.exists(path):
+                continue
+
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+
+                    try:
+                        yield json.loads(line)
+                    except json.JSONDecodeError:
+                        # A partially written record at the end of the
+                        # journal, e.g. after a crash.
+                        self.logger.warning("Skipping invalid record in %s [path=%s]", path, path)
+
+    def rotate(self) -> None:
+        """Start a new journal. The records appended so far are kept in the
+        rotated journal, until a snapshot that includes them is written."""
+        with self.lock:
+            self._files.close()
+
+            if os.path.exists(self.rotated_journal_path):
+                # NOTE: the previous snapshot wasn't written, e.g. because
+                # of a crash, so its rotated journal is still needed.
+                with open(self.journal_path, encoding="utf-8") as src, open(
+                    self.rotated_journal_path, "a", encoding="utf-8"
+                ) as dst:
+                    shutil.copyfileobj(src, dst)
+
+                os.remove(self.journal_path)
+            else:
+                os.replace(self.journal_path, self.rotated_journal_path)
+
+            self._journal = self._open_journal()
+
+    def snapshot(self, records: Iterable[Dict[str, Any]]) -> None:
+        """Write the complete state, as it was when the journal was rotated,
+        to the snapshot file, and remove the rotated journal. The snapshot is
+        written to a temporary file first, and replaced atomically.
+
+        NOTE: this doesn't block appending to the journal, only one snapshot
+        should be written at a time.
+        """
+        tmp_path = f"{self.snapshot_path}.tmp"
+
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for record in records:
+                f.write(json.dumps(record, default=str) + "\n")
+
+            f.flush()
+            os.fsync(f.fileno())
+
+        os.replace(tmp_path, self.snapshot_path)
+
+        if os.path.exists(self.rotated_journal_path):
+            os.remove(self.rotated_journal_path)
+
+    def stop(self) -> None:
+        """Close the journal file."""
+        with self.lock:
+            self._files.close()
@@ -0,0 +1,510 @@
+import contextlib
+import datetime
+import heapq
+import itertools
+import operator
+import threading
+from typing import Any, Callable, Dict, Iterator, List, Optional, Set, Tuple
+
+from scheduler import models, utils
+
+from ..stores import PriorityQueueStorer, TaskStorer
+from .datastore import Journal
+
+
+_OPERATORS: Dict[str, Callable[[Any, Any], bool]] = {
+    "eq": operator.eq,
+    "ne": operator.ne,
+    "lt": operator.lt,
+    "le": operator.le,
+    "gt": operator.gt,
+    "ge": operator.ge,
+}
+
+
+def _cast(value: Any, like: Any) -> Any:
+    """Cast a value from the data of an item to the type of the value of a
+    filter. Returns None when the value is missing or can't be cast."""
+    if isinstance(like, list):
+        like = like[0] if like else ""
+
+    if value is None:
+        return None
+
+    try:
+        # NOTE: bool is a subclass of int, so it needs to be checked first
+        if isinstance(like, bool):
+            return value if isinstance(value, bool) else None
+        if isinstance(like, int):
+            return int(value)
+        if isinstance(like, float):
+            return float(value)
+    except (TypeError, ValueError):
+        return None
+
+    return str(value)
+
+
+class _Queue:
+    """The state of a single priority queue.
+
+    Attributes:
+        heap:
+            A binary heap of entries `[priority, created_at, seq, item_id]`,
+            where seq is a tie-breaker that keeps the order of insertion.
+            Entries of items that are removed or re-prioritized are
+            invalidated (item_id set to None) and skipped when they reach the
+            top of the heap.
+        entries: A dict of the valid heap entry per item id.
+        items: A dict of the items on the queue per item id.
+        hashes: A dict of the item ids per item hash.
+    """
+
+    def __init__(self) -> None:
+        self.heap: List[List[Any]] = []
+        self.entries: Dict[str, List[Any]] = {}
+        self.items: Dict[str, models.PrioritizedItem] = {}
+        self.hashes: Dict[str, Set[str]] = {}
+
+
+class PriorityQueueStore(PriorityQueueStorer):
+    """In-memory datastore for PriorityQueue, intended for single node
+    deployments.
+
+    Every queue is kept in a binary heap with indexes on item id and hash,
+    which makes push and pop O(log n), and qsize and get_item_by_hash O(1).
+    Changes are written to an append-only journal, and the complete state
+    is written to a snapshot every `snapshot_interval` changes, so the
+    queues are restored on startup without scanning a database. The state
+    is copied while holding the lock, and the snapshot is written without
+    holding it.
+
+    Attributes:
+        journal: The Journal used to persist the state of the queues.
+        task_store:
+            The TaskStorer used to set the status of the tasks of popped
+            items to DISPATCHED.
+        snapshot_interval:
+            The number of changes after which a snapshot is written.
+        queues: A dict of the queue state per scheduler id.
+        lock: A threading.RLock that guards the state of the queues.
+        snapshot_lock:
+            A threading.Lock that is held while a snapshot is written.
+    """
+
+    def __init__(
+        self,
+        journal: Journal,
+        task_store: Optional[TaskStorer] = None,
+        snapshot_interval: int = 10000,
+    ) -> None:
+        super().__init__()
+
+        self.journal: Journal = journal
+        self.task_store: Optional[TaskStorer] = task_store
+        self.snapshot_interval: int = snapshot_interval
+
+        self.queues: Dict[str, _Queue] = {}
+        self.lock: threading.RLock = threading.RLock()
+        self.snapshot_lock: threading.Lock = threading.Lock()
+
+        self._seq: Iterator[int] = itertools.count()
+        self._changes: int = 0
+
+        self._restore()
+
+    def pop(
+        self,
+        scheduler_id: str,
+        filters: Optional[List[models.Filter]] = None,
+        lease_expires_at: Optional[datetime.datetime] = None,
+    ) -> Optional[models.PrioritizedItem]:
+        """Remove and return the highest priority item from the queue."""
+        items = self.pop_many(scheduler_id, 1, filters, lease_expires_at)
+        if not items:
+            return None
+
+        return items[0]
+
+    def pop_many(
+        self,
+        scheduler_id: str,
+        n: int,
+        filters: Optional[List[models.Filter]] = None,
+        lease_expires_at: Optional[datetime.datetime] = None,
+    ) -> List[models.PrioritizedItem]:
+        """Remove and return up to `n` of the highest priority items from the
+        queue, ordered by priority.
+
+        The entries are popped from the heap in priority order until `n`
+        (matching) items are found. With filters, the entries of items that
+        don't match are pushed back on the heap afterwards.
+        """
+        with self._changing():
+            q = self.queues.get(scheduler_id)
+            if q is None:
+                return []
+
+            items: List[models.PrioritizedItem] = []
+            skipped: List[List[Any]] = []
+            try:
+                while q.heap and len(items) < n:
+                    entry = heapq.heappop(q.heap)
+                    if entry[-1] is None:
+                        continue
+
+                    # NOTE: the entry is set aside until the item is known to
+                    # match, so it isn't lost when a filter is invalid.
+                    skipped.append(entry)
+                    item = q.items[entry[-1]]
+                    if filters is not None and not self._match(item, filters):
+                        continue
+
+                    skipped.pop()
+                    items.append(item)
+            finally:
+                # Put the entries of the items that didn't match back on
+                # the heap, also when a filter is invalid.
+                for entry in skipped:
+                    heapq.heappush(q.heap, entry)
+
+            for item in items:
+                self._remove_item(scheduler_id, q, str(item.id))
+
+        self._set_dispatched(items, lease_expires_at)
+
+        return [item.copy(deep=True) for item in items]
+
+    def requeue(self, scheduler_id: str, item_id: str) -> bool:
+        """Release the lease of the task of a popped item, and put the item
+        back on the queue.
+
+        Returns:
+            True when the task held a lease, False otherwise.
+        """
+        if self.task_store is None:
+            return False
+
+        # NOTE: the id of the task is the same as the id of the prioritized
+        # item.
+        task = self.task_store.get_task_by_id(str(item_id))
+        if task is None or task.scheduler_id != scheduler_id:
+            return False
+
+        return self._requeue(task)
+
+    def requeue_expired(self, scheduler_id: str, expired_before: datetime.datetime, limit: int) -> int:
+        """Release at most `limit` leases of popped items that expired before
+        `expired_before`, and put the items back on the queue.
+
+        Returns:
+            The number of released leases.
+        """
+        if self.task_store is None:
+            return 0
+
+        tasks = self.task_store.get_expired_tasks(scheduler_id, expired_before, limit)
+        for task in tasks:
+            self._requeue(task, expired_before)
+
+        return len(tasks)
+
+    def push(self, scheduler_id: str, item: models.PrioritizedItem) -> Optional[models.PrioritizedItem]:
+        item = models.PrioritizedItem(**item.dict())
+
+        with self._changing():
+            self._add_item(item)
+            self._record({"op": "push", "item": item.dict()})
+
+        return item.copy(deep=True)
+
+    def push_many(self, scheduler_id: str, items: List[models.PrioritizedItem]) -> List[models.PrioritizedItem]:
+        items = [models.PrioritizedItem(**item.dict()) for item in items]
+
+        with self._changing():
+            for item in items:
+                self._add_item(item)
+                self._record({"op": "push", "item": item.dict()})
+
+        return [item.copy(deep=True) for item in items]
+
+    def peek(self, scheduler_id: str, index: int) -> Optional[models.PrioritizedItem]:
+        with self.lock:
+            q = self.queues.get(scheduler_id)
+            if q is None or index >= len(q.entries):
+                return None
+
+            entries = heapq.nsmallest(index + 1, q.entries.values())
+
+            return q.items[entries[index][-1]].copy(deep=True)
+
+    def update(self, scheduler_id: str, item: models.PrioritizedItem) -> None:
+        with self._changing():
+            q = self.queues.get(scheduler_id)
+            if q is None or str(item.id) not in q.items:
+                return
+
+            item = models.PrioritizedItem(**item.dict())
+            self._add_item(item)
+            self._record({"op": "push", "item": item.dict()})
+
+    def remove(self, scheduler_id: str, item_id: str) -> None:
+        with self._changing():
+            q = self.queues.get(scheduler_id)
+            if q is None or str(item_id) not in q.items:
+                return
+
+            self._remove_item(scheduler_id, q, str(item_id))
+
+    def get(self, scheduler_id: str, item_id: str) -> Optional[models.PrioritizedItem]:
+        with self.lock:
+            q = self.queues.get(scheduler_id)
+            if q is None or str(item_id) not in q.items:
+                return None
+
+            return q.items[str(item_id)].copy(deep=True)
+
+    def empty(self, scheduler_id: str) -> bool:
+        return self.qsize(scheduler_id) == 0
+
+    def qsize(self, scheduler_id: str) -> int:
+        with self.lock:
+            q = self.queues.get(scheduler_id)
+            if q is None:
+                return 0
+
+            return len(q.items)
+
+    def get_item_by_hash(self, scheduler_id: str, item_hash: str) -> Optional[models.PrioritizedItem]:
+        items = self.get_items_by_hashes(scheduler_id, [item_hash])
+        if not items:
+            return None
+
+        return items[0]
+
+    def get_items_by_hashes(self, scheduler_id: str, item_hashes: List[str]) -> List[models.PrioritizedItem]:
+        with self.lock:
+            q = self.queues.get(scheduler_id)
+            if q is None:
+                return []
+
+            items = [
+                q.items[item_id]
+                for item_hash in set(str(item_hash) for item_hash in item_hashes)
+                for item_id in q.hashes.get(item_hash, set())
+            ]
+
+            items.sort(key=lambda item: item.created_at.timestamp(), reverse=True)
+
+            return [item.copy(deep=True) for item in items]
+
+    def get_items_by_scheduler_id(self, scheduler_id: str) -> List[models.PrioritizedItem]:
+        with self.lock:
+            q = self.queues.get(scheduler_id)
+            if q is None:
+                return []
+
+            return [item.copy(deep=True) for item in q.items.values()]
+
+    def get_items(
+        self,
+        scheduler_id: str,
+        limit: int,
+        after: Optional[Tuple[int, datetime.datetime, str]] = None,
+    ) -> List[models.PrioritizedItem]:
+        with self.lock:
+            q = self.queues.get(scheduler_id)
+            if q is None:
+                return []
+
+            keys = ((entry[0], entry[1], entry[-1]) for entry in q.entries.values())
+            if after is not None:
+                cursor = (after[0], after[1].timestamp(), str(after[2]))
+                keys = (key for key in keys if key > cursor)
+
+            return [q.items[key[-1]].copy(deep=True) for key in heapq.nsmallest(limit, keys)]
+
+    def get_priority_range(self, scheduler_id: str) -> Tuple[Optional[int], Optional[int]]:
+        with self.lock:
+            q = self.queues.get(scheduler_id)
+            if q is None or not q.entries:
+                return None, None
+
+            priorities = [entry[0] for entry in q.entries.values()]
+
+            return min(priorities), max(priorities)
+
+    def snapshot(self) -> None:
+        """Write the state of all queues to a snapshot in the journal. The
+        items are copied and the journal is rotated while holding the lock,
+        the snapshot is written without holding it."""
+        with self.snapshot_lock:
+            # NOTE: the items on the queues are never modified, only
+            # replaced, so copying the references is enough.
+            with self.lock:
+                items = [item for q in self.queues.values() for item in q.items.values()]
+                self.journal.rotate()
+                self._changes = 0
+
+            self.journal.snapshot({"op": "push", "item": item.dict()} for item in items)
+
+    def stop(self) -> None:
+        """Close the journal."""
+        self.journal.stop()
+
+    @contextlib.contextmanager
+    def _changing(self) -> Iterator[None]:
+        """Hold the lock while changing the state of the queues, and write a
+        snapshot after releasing it, when one is due and no snapshot is
+        being written already."""
+        with self.lock:
+            yield
+
+        if self._changes >= self.snapshot_interval and not self.snapshot_lock.locked():
+            self.snapshot()
+
+    def _add_item(self, item: models.PrioritizedItem) -> None:
+        """Add an item to the heap and indexes of its queue, an item with the
+        same id that is already on the queue is replaced."""
+        scheduler_id = str(item.scheduler_id)
+        item_id = str(item.id)
+
+        q = self.queues.setdefault(scheduler_id, _Queue())
+        if item_id in q.items:
+            self._remove_item(scheduler_id, q, item_id, record=False)
+
+        priority = item.priority if item.priority is not None else 0
+        entry = [priority, item.created_at.timestamp(), next(self._seq), item_id]
+        heapq.heappush(q.heap, entry)
+
+        q.entries[item_id] = entry
+        q.items[item_id] = item
+        if item.hash is not None:
+            q.hashes.setdefault(str(item.hash), set()).add(item_id)
+
+    def _remove_item(self, scheduler_id: str, q: _Queue, item_id: str, record: bool = True) -> None:
+        """Remove an item from the indexes of its queue, and invalidate its
+        heap entry."""
+        entry = q.entries.pop(item_id, None)
+        if entry is not None:
+            entry[-1] = None
+
+        item = q.items.pop(item_id, None)
+        if item is not None and item.hash is not None:
+            ids = q.hashes.get(str(item.hash), set())
+            ids.discard(item_id)
+            if not ids:
+                q.hashes.pop(str(item.hash), None)
+
+        # Compact the heap when most of its entries are invalidated
+        if len(q.heap) > 2 * len(q.entries) + 64:
+            q.heap = [e for e in q.heap if e[-1] is not None]
+            heapq.heapify(q.heap)
+
+        if record:
+            self._record({"op": "remove", "scheduler_id": scheduler_id, "item_id": item_id})
+
+    def _match(self, item: models.PrioritizedItem, filters: List[models.Filter]) -> bool:
+        """Check whether the data of an item matches all filters, with the
+        same semantics as the filters of the sqlalchemy PriorityQueueStore:
+        the value in the data is cast to the type of the value of the filter,
+        and a missing value never matches."""
+        for f in filters:
+            value: Any
+            if isinstance(f.value, list):
+                value = [v.isoformat() if isinstance(v, datetime.date) else v for v in f.value]
+            else:
+                value = f.value.isoformat() if isinstance(f.value, datetime.date) else f.value
+
+            if f.operator in ("in_", "notin_") and not isinstance(value, list):
+                raise ValueError(f"Filter operator {f.operator} requires a list of values")
+
+            if f.operator not in ("in_", "notin_") and isinstance(value, list):
+                raise ValueError(f"Filter operator {f.operator} requires a single value")
+
+            data_value = _cast(utils.deep_get(item.data, f.get_field()), value)
+            if data_value is None:
+                return False
+
+            if isinstance(value, list):
+                matched = (data_value in value) == (f.operator == "in_")
+            elif f.operator in _OPERATORS:
+                matched = _OPERATORS[f.operator](data_value, value)
+            else:
+                raise ValueError(f"Unknown filter operator: {f.operator}")
+
+            if not matched:
+                return False
+
+        return True
+
+    def _set_dispatched(
+        self, items: List[models.PrioritizedItem], lease_expires_at: Optional[datetime.datetime] = None
+    ) -> None:
+        """Set the status of the tasks of the popped items to DISPATCHED, and
+        lease them until `lease_expires_at`.
+
+        NOTE: unlike the sqlalchemy PriorityQueueStore this isn't done in the
+        same transaction as removing the items from the queue.
+        """
+        if self.task_store is None or not items:
+            return
+
+        # NOTE: the id of the task is the same as the id of the prioritized
+        # item.
+        self.task_store.set_status(
+            [str(item.id) for item in items],
+            models.TaskStatus.DISPATCHED,
+            lease_expires_at,
+        )
+
+    def _requeue(self, task: models.Task, expired_before: Optional[datetime.datetime] = None) -> bool:
+        """Release the lease of a task, and put its prioritized item back on
+        the queue with its original priority. When an item with the same hash
+        has been pushed onto the queue in the meantime the task is set to
+        FAILED instead, since that item supersedes it.
+
+        Returns:
+            True when the lease was released, False otherwise.
+        """
+        if self.task_store is None:
+            return False
+
+        item = models.PrioritizedItem(**task.p_item.dict())
+
+        with self._changing():
+            superseded = item.hash is not None and bool(self.get_items_by_hashes(task.scheduler_id, [item.hash]))
+            status = models.TaskStatus.FAILED if superseded else models.TaskStatus.QUEUED
+
+            if self.task_store.release_lease(str(task.id), status, expired_before) is None:
+                return False
+
+            if not superseded:
+                self._add_item(item)
+                self._record({"op": "push", "item": item.dict()})
+
+        return True
+
+    def _record(self, record: Dict[str, Any]) -> None:
+        """Append a change to the journal. A snapshot is written every
+        `snapshot_interval` changes, see `_changing`."""
+        self.journal.append(record)
+        self._changes += 1
+
+    def _restore(self) -> None:
+        """Restore the state of the queues from the snapshot and journal."""
+        with self.lock:
+            for record in self.journal.load():
+                if record.get("op") == "push":
+                    self._add_item(models.PrioritizedItem.parse_obj(record["item"]))
+                elif record.get("op") == "remove":
+                    q = self.queues.get(record["scheduler_id"])
+                    if q is not None:
+                        self._remove_item(record["scheduler_id"], q, record["item_id"], record=False)
+
+            self.logger.info(
+                "Restored %d items on %d queues from journal [path=%s]",
+                sum(len(q.items) for q in self.queues.values()),
+                len(self.queues),
+                self.journal.path,
+            )
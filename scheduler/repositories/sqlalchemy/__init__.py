@@ -1,3 +1,5 @@
 from .datastore import SQLAlchemy
+from .notifications import PushListener
 from .pq_store import PriorityQueueStore
+from .retention import TaskRetention
 from .task_store import TaskStore
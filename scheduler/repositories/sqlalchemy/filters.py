@@ -0,0 +1,85 @@
+import datetime
+from typing import Any, List
+
+from sqlalchemy.orm import Query
+from sqlalchemy.sql.elements import ColumnElement
+
+from scheduler import models
+
+
+def _typed(element: Any, value: Any) -> ColumnElement:
+    """Extract the value at a JSON path with the type of the value it is
+    compared to."""
+    if isinstance(value, list):
+        value = value[0] if value else ""
+
+    # NOTE: bool is a subclass of int, so it needs to be checked first
+    if isinstance(value, bool):
+        return element.as_boolean()
+
+    if isinstance(value, int):
+        return element.as_integer()
+
+    if isinstance(value, float):
+        return element.as_float()
+
+    return element.as_string()
+
+
+def filter_expression(column: Any, f: models.Filter) -> ColumnElement:
+    """Create a SQL expression for a filter on a JSON column.
+
+    The field of the filter is used as the path into the JSON column, and
+    the extracted value is cast to the type of the value of the filter, so
+    numeric comparisons are done on numbers and not on strings.
+
+    Args:
+        column: The JSON column to filter on.
+        f: The filter to apply.
+
+    Returns:
+        A SQL expression that can be passed to `Query.filter`.
+
+    Raises:
+        ValueError: If the operator is unknown, or the value of the filter
+            doesn't fit the operator.
+    """
+    value = f.value
+    if isinstance(value, datetime.date):
+        value = value.isoformat()
+    elif isinstance(value, list):
+        value = [v.isoformat() if isinstance(v, datetime.date) else v for v in value]
+
+    element = _typed(column[f.get_field()], value)
+
+    if f.operator in ("in_", "notin_"):
+        if not isinstance(value, list):
+            raise ValueError(f"Filter operator {f.operator} requires a list of values")
+
+        return element.in_(value) if f.operator == "in_" else element.not_in(value)
+
+    if isinstance(value, list):
+        raise ValueError(f"Filter operator {f.operator} requires a single value")
+
+    if f.operator == "eq":
+        return element == value
+    if f.operator == "ne":
+        return element != value
+    if f.operator == "lt":
+        return element < value
+    if f.operator == "le":
+        return element <= value
+    if f.operator == "gt":
+        return element > value
+    if f.operator == "ge":
+        return element >= value
+
+    raise ValueError(f"Unknown filter operator: {f.operator}")
+
+
+def apply_filters(query: Query, column: Any, filters: List[models.Filter]) -> Query:
+    """Apply a list of filters on a JSON column to a query."""
+    for f in filters:
+        query = query.filter(filter_expression(column, f))
+
+    return query
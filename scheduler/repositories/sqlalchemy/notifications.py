@@ -0,0 +1,92 @@
+import logging
+import select
+from typing import Any, Callable, Optional
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from .datastore import SQLAlchemy
+
+# Channel on which PostgreSQL notifications are sent when items are pushed
+# onto a queue, the payload is the id of the scheduler.
+PUSH_CHANNEL = "scheduler_items_pushed"
+
+
+def notify_push(session: Session, scheduler_id: str) -> None:
+    """Send a notification that items are pushed onto the queue of the
+    scheduler. The notification is delivered when the transaction of the
+    session is committed, and only supported on PostgreSQL."""
+    session.execute(
+        text("SELECT pg_notify(:channel, :payload)"),
+        {"channel": PUSH_CHANNEL, "payload": scheduler_id},
+    )
+
+
+class PushListener:
+    """Listen for PostgreSQL notifications of items that are pushed onto a
+    queue, e.g. by other scheduler instances that share the database.
+
+    Attributes:
+        logger: The logger for the class.
+        datastore: The SQLAlchemy datastore to listen on.
+        callback: A function that is called with the scheduler id of the
+            queue items have been pushed on.
+        timeout: The number of seconds `listen` waits for notifications.
+    """
+
+    def __init__(self, datastore: SQLAlchemy, callback: Callable[[str], Any], timeout: float = 1.0) -> None:
+        self.logger: logging.Logger = logging.getLogger(__name__)
+        self.datastore: SQLAlchemy = datastore
+        self.callback: Callable[[str], Any] = callback
+        self.timeout: float = timeout
+
+        self.connection: Optional[Any] = None
+
+    def connect(self) -> Any:
+        """Open a dedicated connection, outside of the connection pool, and
+        subscribe to the channel.
+
+        Returns:
+            The DBAPI connection.
+        """
+        engine = self.datastore.engine
+        if engine is None:
+            raise RuntimeError("Datastore has no engine")
+
+        raw_connection = engine.raw_connection()
+        raw_connection.detach()
+
+        connection = raw_connection.connection
+        connection.autocommit = True
+
+        with connection.cursor() as cursor:
+            cursor.execute(f"LISTEN {PUSH_CHANNEL}")
+
+        self.connection = connection
+
+        return connection
+
+    def close(self) -> None:
+        if self.connection is not None:
+            self.connection.close()
+
+        self.connection = None
+
+    def listen(self) -> None:
+        """Wait up to `timeout` seconds for notifications, and call the
+        callback for every notification received."""
+        try:
+            connection = self.connection if self.connection is not None else self.connect()
+
+            if select.select([connection], [], [], self.timeout) == ([], [], []):
+                return
+
+            connection.poll()
+        except Exception as exc:
+            self.logger.warning("Failed to listen for notifications, reconnecting [exc=%s]", exc)
+            self.close()
+            return
+
+        while connection.notifies:
+            notification = connection.notifies.pop(0)
+            self.callback(notification.payload)
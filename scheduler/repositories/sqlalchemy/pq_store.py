@@ -1,9 +1,18 @@
-from typing import List, Optional
+import contextlib
+import datetime
+import threading
+import time
+from typing import Any, ContextManager, Dict, List, Optional, Tuple
+
+from sqlalchemy import and_, func, or_, orm
 
 from scheduler import models
 
 from ..stores import PriorityQueueStorer
 from .datastore import SQLAlchemy
+from .filters import apply_filters
+from .notifications import notify_push
+from .task_store import LEASED_STATUSES, set_latest_status
 
 
 class PriorityQueueStore(PriorityQueueStorer):
@@ -13,36 +22,271 @@ class PriorityQueueStore(PriorityQueueStorer):
 
     Attributes:
         datastore: SQAlchemy satastore to use for the database connection.
+        pop_lock:
+            A context manager that guards `pop_many`. PostgreSQL locks the popped
+            row with `FOR UPDATE SKIP LOCKED`, for dialects that don't
+            support row-level locking (e.g. SQLite) we serialize pops
+            within the process with a threading.Lock.
+        size_reconcile_interval:
+            Interval in seconds after which the size counter of a queue is
+            reconciled with the number of items in the database.
+        sizes:
+            A dict with the number of items per queue, keyed by scheduler id.
+            The counters are adjusted after every committed push, pop and
+            remove, so `qsize` and `empty` don't need to count the rows.
+        sizes_reconciled_at:
+            A dict with the time the size counter of a queue was last
+            reconciled with the database, keyed by scheduler id.
+        sizes_pending:
+            A dict with the adjustments of the size counter of a queue while
+            it is being counted, keyed by scheduler id.
+        sizes_lock:
+            A threading.Lock that guards the size counters.
+        notify:
+            Whether to send a PostgreSQL notification when items are pushed,
+            so other scheduler instances can wake up callers waiting to pop.
     """
 
-    def __init__(self, datastore: SQLAlchemy) -> None:
+    def __init__(self, datastore: SQLAlchemy, size_reconcile_interval: float = 60) -> None:
         super().__init__()
 
         self.datastore = datastore
 
-    def pop(self, scheduler_id: str, filters: Optional[List[models.Filter]] = None) -> Optional[models.PrioritizedItem]:
-        with self.datastore.session.begin() as session:
+        self.size_reconcile_interval: float = size_reconcile_interval
+        self.sizes: Dict[str, int] = {}
+        self.sizes_reconciled_at: Dict[str, float] = {}
+        self.sizes_pending: Dict[str, int] = {}
+        self.sizes_lock: threading.Lock = threading.Lock()
+
+        engine = self.datastore.engine
+        if engine is None:
+            raise RuntimeError("Datastore has no engine")
+
+        self.pop_lock: ContextManager[Any] = threading.Lock()
+        if engine.dialect.name == "postgresql":
+            self.pop_lock = contextlib.nullcontext()
+
+        self.notify: bool = engine.dialect.name == "postgresql"
+
+    def pop(
+        self,
+        scheduler_id: str,
+        filters: Optional[List[models.Filter]] = None,
+        lease_expires_at: Optional[datetime.datetime] = None,
+    ) -> Optional[models.PrioritizedItem]:
+        """Remove and return the highest priority item from the queue."""
+        items = self.pop_many(scheduler_id, 1, filters, lease_expires_at)
+        if not items:
+            return None
+
+        return items[0]
+
+    def pop_many(
+        self,
+        scheduler_id: str,
+        n: int,
+        filters: Optional[List[models.Filter]] = None,
+        lease_expires_at: Optional[datetime.datetime] = None,
+    ) -> List[models.PrioritizedItem]:
+        """Remove and return up to `n` of the highest priority items from the
+        queue, ordered by priority.
+
+        Selecting the items, removing them from the queue and setting the
+        status of their tasks to DISPATCHED is done in a single transaction,
+        so concurrent runners will never be dispatched the same item. When
+        `lease_expires_at` is given the tasks are leased until that time, see
+        `requeue_expired`.
+        """
+        with self.pop_lock, self.datastore.session.begin() as session:
             query = session.query(models.PrioritizedItemORM).filter(
                 models.PrioritizedItemORM.scheduler_id == scheduler_id
             )
 
             if filters is not None:
-                for f in filters:
-                    query = query.filter(models.PrioritizedItemORM.data[f.get_field()].as_string() == f.value)
+                query = apply_filters(query, models.PrioritizedItemORM.data, filters)
 
-            item_orm = query.first()
+            items_orm = (
+                query.order_by(models.PrioritizedItemORM.priority.asc())
+                .order_by(models.PrioritizedItemORM.created_at.asc())
+                .limit(n)
+                .with_for_update(skip_locked=True)
+                .all()
+            )
 
-            if item_orm is None:
-                return None
+            if not items_orm:
+                return []
 
-            return models.PrioritizedItem.from_orm(item_orm)
+            items = [models.PrioritizedItem.from_orm(item_orm) for item_orm in items_orm]
+            item_ids = [item_orm.id for item_orm in items_orm]
+
+            (
+                session.query(models.PrioritizedItemORM)
+                .filter(models.PrioritizedItemORM.id.in_(item_ids))
+                .delete(synchronize_session=False)
+            )
+
+            # NOTE: the id of the task is the same as the id of the
+            # prioritized item.
+            (
+                session.query(models.TaskORM)
+                .filter(models.TaskORM.id.in_(item_ids))
+                .update(
+                    {"status": models.TaskStatus.DISPATCHED, "lease_expires_at": lease_expires_at},
+                    synchronize_session=False,
+                )
+            )
+            set_latest_status(session, item_ids, models.TaskStatus.DISPATCHED)
+
+        self._adjust_size(scheduler_id, -len(items))
+
+        return items
+
+    def requeue(self, scheduler_id: str, item_id: str) -> bool:
+        """Release the lease of the task of a popped item, and put the item
+        back on the queue.
+
+        Returns:
+            True when the task held a lease, False otherwise.
+        """
+        with self.pop_lock, self.datastore.session.begin() as session:
+            # NOTE: the id of the task is the same as the id of the
+            # prioritized item.
+            task_orm = (
+                session.query(models.TaskORM)
+                .filter(models.TaskORM.id == item_id)
+                .filter(models.TaskORM.scheduler_id == scheduler_id)
+                .filter(models.TaskORM.lease_expires_at.isnot(None))
+                .filter(models.TaskORM.status.in_(LEASED_STATUSES))
+                .with_for_update()
+                .first()
+            )
+
+            if task_orm is None:
+                return False
+
+            requeued = self._requeue(session, scheduler_id, [task_orm])
+
+        self._adjust_size(scheduler_id, len(requeued))
+
+        return True
+
+    def requeue_expired(self, scheduler_id: str, expired_before: datetime.datetime, limit: int) -> int:
+        """Release at most `limit` leases of popped items that expired before
+        `expired_before`, and put the items back on the queue.
+
+        The expired leases are looked up by the partial index on the lease
+        deadline of the tasks, so this doesn't scan the tasks without a
+        lease.
+
+        Returns:
+            The number of released leases.
+        """
+        with self.pop_lock, self.datastore.session.begin() as session:
+            tasks_orm = (
+                session.query(models.TaskORM)
+                .filter(models.TaskORM.scheduler_id == scheduler_id)
+                .filter(models.TaskORM.lease_expires_at.isnot(None))
+                .filter(models.TaskORM.lease_expires_at < expired_before)
+                .filter(models.TaskORM.status.in_(LEASED_STATUSES))
+                .order_by(models.TaskORM.lease_expires_at.asc())
+                .limit(limit)
+                .with_for_update(skip_locked=True)
+                .all()
+            )
+
+            if not tasks_orm:
+                return 0
+
+            requeued = self._requeue(session, scheduler_id, tasks_orm)
+
+        self._adjust_size(scheduler_id, len(requeued))
+
+        return len(tasks_orm)
+
+    def _requeue(
+        self, session: orm.Session, scheduler_id: str, tasks_orm: List[models.TaskORM]
+    ) -> List[models.PrioritizedItem]:
+        """Put the prioritized items of leased tasks back on the queue with
+        their original priority, and set the tasks to QUEUED. When an item
+        with the same hash has been pushed onto the queue in the meantime the
+        task is set to FAILED instead, since that item supersedes it.
+
+        Returns:
+            The items that were put back on the queue.
+        """
+        items = [models.Task.from_orm(task_orm).p_item for task_orm in tasks_orm]
+
+        hashes = [item.hash for item in items if item.hash is not None]
+        queued = set()
+        if hashes:
+            queued = {
+                item_hash
+                for (item_hash,) in session.query(models.PrioritizedItemORM.hash)
+                .filter(models.PrioritizedItemORM.scheduler_id == scheduler_id)
+                .filter(models.PrioritizedItemORM.hash.in_(hashes))
+                .all()
+            }
+
+        requeued: List[models.PrioritizedItem] = []
+        superseded: List[str] = []
+        for task_orm, item in zip(tasks_orm, items):
+            task_orm.lease_expires_at = None
+
+            if item.hash is not None and item.hash in queued:
+                task_orm.status = models.TaskStatus.FAILED
+                superseded.append(str(task_orm.id))
+                continue
+
+            task_orm.status = models.TaskStatus.QUEUED
+            queued.add(item.hash)
+            requeued.append(item)
+
+        set_latest_status(session, superseded, models.TaskStatus.FAILED)
+        set_latest_status(session, [str(item.id) for item in requeued], models.TaskStatus.QUEUED)
+
+        if requeued:
+            session.execute(
+                models.PrioritizedItemORM.__table__.insert(),
+                [item.dict() for item in requeued],
+            )
+
+            if self.notify:
+                notify_push(session, scheduler_id)
+
+        return requeued
 
     def push(self, scheduler_id: str, item: models.PrioritizedItem) -> Optional[models.PrioritizedItem]:
         with self.datastore.session.begin() as session:
             item_orm = models.PrioritizedItemORM(**item.dict())
             session.add(item_orm)
 
-            return models.PrioritizedItem.from_orm(item_orm)
+            if self.notify:
+                notify_push(session, scheduler_id)
+
+            created_item = models.PrioritizedItem.from_orm(item_orm)
+
+        self._adjust_size(created_item.scheduler_id, 1)
+
+        return created_item
+
+    def push_many(self, scheduler_id: str, items: List[models.PrioritizedItem]) -> List[models.PrioritizedItem]:
+        """Push a batch of items onto the queue with a multi-row insert."""
+        if not items:
+            return []
+
+        with self.datastore.session.begin() as session:
+            session.execute(
+                models.PrioritizedItemORM.__table__.insert(),
+                [item.dict() for item in items],
+            )
+
+            if self.notify:
+                notify_push(session, scheduler_id)
+
+        for item in items:
+            self._adjust_size(item.scheduler_id, 1)
+
+        return items
 
     def peek(self, scheduler_id: str, index: int) -> Optional[models.PrioritizedItem]:
         with self.datastore.session.begin() as session:
@@ -71,13 +315,15 @@ class PriorityQueueStore(PriorityQueueStorer):
 
     def remove(self, scheduler_id: str, item_id: str) -> None:
         with self.datastore.session.begin() as session:
-            (
+            deleted = (
                 session.query(models.PrioritizedItemORM)
                 .filter(models.PrioritizedItemORM.scheduler_id == scheduler_id)
                 .filter(models.PrioritizedItemORM.id == item_id)
                 .delete()
             )
 
+        self._adjust_size(scheduler_id, -deleted)
+
     def get(self, scheduler_id, item_id: str) -> Optional[models.PrioritizedItem]:
         with self.datastore.session.begin() as session:
             item_orm = (
@@ -93,15 +339,42 @@ class PriorityQueueStore(PriorityQueueStorer):
             return models.PrioritizedItem.from_orm(item_orm)
 
     def empty(self, scheduler_id: str) -> bool:
-        with self.datastore.session.begin() as session:
-            count = (
-                session.query(models.PrioritizedItemORM)
-                .filter(models.PrioritizedItemORM.scheduler_id == scheduler_id)
-                .count()
-            )
-            return count == 0
+        return self.qsize(scheduler_id) == 0
 
     def qsize(self, scheduler_id: str) -> int:
+        """Return the number of items on the queue, from the size counter of
+        the queue. The counter is (re)initialized with a count of the items
+        in the database when it is missing, or when it hasn't been reconciled
+        for `size_reconcile_interval` seconds.
+
+        The items are counted without holding the lock of the counters, the
+        adjustments made while counting are added to the count. Meanwhile
+        other callers are served from the current counter.
+        """
+        with self.sizes_lock:
+            reconciled_at = self.sizes_reconciled_at.get(scheduler_id)
+            if reconciled_at is not None and time.monotonic() - reconciled_at <= self.size_reconcile_interval:
+                return self.sizes[scheduler_id]
+
+            if reconciled_at is not None:
+                self.sizes_reconciled_at[scheduler_id] = time.monotonic()
+
+            self.sizes_pending.setdefault(scheduler_id, 0)
+
+        try:
+            count = self._count(scheduler_id)
+        except Exception:
+            with self.sizes_lock:
+                self.sizes_pending.pop(scheduler_id, None)
+            raise
+
+        with self.sizes_lock:
+            self.sizes[scheduler_id] = max(0, count + self.sizes_pending.pop(scheduler_id, 0))
+            self.sizes_reconciled_at[scheduler_id] = time.monotonic()
+
+            return self.sizes[scheduler_id]
+
+    def _count(self, scheduler_id: str) -> int:
         with self.datastore.session.begin() as session:
             count = (
                 session.query(models.PrioritizedItemORM)
@@ -111,6 +384,21 @@ class PriorityQueueStore(PriorityQueueStorer):
 
             return count
 
+    def _adjust_size(self, scheduler_id: Optional[str], delta: int) -> None:
+        """Adjust the size counter of a queue after a committed change. When
+        the counter hasn't been initialized yet, it will be counted on the
+        next call to `qsize`.
+        """
+        if scheduler_id is None or delta == 0:
+            return
+
+        with self.sizes_lock:
+            if scheduler_id in self.sizes_pending:
+                self.sizes_pending[scheduler_id] += delta
+
+            if scheduler_id in self.sizes:
+                self.sizes[scheduler_id] = max(0, self.sizes[scheduler_id] + delta)
+
     def get_item_by_hash(self, scheduler_id: str, item_hash: str) -> Optional[models.PrioritizedItem]:
         with self.datastore.session.begin() as session:
             item_orm = (
@@ -126,6 +414,21 @@ class PriorityQueueStore(PriorityQueueStorer):
 
             return models.PrioritizedItem.from_orm(item_orm)
 
+    def get_items_by_hashes(self, scheduler_id: str, item_hashes: List[str]) -> List[models.PrioritizedItem]:
+        if not item_hashes:
+            return []
+
+        with self.datastore.session.begin() as session:
+            items_orm = (
+                session.query(models.PrioritizedItemORM)
+                .order_by(models.PrioritizedItemORM.created_at.desc())
+                .filter(models.PrioritizedItemORM.scheduler_id == scheduler_id)
+                .filter(models.PrioritizedItemORM.hash.in_(item_hashes))
+                .all()
+            )
+
+            return [models.PrioritizedItem.from_orm(item_orm) for item_orm in items_orm]
+
     def get_items_by_scheduler_id(self, scheduler_id: str) -> List[models.PrioritizedItem]:
         with self.datastore.session.begin() as session:
             items_orm = (
@@ -135,3 +438,59 @@ class PriorityQueueStore(PriorityQueueStorer):
             )
 
             return [models.PrioritizedItem.from_orm(item_orm) for item_orm in items_orm]
+
+    def get_items(
+        self,
+        scheduler_id: str,
+        limit: int,
+        after: Optional[Tuple[int, datetime.datetime, str]] = None,
+    ) -> List[models.PrioritizedItem]:
+        """Return a page of at most `limit` items of the queue, ordered by
+        priority. When `after` is given, as a (priority, created_at, id)
+        tuple of the last item of the previous page, the page starts after
+        that item."""
+        with self.datastore.session.begin() as session:
+            query = session.query(models.PrioritizedItemORM).filter(
+                models.PrioritizedItemORM.scheduler_id == scheduler_id
+            )
+
+            if after is not None:
+                priority, created_at, item_id = after
+                query = query.filter(
+                    or_(
+                        models.PrioritizedItemORM.priority > priority,
+                        and_(
+                            models.PrioritizedItemORM.priority == priority,
+                            or_(
+                                models.PrioritizedItemORM.created_at > created_at,
+                                and_(
+                                    models.PrioritizedItemORM.created_at == created_at,
+                                    models.PrioritizedItemORM.id > item_id,
+                                ),
+                            ),
+                        ),
+                    )
+                )
+
+            items_orm = (
+                query.order_by(models.PrioritizedItemORM.priority.asc())
+                .order_by(models.PrioritizedItemORM.created_at.asc())
+                .order_by(models.PrioritizedItemORM.id.asc())
+                .limit(limit)
+                .all()
+            )
+
+            return [models.PrioritizedItem.from_orm(item_orm) for item_orm in items_orm]
+
+    def get_priority_range(self, scheduler_id: str) -> Tuple[Optional[int], Optional[int]]:
+        with self.datastore.session.begin() as session:
+            min_priority, max_priority = (
+                session.query(
+                    func.min(models.PrioritizedItemORM.priority),
+                    func.max(models.PrioritizedItemORM.priority),
+                )
+                .filter(models.PrioritizedItemORM.scheduler_id == scheduler_id)
+                .one()
+            )
+
+            return min_priority, max_priority
@@ -0,0 +1,404 @@
+import datetime
+import gzip
+import json
+import logging
+import os
+import re
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import DateTime, delete, text
+from sqlalchemy.engine import Connection, Engine
+
+from scheduler import models
+
+from .datastore import SQLAlchemy
+
+# Name of the monthly partitions of the tasks table, e.g. tasks_p2023_03
+PARTITION_PREFIX = "tasks_p"
+PARTITION_PATTERN = re.compile(r"^tasks_p(\d{4})_(\d{2})$")
+
+# Name of the partition of the tasks table that holds the tasks outside of
+# the monthly partitions
+DEFAULT_PARTITION = "tasks_default"
+
+
+def month_start(dt: datetime.datetime) -> datetime.datetime:
+    """Return the start of the month of a datetime, in UTC."""
+    dt = dt.astimezone(datetime.timezone.utc)
+    return datetime.datetime(dt.year, dt.month, 1, tzinfo=datetime.timezone.utc)
+
+
+def next_month(dt: datetime.datetime) -> datetime.datetime:
+    """Return the start of the month after the month of a datetime."""
+    start = month_start(dt)
+    if start.month == 12:
+        return start.replace(year=start.year + 1, month=1)
+
+    return start.replace(month=start.month + 1)
+
+
+def partition_name(dt: datetime.datetime) -> str:
+    """Return the name of the partition of the tasks table that holds the
+    tasks created in the month of a datetime."""
+    start = month_start(dt)
+    return f"{PARTITION_PREFIX}{start.year:04d}_{start.month:02d}"
+
+
+def partition_range(name: str) -> Optional[Tuple[datetime.datetime, datetime.datetime]]:
+    """Return the range of creation dates of a monthly partition by its
+    name, or None when it isn't a monthly partition (e.g. the default
+    partition)."""
+    match = PARTITION_PATTERN.match(name)
+    if match is None:
+        return None
+
+    start = datetime.datetime(int(match.group(1)), int(match.group(2)), 1, tzinfo=datetime.timezone.utc)
+
+    return start, next_month(start)
+
+
+def is_partitioned(connection: Connection, table: str = "tasks") -> bool:
+    """Return whether a table is a partitioned table, only PostgreSQL
+    supports partitioning."""
+    if connection.dialect.name != "postgresql":
+        return False
+
+    relkind = connection.execute(
+        text("SELECT relkind FROM pg_class WHERE oid = to_regclass(:table)"),
+        {"table": table},
+    ).scalar()
+
+    return relkind == "p"
+
+
+class TaskRetention:
+    """Maintains the history of tasks, and removes tasks that are older than
+    the retention period, after optionally archiving them to gzip compressed
+    NDJSON files.
+
+    On PostgreSQL the tasks table is partitioned by month on the creation
+    date of the tasks (see migration 0009). The partitions for the upcoming
+    months are created ahead of time, and partitions that are completely
+    outside of the retention period are detached, archived and dropped. This
+    doesn't touch the rows of the partitions that are kept. Expired tasks in
+    the default partition are archived and deleted in batches. On other
+    databases the expired tasks are archived and deleted in batches.
+
+    The task_latest rows of removed tasks are removed with them, so they
+    don't refer to tasks that don't exist anymore.
+
+    NOTE: the primary key of the partitioned tasks table is (id, created_at)
+    while TaskORM only declares the id, ids are unique uuids. Lookups by id
+    alone can't be pruned to a single partition, they probe the index of
+    every partition.
+
+    Attributes:
+        logger: The logger for the class.
+        datastore: SQLAlchemy datastore of the tasks.
+        max_age:
+            The retention period, tasks created before now - max_age are
+            removed. When None, tasks are kept forever, and only the upcoming
+            partitions are created.
+        archive_dir:
+            Directory to archive the expired tasks to before they are
+            removed, when None the tasks aren't archived.
+        months_ahead:
+            The number of months after the current month to create
+            partitions for.
+        batch_size:
+            The number of tasks that are deleted at once, when the tasks
+            table isn't partitioned.
+    """
+
+    def __init__(
+        self,
+        datastore: SQLAlchemy,
+        max_age: Optional[datetime.timedelta] = None,
+        archive_dir: Optional[str] = None,
+        months_ahead: int = 2,
+        batch_size: int = 10000,
+    ) -> None:
+        self.logger: logging.Logger = logging.getLogger(__name__)
+        self.datastore: SQLAlchemy = datastore
+        self.max_age: Optional[datetime.timedelta] = max_age
+        self.archive_dir: Optional[str] = archive_dir
+        self.months_ahead: int = months_ahead
+        self.batch_size: int = batch_size
+
+    @property
+    def engine(self) -> Engine:
+        """The engine of the datastore of the tasks."""
+        engine = self.datastore.engine
+        if engine is None:
+            raise RuntimeError("Datastore of the tasks has no engine")
+
+        return engine
+
+    def run(self) -> None:
+        """Create the upcoming partitions, and remove the expired tasks.
+
+        NOTE: errors are logged and not raised, a failing retention job
+        shouldn't stop the scheduler. It is retried on the next run.
+        """
+        now = datetime.datetime.now(datetime.timezone.utc)
+
+        try:
+            with self.engine.connect() as connection:
+                partitioned = is_partitioned(connection)
+
+            if partitioned:
+                self.create_partitions(now)
+
+            if self.max_age is None:
+                return
+
+            expired_before = now - self.max_age
+            if partitioned:
+                self.expire_partitions(expired_before)
+            else:
+                self.expire_rows(expired_before)
+        except Exception as exc:
+            self.logger.exception("Unable to apply retention to tasks [exc=%s]", exc)
+
+    def get_partitions(self) -> List[str]:
+        """Return the names of the partitions that are attached to the tasks
+        table."""
+        with self.engine.connect() as connection:
+            rows = connection.execute(
+                text(
+                    "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+                    "WHERE i.inhparent = to_regclass('tasks') ORDER BY c.relname"
+                )
+            )
+
+            return [row[0] for row in rows]
+
+    def get_detached_partitions(self) -> List[str]:
+        """Return the names of monthly partitions that were detached, but not
+        dropped, e.g. because archiving them failed."""
+        with self.engine.connect() as connection:
+            rows = connection.execute(
+                text(
+                    "SELECT relname FROM pg_class "
+                    "WHERE relname LIKE :prefix AND relkind = 'r' AND NOT relispartition ORDER BY relname"
+                ),
+                {"prefix": f"{PARTITION_PREFIX}%"},
+            )
+
+            return [row[0] for row in rows if PARTITION_PATTERN.match(row[0])]
+
+    def create_partitions(self, now: datetime.datetime) -> None:
+        """Create the partitions for the current month and `months_ahead`
+        months after that, when they don't exist yet."""
+        existing = set(self.get_partitions())
+
+        starts = [month_start(now)]
+        for _ in range(self.months_ahead):
+            starts.append(next_month(starts[-1]))
+
+        for start in starts:
+            name = partition_name(start)
+            if name in existing:
+                continue
+
+            try:
+                with self.engine.begin() as connection:
+                    connection.execute(
+                        text(
+                            f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF tasks "
+                            f"FOR VALUES FROM ('{start.isoformat()}') TO ('{next_month(start).isoformat()}')"
+                        )
+                    )
+            except Exception as exc:
+                # NOTE: this fails when the default partition already holds
+                # tasks of this month.
+                self.logger.error(
+                    "Unable to create partition %s of tasks [partition=%s, exc=%s]",
+                    name,
+                    name,
+                    exc,
+                )
+                continue
+
+            self.logger.info("Created partition %s of tasks [partition=%s]", name, name)
+
+    def expire_partitions(self, expired_before: datetime.datetime) -> None:
+        """Detach, archive and drop the monthly partitions that only hold
+        tasks created before `expired_before`."""
+        for name in self.get_partitions():
+            bounds = partition_range(name)
+            if bounds is None or bounds[1] > expired_before:
+                continue
+
+            # NOTE: the latest task of a hash is in the partition of its
+            # creation date.
+            with self.engine.begin() as connection:
+                connection.execute(text(f"ALTER TABLE tasks DETACH PARTITION {name}"))
+                connection.execute(
+                    text("DELETE FROM task_latest WHERE created_at >= :start AND created_at < :end"),
+                    {"start": bounds[0], "end": bounds[1]},
+                )
+
+            self.logger.info("Detached partition %s of tasks [partition=%s]", name, name)
+
+        # NOTE: this includes partitions that were detached by a previous
+        # run that failed before they could be dropped.
+        for name in self.get_detached_partitions():
+            bounds = partition_range(name)
+            if bounds is None or bounds[1] > expired_before:
+                continue
+
+            if self.archive_dir is not None:
+                with self.engine.connect() as connection:
+                    rows = connection.execution_options(stream_results=True).execute(text(f"SELECT * FROM {name}"))
+                    count = self.archive(name, (dict(row._mapping) for row in rows))
+
+                self.logger.info(
+                    "Archived %d tasks of partition %s [partition=%s, count=%d, archive_dir=%s]",
+                    count,
+                    name,
+                    name,
+                    count,
+                    self.archive_dir,
+                )
+
+            with self.engine.begin() as connection:
+                connection.execute(text(f"DROP TABLE {name}"))
+
+            self.logger.info("Dropped partition %s of tasks [partition=%s]", name, name)
+
+        self.expire_default_partition(expired_before)
+
+    def expire_default_partition(self, expired_before: datetime.datetime) -> None:
+        """Archive and delete the tasks created before `expired_before` in
+        the default partition, in batches of `batch_size` tasks. Every batch
+        is archived to its own file before its deletion is committed."""
+        count = 0
+        while True:
+            with self.engine.begin() as connection:
+                rows = [
+                    dict(row._mapping)
+                    for row in connection.execute(
+                        text(
+                            f"DELETE FROM {DEFAULT_PARTITION} WHERE id IN ("
+                            f"SELECT id FROM {DEFAULT_PARTITION} WHERE created_at < :expired_before "
+                            "ORDER BY created_at LIMIT :limit) RETURNING *"
+                        ).columns(created_at=DateTime(timezone=True)),
+                        {"expired_before": expired_before, "limit": self.batch_size},
+                    )
+                ]
+
+                if not rows:
+                    break
+
+                connection.execute(
+                    delete(models.TaskLatestORM.__table__).where(
+                        models.TaskLatestORM.task_id.in_([row["id"] for row in rows])
+                    )
+                )
+
+                if self.archive_dir is not None:
+                    rows.sort(key=lambda row: row["created_at"])
+                    self.archive(
+                        f"{DEFAULT_PARTITION}_{rows[0]['created_at'].strftime('%Y%m%dT%H%M%S%f')}",
+                        rows,
+                    )
+
+            count += len(rows)
+            if len(rows) < self.batch_size:
+                break
+
+        if count == 0:
+            return
+
+        self.logger.info(
+            "Removed %d tasks created before %s from partition %s [count=%d, expired_before=%s, partition=%s]",
+            count,
+            expired_before,
+            DEFAULT_PARTITION,
+            count,
+            expired_before,
+            DEFAULT_PARTITION,
+        )
+
+    def expire_rows(self, expired_before: datetime.datetime) -> None:
+        """Archive and delete the tasks created before `expired_before` in
+        batches of `batch_size` tasks, oldest first. Every batch is archived
+        to its own file before it is deleted."""
+        count = 0
+        while True:
+            with self.datastore.session.begin() as session:
+                tasks_orm = (
+                    session.query(models.TaskORM)
+                    .filter(models.TaskORM.created_at < expired_before)
+                    .order_by(models.TaskORM.created_at.asc())
+                    .limit(self.batch_size)
+                    .all()
+                )
+
+                if not tasks_orm:
+                    break
+
+                if self.archive_dir is not None:
+                    tasks = [models.Task.from_orm(task_orm) for task_orm in tasks_orm]
+                    self.archive(
+                        f"tasks_{tasks[0].created_at.strftime('%Y%m%dT%H%M%S%f')}",
+                        (task.dict() for task in tasks),
+                    )
+
+                task_ids = [task_orm.id for task_orm in tasks_orm]
+                (
+                    session.query(models.TaskORM)
+                    .filter(models.TaskORM.id.in_(task_ids))
+                    .delete(synchronize_session=False)
+                )
+                (
+                    session.query(models.TaskLatestORM)
+                    .filter(models.TaskLatestORM.task_id.in_(task_ids))
+                    .delete(synchronize_session=False)
+                )
+
+            count += len(tasks_orm)
+            if len(tasks_orm) < self.batch_size:
+                break
+
+        if count == 0:
+            return
+
+        self.logger.info(
+            "Removed %d tasks created before %s [count=%d, expired_before=%s, archive_dir=%s]",
+            count,
+            expired_before,
+            count,
+            expired_before,
+            self.archive_dir,
+        )
+
+    def archive(self, name: str, rows: Iterable[Dict[str, Any]]) -> int:
+        """Write rows to the gzip compressed NDJSON file `<name>.ndjson.gz` in
+        the archive directory. The rows are written to a temporary file that
+        is moved into place when it is complete, so a partially written
+        archive is never mistaken for a complete one.
+
+        Returns:
+            The number of archived rows.
+        """
+        if self.archive_dir is None:
+            return 0
+
+        os.makedirs(self.archive_dir, exist_ok=True)
+        path = os.path.join(self.archive_dir, f"{name}.ndjson.gz")
+
+        count = 0
+        try:
+            with gzip.open(f"{path}.tmp", "wt", encoding="utf-8") as archive:
+                for row in rows:
+                    archive.write(json.dumps(row, default=str) + "\n")
+                    count += 1
+        except Exception:
+            os.remove(f"{path}.tmp")
+            raise
+
+        os.replace(f"{path}.tmp", path)
+
+        return count
@@ -1,10 +1,136 @@
 import datetime
-from typing import List, Optional, Tuple
+import json
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import case, func, or_, orm, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import ClauseElement, Executable
 
 from scheduler import models
 
 from ..stores import TaskStorer
 from .datastore import SQLAlchemy
+from .filters import apply_filters
+from .retention import is_partitioned
+
+# The statuses of tasks that can hold a lease, a popped task is DISPATCHED,
+# and is set to RUNNING by the runner that picked it up.
+LEASED_STATUSES = (models.TaskStatus.DISPATCHED, models.TaskStatus.RUNNING)
+
+
+class Explain(Executable, ClauseElement):
+    """The query plan of a statement, in the JSON format of PostgreSQL.
+
+    The statement is compiled and its parameters are bound by SQLAlchemy
+    when it is executed, like any other statement, so e.g. `in_` filters
+    are expanded."""
+
+    inherit_cache = False
+
+    def __init__(self, statement: Any) -> None:
+        self.statement = statement
+
+
+@compiles(Explain, "postgresql")
+def compile_explain(element: Explain, compiler: Any, **kw: Any) -> str:
+    return f"EXPLAIN (FORMAT JSON) {compiler.process(element.statement, **kw)}"
+
+
+def record_latest(session: orm.Session, rows: List[Dict[str, Any]]) -> None:
+    """Record created or updated tasks in the task_latest table. A task
+    becomes the latest task of its hash when it was created after the
+    current latest task, the run count is incremented for every task of the
+    hash that wasn't recorded before.
+
+    Args:
+        session: The session of the transaction that writes the tasks.
+        rows: The tasks as dicts, as written to the tasks table.
+    """
+    latest: Dict[str, Dict[str, Any]] = {}
+    for row in rows:
+        if row.get("hash") is None:
+            continue
+
+        current = latest.get(row["hash"])
+        if current is None:
+            latest[row["hash"]] = {
+                "hash": row["hash"],
+                "task_id": row["id"],
+                "status": row["status"],
+                "run_count": 1,
+                "created_at": row["created_at"],
+                "modified_at": row["modified_at"],
+            }
+            continue
+
+        # NOTE: a hash can only be written once by a single INSERT ... ON
+        # CONFLICT, so the tasks of a batch are folded per hash.
+        current["run_count"] += 1
+        if row["created_at"] >= current["created_at"]:
+            current.update(
+                task_id=row["id"],
+                status=row["status"],
+                created_at=row["created_at"],
+                modified_at=row["modified_at"],
+            )
+
+    if not latest:
+        return
+
+    table = models.TaskLatestORM.__table__
+    dialect = session.get_bind().dialect.name
+    if dialect == "postgresql":
+        stmt = postgresql.insert(table).values(list(latest.values()))
+    elif dialect == "sqlite":
+        stmt = sqlite.insert(table).values(list(latest.values()))
+    else:
+        for values in latest.values():
+            latest_orm = session.get(models.TaskLatestORM, values["hash"], with_for_update=True)
+            if latest_orm is None:
+                session.add(models.TaskLatestORM(**values))
+                continue
+
+            if latest_orm.task_id != values["task_id"] and latest_orm.created_at > values["created_at"]:
+                continue
+
+            if latest_orm.task_id != values["task_id"]:
+                latest_orm.run_count += values["run_count"]
+
+            latest_orm.task_id = values["task_id"]
+            latest_orm.status = values["status"]
+            latest_orm.created_at = values["created_at"]
+            latest_orm.modified_at = values["modified_at"]
+        return
+
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.hash],
+        set_={
+            "task_id": stmt.excluded.task_id,
+            "status": stmt.excluded.status,
+            "run_count": table.c.run_count
+            + case((table.c.task_id == stmt.excluded.task_id, 0), else_=stmt.excluded.run_count),
+            "created_at": stmt.excluded.created_at,
+            "modified_at": stmt.excluded.modified_at,
+        },
+        # An update of an older task doesn't replace the latest task
+        where=or_(table.c.task_id == stmt.excluded.task_id, table.c.created_at <= stmt.excluded.created_at),
+    )
+
+    session.execute(stmt)
+
+
+def set_latest_status(session: orm.Session, task_ids: List[str], status: models.TaskStatus) -> None:
+    """Set the status of the tasks that are the latest task of their hash
+    in the task_latest table."""
+    if not task_ids:
+        return
+
+    session.execute(
+        update(models.TaskLatestORM.__table__)
+        .where(models.TaskLatestORM.task_id.in_(task_ids))
+        .values(status=status, modified_at=func.now())
+    )
 
 
 class TaskStore(TaskStorer):
@@ -19,6 +145,21 @@ class TaskStore(TaskStorer):
 
         self.datastore = datastore
 
+        self._partitioned: Optional[bool] = None
+
+    @property
+    def partitioned(self) -> bool:
+        """Whether the tasks table is partitioned, see TaskRetention."""
+        if self._partitioned is None:
+            engine = self.datastore.engine
+            if engine is None:
+                raise RuntimeError("Datastore of the tasks has no engine")
+
+            with engine.connect() as connection:
+                self._partitioned = is_partitioned(connection)
+
+        return self._partitioned
+
     def get_tasks(
         self,
         scheduler_id: Optional[str],
@@ -29,7 +170,23 @@ class TaskStore(TaskStorer):
         filters: Optional[List[models.Filter]],
         offset: int = 0,
         limit: int = 100,
-    ) -> Tuple[List[models.Task], int]:
+        after: Optional[Tuple[datetime.datetime, str]] = None,
+        count: models.CountMode = models.CountMode.EXACT,
+    ) -> Tuple[List[models.Task], Optional[int]]:
+        """Return a page of tasks, ordered by creation date (newest first).
+
+        Args:
+            after: The (created_at, id) of the last task of the previous
+                page, the page starts after that task. Unlike `offset` this
+                is served from the index, so deep pages are as cheap as the
+                first page.
+            count: How to count the total number of tasks that match, an
+                exact count scans every matching row.
+
+        Returns:
+            A tuple of the tasks, and the (estimated) number of tasks that
+            match. The number is None when `count` is NONE.
+        """
         with self.datastore.session.begin() as session:
             query = session.query(models.TaskORM)
 
@@ -49,16 +206,49 @@ class TaskStore(TaskStorer):
                 query = query.filter(models.TaskORM.created_at <= max_created_at)
 
             if filters is not None:
-                for f in filters:
-                    query = query.filter(models.TaskORM.p_item[f.get_field()].as_string() == f.value)
-
-            count = query.count()
+                query = apply_filters(query, models.TaskORM.p_item, filters)
+
+            total = None
+            if count == models.CountMode.EXACT:
+                total = query.count()
+            elif count == models.CountMode.ESTIMATE:
+                total = self._estimate_count(session, query)
+
+            if after is not None:
+                # NOTE: the redundant `created_at <= ...` bounds the range
+                # that is searched in the index.
+                created_at, task_id = after
+                query = query.filter(models.TaskORM.created_at <= created_at).filter(
+                    or_(
+                        models.TaskORM.created_at < created_at,
+                        models.TaskORM.id < task_id,
+                    )
+                )
 
-            tasks_orm = query.order_by(models.TaskORM.created_at.desc()).offset(offset).limit(limit).all()
+            tasks_orm = (
+                query.order_by(models.TaskORM.created_at.desc())
+                .order_by(models.TaskORM.id.desc())
+                .offset(offset)
+                .limit(limit)
+                .all()
+            )
 
             tasks = [models.Task.from_orm(task_orm) for task_orm in tasks_orm]
 
-            return tasks, count
+            return tasks, total
+
+    def _estimate_count(self, session: orm.Session, query: orm.Query) -> int:
+        """Estimate the number of rows a query returns from the planner
+        statistics of PostgreSQL, without executing the query. Other
+        dialects don't expose an estimate, so the rows are counted."""
+        if session.get_bind().dialect.name != "postgresql":
+            return query.count()
+
+        plan = session.execute(Explain(query.statement)).scalar()
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+
+        return int(plan[0]["Plan"]["Plan Rows"])
 
     def get_task_by_id(self, task_id: str) -> Optional[models.Task]:
         with self.datastore.session.begin() as session:
@@ -74,7 +264,7 @@ class TaskStore(TaskStorer):
         with self.datastore.session.begin() as session:
             tasks_orm = (
                 session.query(models.TaskORM)
-                .filter(models.TaskORM.p_item["hash"].as_string() == task_hash)
+                .filter(models.TaskORM.hash == task_hash)
                 .order_by(models.TaskORM.created_at.desc())
                 .all()
             )
@@ -87,10 +277,16 @@ class TaskStore(TaskStorer):
             return tasks
 
     def get_latest_task_by_hash(self, task_hash: str) -> Optional[models.Task]:
+        """Return the most recently created task with a hash.
+
+        NOTE: when the tasks table is partitioned by created_at, ordering by
+        created_at with a limit lets PostgreSQL scan the partitions newest
+        first, and stop at the first partition that holds the hash.
+        """
         with self.datastore.session.begin() as session:
             task_orm = (
                 session.query(models.TaskORM)
-                .filter(models.TaskORM.p_item["hash"].as_string() == task_hash)
+                .filter(models.TaskORM.hash == task_hash)
                 .order_by(models.TaskORM.created_at.desc())
                 .first()
             )
@@ -102,15 +298,229 @@ class TaskStore(TaskStorer):
 
             return task
 
+    def get_latest_by_hash(self, task_hash: str) -> Optional[models.TaskLatest]:
+        """Return the summary of the latest task with a hash, looked up by
+        the primary key of the task_latest table."""
+        with self.datastore.session.begin() as session:
+            latest_orm = session.get(models.TaskLatestORM, task_hash)
+            if latest_orm is None:
+                return None
+
+            return models.TaskLatest.from_orm(latest_orm)
+
+    def get_latest_by_hashes(self, task_hashes: List[str]) -> Dict[str, models.TaskLatest]:
+        """Return the summaries of the latest tasks of a batch of hashes,
+        with a single lookup. Hashes without tasks are left out."""
+        if not task_hashes:
+            return {}
+
+        with self.datastore.session.begin() as session:
+            latest_orm = (
+                session.query(models.TaskLatestORM).filter(models.TaskLatestORM.hash.in_(set(task_hashes))).all()
+            )
+
+            return {latest.hash: models.TaskLatest.from_orm(latest) for latest in latest_orm}
+
     def create_task(self, task: models.Task) -> Optional[models.Task]:
         with self.datastore.session.begin() as session:
             task_orm = models.TaskORM(**task.dict())
             session.add(task_orm)
+            session.flush()
 
             created_task = models.Task.from_orm(task_orm)
+            record_latest(session, [created_task.dict()])
 
             return created_task
 
+    def create_tasks(self, tasks: List[models.Task]) -> None:
+        """Create a batch of tasks with a multi-row insert."""
+        if not tasks:
+            return
+
+        rows = [task.dict() for task in tasks]
+
+        with self.datastore.session.begin() as session:
+            session.execute(models.TaskORM.__table__.insert(), rows)
+            record_latest(session, rows)
+
     def update_task(self, task: models.Task) -> None:
         with self.datastore.session.begin() as session:
             (session.query(models.TaskORM).filter(models.TaskORM.id == task.id).update(task.dict()))
+            set_latest_status(session, [str(task.id)], task.status)
+
+    def upsert_task(self, task: models.Task) -> None:
+        """Create a task, or update it when a task with the same id exists."""
+        self.upsert_tasks([task])
+
+    def upsert_tasks(self, tasks: List[models.Task]) -> None:
+        """Create a batch of tasks, and update the tasks of which a task with
+        the same id exists, with a single INSERT ... ON CONFLICT DO UPDATE
+        statement. The creation date of existing tasks is kept."""
+        if not tasks:
+            return
+
+        rows = [task.dict() for task in tasks]
+
+        with self.datastore.session.begin() as session:
+            dialect = session.get_bind().dialect.name
+            if self.partitioned:
+                # NOTE: ON CONFLICT needs a unique index on the id, which a
+                # table that is partitioned by created_at can't have. So we
+                # lock the existing tasks, and update or create the tasks.
+                existing = {
+                    str(task_id)
+                    for (task_id,) in session.query(models.TaskORM.id)
+                    .filter(models.TaskORM.id.in_([row["id"] for row in rows]))
+                    .with_for_update()
+                    .all()
+                }
+
+                for row in rows:
+                    if str(row["id"]) in existing:
+                        (
+                            session.query(models.TaskORM)
+                            .filter(models.TaskORM.id == row["id"])
+                            .update({k: v for k, v in row.items() if k not in ("id", "created_at")})
+                        )
+
+                created = [row for row in rows if str(row["id"]) not in existing]
+                if created:
+                    session.execute(models.TaskORM.__table__.insert(), created)
+
+                record_latest(session, rows)
+
+                return
+
+            if dialect == "postgresql":
+                stmt = postgresql.insert(models.TaskORM.__table__).values(rows)
+            elif dialect == "sqlite":
+                stmt = sqlite.insert(models.TaskORM.__table__).values(rows)
+            else:
+                for row in rows:
+                    session.merge(models.TaskORM(**row))
+                record_latest(session, rows)
+                return
+
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[models.TaskORM.id],
+                set_={column: stmt.excluded[column] for column in rows[0] if column not in ("id", "created_at")},
+            )
+
+            session.execute(stmt)
+            record_latest(session, rows)
+
+    def set_status(
+        self,
+        task_ids: List[str],
+        status: models.TaskStatus,
+        lease_expires_at: Optional[datetime.datetime] = None,
+    ) -> List[str]:
+        """Set the status and lease of tasks with a single UPDATE, without
+        loading or writing back the prioritized item of the tasks.
+
+        Args:
+            task_ids: The ids of the tasks.
+            status: The status to set.
+            lease_expires_at: The deadline of the lease of the tasks, the
+                lease is released when None.
+
+        Returns:
+            The ids of the tasks that were updated.
+        """
+        if not task_ids:
+            return []
+
+        stmt = (
+            update(models.TaskORM.__table__)
+            .where(models.TaskORM.id.in_(task_ids))
+            .values(status=status, lease_expires_at=lease_expires_at)
+        )
+
+        with self.datastore.session.begin() as session:
+            if session.get_bind().dialect.name == "postgresql":
+                updated = [str(task_id) for (task_id,) in session.execute(stmt.returning(models.TaskORM.id))]
+                set_latest_status(session, updated, status)
+                return updated
+
+            # NOTE: RETURNING isn't supported for other dialects, so we select
+            # the ids in the same transaction.
+            updated = [
+                str(task_id)
+                for (task_id,) in session.query(models.TaskORM.id).filter(models.TaskORM.id.in_(task_ids)).all()
+            ]
+            if updated:
+                session.execute(stmt)
+                set_latest_status(session, updated, status)
+
+            return updated
+
+    def get_expired_tasks(self, scheduler_id: str, expired_before: datetime.datetime, limit: int) -> List[models.Task]:
+        """Return at most `limit` tasks of a scheduler with a lease that
+        expired before `expired_before`, oldest lease first."""
+        with self.datastore.session.begin() as session:
+            tasks_orm = (
+                session.query(models.TaskORM)
+                .filter(models.TaskORM.scheduler_id == scheduler_id)
+                .filter(models.TaskORM.lease_expires_at.isnot(None))
+                .filter(models.TaskORM.lease_expires_at < expired_before)
+                .filter(models.TaskORM.status.in_(LEASED_STATUSES))
+                .order_by(models.TaskORM.lease_expires_at.asc())
+                .limit(limit)
+                .all()
+            )
+
+            return [models.Task.from_orm(task_orm) for task_orm in tasks_orm]
+
+    def update_lease(self, task_id: str, lease_expires_at: datetime.datetime) -> Optional[models.Task]:
+        """Set the deadline of the lease of a task. Returns None when the
+        task doesn't hold a lease."""
+        with self.datastore.session.begin() as session:
+            task_orm = (
+                session.query(models.TaskORM)
+                .filter(models.TaskORM.id == task_id)
+                .filter(models.TaskORM.lease_expires_at.isnot(None))
+                .filter(models.TaskORM.status.in_(LEASED_STATUSES))
+                .with_for_update()
+                .first()
+            )
+
+            if task_orm is None:
+                return None
+
+            task_orm.lease_expires_at = lease_expires_at
+            session.flush()
+
+            return models.Task.from_orm(task_orm)
+
+    def release_lease(
+        self,
+        task_id: str,
+        status: models.TaskStatus,
+        expired_before: Optional[datetime.datetime] = None,
+    ) -> Optional[models.Task]:
+        """Release the lease of a task, and set its status. When
+        `expired_before` is given the lease is only released when it expired
+        before that time. Returns None when the task doesn't hold a (expired)
+        lease."""
+        with self.datastore.session.begin() as session:
+            query = (
+                session.query(models.TaskORM)
+                .filter(models.TaskORM.id == task_id)
+                .filter(models.TaskORM.lease_expires_at.isnot(None))
+                .filter(models.TaskORM.status.in_(LEASED_STATUSES))
+            )
+
+            if expired_before is not None:
+                query = query.filter(models.TaskORM.lease_expires_at < expired_before)
+
+            task_orm = query.with_for_update().first()
+            if task_orm is None:
+                return None
+
+            task_orm.status = status
+            task_orm.lease_expires_at = None
+            session.flush()
+
+            set_latest_status(session, [task_orm.id], status)
+
+            return models.Task.from_orm(task_orm)
@@ -1,7 +1,7 @@
 import abc
 import datetime
 import logging
-from typing import List, Optional, Tuple
+from typing import Dict, List, Optional, Tuple
 
 from scheduler import models
 
@@ -26,7 +26,9 @@ class TaskStorer(abc.ABC):
         filters: Optional[List[models.Filter]],
         offset: int = 0,
         limit: int = 100,
-    ) -> Tuple[List[models.Task], int]:
+        after: Optional[Tuple[datetime.datetime, str]] = None,
+        count: models.CountMode = models.CountMode.EXACT,
+    ) -> Tuple[List[models.Task], Optional[int]]:
         raise NotImplementedError
 
     @abc.abstractmethod
@@ -41,14 +43,60 @@ class TaskStorer(abc.ABC):
     def get_latest_task_by_hash(self, task_hash: str) -> Optional[models.Task]:
         raise NotImplementedError
 
+    @abc.abstractmethod
+    def get_latest_by_hash(self, task_hash: str) -> Optional[models.TaskLatest]:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def get_latest_by_hashes(self, task_hashes: List[str]) -> Dict[str, models.TaskLatest]:
+        raise NotImplementedError
+
     @abc.abstractmethod
     def create_task(self, task: models.Task) -> Optional[models.Task]:
         raise NotImplementedError
 
+    @abc.abstractmethod
+    def create_tasks(self, tasks: List[models.Task]) -> None:
+        raise NotImplementedError
+
     @abc.abstractmethod
     def update_task(self, task: models.Task) -> Optional[models.Task]:
         raise NotImplementedError
 
+    @abc.abstractmethod
+    def upsert_task(self, task: models.Task) -> None:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def upsert_tasks(self, tasks: List[models.Task]) -> None:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def set_status(
+        self,
+        task_ids: List[str],
+        status: models.TaskStatus,
+        lease_expires_at: Optional[datetime.datetime] = None,
+    ) -> List[str]:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def get_expired_tasks(self, scheduler_id: str, expired_before: datetime.datetime, limit: int) -> List[models.Task]:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def update_lease(self, task_id: str, lease_expires_at: datetime.datetime) -> Optional[models.Task]:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def release_lease(
+        self,
+        task_id: str,
+        status: models.TaskStatus,
+        expired_before: Optional[datetime.datetime] = None,
+    ) -> Optional[models.Task]:
+        raise NotImplementedError
+
 
 class PriorityQueueStorer(abc.ABC):
     def __init__(self) -> None:
@@ -59,7 +107,34 @@ class PriorityQueueStorer(abc.ABC):
         raise NotImplementedError
 
     @abc.abstractmethod
-    def pop(self, scheduler_id: str, filters: Optional[List[models.Filter]] = None) -> Optional[models.PrioritizedItem]:
+    def push_many(self, scheduler_id: str, items: List[models.PrioritizedItem]) -> List[models.PrioritizedItem]:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def pop(
+        self,
+        scheduler_id: str,
+        filters: Optional[List[models.Filter]] = None,
+        lease_expires_at: Optional[datetime.datetime] = None,
+    ) -> Optional[models.PrioritizedItem]:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def pop_many(
+        self,
+        scheduler_id: str,
+        n: int,
+        filters: Optional[List[models.Filter]] = None,
+        lease_expires_at: Optional[datetime.datetime] = None,
+    ) -> List[models.PrioritizedItem]:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def requeue(self, scheduler_id: str, item_id: str) -> bool:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def requeue_expired(self, scheduler_id: str, expired_before: datetime.datetime, limit: int) -> int:
         raise NotImplementedError
 
     @abc.abstractmethod
@@ -86,6 +161,23 @@ class PriorityQueueStorer(abc.ABC):
     def get_item_by_hash(self, scheduler_id: str, item_hash: str) -> Optional[models.PrioritizedItem]:
         raise NotImplementedError
 
+    @abc.abstractmethod
+    def get_items_by_hashes(self, scheduler_id: str, item_hashes: List[str]) -> List[models.PrioritizedItem]:
+        raise NotImplementedError
+
     @abc.abstractmethod
     def get_items_by_scheduler_id(self, scheduler_id: str) -> List[models.PrioritizedItem]:
         raise NotImplementedError
+
+    @abc.abstractmethod
+    def get_items(
+        self,
+        scheduler_id: str,
+        limit: int,
+        after: Optional[Tuple[int, datetime.datetime, str]] = None,
+    ) -> List[models.PrioritizedItem]:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def get_priority_range(self, scheduler_id: str) -> Tuple[Optional[int], Optional[int]]:
+        raise NotImplementedError
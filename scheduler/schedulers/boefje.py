@@ -1,26 +1,99 @@
+import functools
 import logging
 import time
+from concurrent import futures
 from datetime import datetime, timedelta, timezone
 from types import SimpleNamespace
-from typing import List
+from typing import Any, Dict, List, Optional
 
 import pika
 import requests
 
 from scheduler import context, queues, rankers
-from scheduler.models import OOI, Boefje, BoefjeTask, Organisation, Plugin, PrioritizedItem, TaskStatus
+from scheduler.models import (
+    OOI,
+    Boefje,
+    BoefjeMeta,
+    BoefjeTask,
+    Organisation,
+    Plugin,
+    PrioritizedItem,
+    TaskLatest,
+    TaskStatus,
+)
 
 from .scheduler import Scheduler
 
 
+class TaskRunState:
+    """The run state of a task according to the datastore and bytes, for a
+    single evaluation of the task. Every lookup is done at most once, and
+    shared by the checks and the ranking of the task.
+
+    The lookups can be set up front, e.g. from a batched lookup for multiple
+    tasks.
+
+    NOTE: functools.cached_property isn't used, since before Python 3.12 it
+    holds a lock that is shared by all instances, and the states are looked
+    up concurrently.
+
+    Attributes:
+        ctx: Application context of shared data.
+        task: The task to look up the run state of.
+    """
+
+    def __init__(self, ctx: context.AppContext, task: BoefjeTask) -> None:
+        self.ctx: context.AppContext = ctx
+        self.task: BoefjeTask = task
+
+        self._cache: Dict[str, Any] = {}
+
+    @property
+    def latest(self) -> Optional[TaskLatest]:
+        """The latest task with the same hash in the datastore."""
+        if "latest" not in self._cache:
+            self._cache["latest"] = self.ctx.task_store.get_latest_by_hash(self.task.hash)
+
+        return self._cache["latest"]
+
+    @latest.setter
+    def latest(self, latest: Optional[TaskLatest]) -> None:
+        self._cache["latest"] = latest
+
+    @property
+    def last_run(self) -> Optional[BoefjeMeta]:
+        """The last run of the boefje on the input ooi according to bytes."""
+        if "last_run" not in self._cache:
+            self._cache["last_run"] = self.ctx.services.bytes.get_last_run_boefje(
+                boefje_id=self.task.boefje.id,
+                input_ooi=self.task.input_ooi,
+                organization_id=self.task.organization,
+            )
+
+        return self._cache["last_run"]
+
+    @last_run.setter
+    def last_run(self, last_run: Optional[BoefjeMeta]) -> None:
+        self._cache["last_run"] = last_run
+
+
 class BoefjeScheduler(Scheduler):
     """A KAT specific implementation of a Boefje scheduler. It extends
     the `Scheduler` class by adding a `organisation` attribute.
 
     Attributes:
         organisation: The organisation that this scheduler is for.
+        executor:
+            A bounded thread pool on which the tasks that are candidates
+            for the queue are evaluated concurrently.
     """
 
+    # The number of oois of which the tasks are evaluated at once
+    POPULATE_BATCH_SIZE = 10
+
+    # The number of seconds between batches of random oois
+    POPULATE_BATCH_INTERVAL = 1
+
     def __init__(
         self,
         ctx: context.AppContext,
@@ -40,6 +113,30 @@ class BoefjeScheduler(Scheduler):
 
         self.logger = logging.getLogger(__name__)
         self.organisation: Organisation = organisation
+        self.mutations_queue: str = f"{organisation.id}__scan_profile_mutations"
+        self.random_objects_populated_at: Optional[float] = None
+
+        self.executor: futures.ThreadPoolExecutor = futures.ThreadPoolExecutor(
+            max_workers=self.ctx.config.pq_populate_concurrency,
+            thread_name_prefix=f"{scheduler_id}_populate",
+        )
+
+    def stop(self) -> None:
+        """Stop the scheduler, its executor, and stop consuming its queue."""
+        self.executor.shutdown(wait=False)
+
+        super().stop()
+
+        self.ctx.services.scan_profile_mutation.remove(self.mutations_queue)
+
+    def run(self) -> None:
+        super().run()
+
+        # Wake up the populator when a mutation is delivered
+        self.ctx.services.scan_profile_mutation.add_callback(
+            self.mutations_queue,
+            functools.partial(self.wake_thread, "populator"),
+        )
 
     def populate_queue(self) -> None:
         """Populate the PriorityQueue.
@@ -50,188 +147,129 @@ class BoefjeScheduler(Scheduler):
 
         When this is done we will try and fill the rest of the queue with
         random items from octopoes and schedule them accordingly.
+
+        The populator runs when mutations are delivered, and when items are
+        popped from the queue, the populate interval is only a fallback.
         """
         self.push_tasks_for_scan_profile_mutations()
 
+        # NOTE: the populator is woken up by every delivered mutation and
+        # every pop from the queue, the random objects are only fetched once
+        # every populate interval.
+        now = time.monotonic()
+        if (
+            self.random_objects_populated_at is not None
+            and now - self.random_objects_populated_at < self.ctx.config.pq_populate_interval
+        ):
+            return
+
+        self.random_objects_populated_at = now
         self.push_tasks_for_random_objects()
 
     def push_tasks_for_scan_profile_mutations(self) -> None:
         """Create tasks for oois that have a scan level change.
 
-        We loop until we don't have any messages on the queue anymore.
+        We loop until we don't have any messages on the queue anymore. The
+        mutations are processed in batches of `POPULATE_BATCH_SIZE` oois, of
+        which the tasks are evaluated concurrently. The mutations of a batch
+        are acknowledged once its tasks are pushed onto the queue.
         """
         while not self.queue.full():
-            time.sleep(1)
-
-            mutation = None
-            try:
-                mutation = self.ctx.services.scan_profile_mutation.get_scan_profile_mutation(
-                    queue=f"{self.organisation.id}__scan_profile_mutations",
-                )
-            except (
-                pika.exceptions.ConnectionClosed,
-                pika.exceptions.ChannelClosed,
-                pika.exceptions.ChannelClosedByBroker,
-                pika.exceptions.AMQPConnectionError,
-            ) as e:
-                self.logger.debug(
-                    "Could not connect to rabbitmq queue: %s [organisation.id=%s, scheduler_id=%s]",
-                    f"{self.organisation.id}__scan_profile_mutations",
-                    self.organisation.id,
-                    self.scheduler_id,
-                )
-                if self.stop_event.is_set():
-                    raise e
-
-            # Stop the loop when we've processed everything from the
-            # messaging queue, so we can continue to the next step.
-            if mutation is None:
-                self.logger.debug(
-                    "No more mutation left on queue, processed everything [orgnisation.id=%s, scheduler_id=%s]",
-                    self.organisation.id,
-                    self.scheduler_id,
-                )
-                return
-
-            self.logger.debug(
-                "Received scan level mutation %s for: %s [ooi.primary_key=%s, organisation.id=%s, scheduler_id=%s]",
-                mutation.operation,
-                mutation.primary_key,
-                mutation.primary_key,
-                self.organisation.id,
-                self.scheduler_id,
-            )
+            tasks: List[BoefjeTask] = []
+            processed_all = False
+            for _ in range(self.POPULATE_BATCH_SIZE):
+                mutation = None
+                try:
+                    mutation = self.ctx.services.scan_profile_mutation.get_scan_profile_mutation(
+                        queue=self.mutations_queue,
+                    )
+                except (
+                    pika.exceptions.ConnectionClosed,
+                    pika.exceptions.ChannelClosed,
+                    pika.exceptions.ChannelClosedByBroker,
+                    pika.exceptions.AMQPConnectionError,
+                ) as e:
+                    self.logger.debug(
+                        "Could not connect to rabbitmq queue: %s [organisation.id=%s, scheduler_id=%s]",
+                        self.mutations_queue,
+                        self.organisation.id,
+                        self.scheduler_id,
+                    )
+                    if self.stop_event.is_set():
+                        raise e
 
-            # Should be an OOI in value
-            ooi = mutation.value
-            if ooi is None:
-                self.logger.debug(
-                    "Mutation value is None, skipping %s [organisation.id=%s, scheduler_id=%s]",
-                    mutation,
-                    self.organisation.id,
-                    self.scheduler_id,
-                )
-                continue
+                # Stop the loop when we've processed everything from the
+                # messaging queue, so we can continue to the next step.
+                if mutation is None:
+                    self.logger.debug(
+                        "No more mutation left on queue, processed everything [orgnisation.id=%s, scheduler_id=%s]",
+                        self.organisation.id,
+                        self.scheduler_id,
+                    )
+                    processed_all = True
+                    break
 
-            # What available boefjes do we have for this ooi?
-            boefjes = self.get_boefjes_for_ooi(ooi)
-            if boefjes is None or len(boefjes) == 0:
                 self.logger.debug(
-                    "No boefjes available for ooi %s, skipping [organisation.id=%s, scheduler_id=%s]",
-                    mutation.value,
+                    "Received scan level mutation %s for: %s [ooi.primary_key=%s, organisation.id=%s, scheduler_id=%s]",
+                    mutation.operation,
+                    mutation.primary_key,
+                    mutation.primary_key,
                     self.organisation.id,
                     self.scheduler_id,
                 )
-                continue
 
-            # Create a task for each boefje for this ooi and push it onto the
-            # queue.
-            for boefje in boefjes:
-                task = BoefjeTask(
-                    boefje=Boefje.parse_obj(boefje),
-                    input_ooi=ooi.primary_key,
-                    organization=self.organisation.id,
-                )
-
-                if not self.is_task_allowed_to_run(boefje, ooi):
+                # Should be an OOI in value
+                ooi = mutation.value
+                if ooi is None:
                     self.logger.debug(
-                        "Task is not allowed to run: %s [organisation.id=%s, scheduler_id=%s]",
-                        task,
+                        "Mutation value is None, skipping %s [organisation.id=%s, scheduler_id=%s]",
+                        mutation,
                         self.organisation.id,
                         self.scheduler_id,
                     )
                     continue
 
-                try:
-                    is_running = self.is_task_running(task)
-                    if is_running:
-                        self.logger.debug(
-                            "Task is already running: %s [organisation.id=%s, scheduler_id=%s]",
-                            task,
-                            self.organisation.id,
-                            self.scheduler_id,
-                        )
-                        continue
-                except Exception as exc_running:
-                    self.logger.warning(
-                        "Could not check if task is running: %s [organisation.id=%s, scheduler_id=%s]",
-                        task,
+                # What available boefjes do we have for this ooi?
+                boefjes = self.get_boefjes_for_ooi(ooi)
+                if boefjes is None or len(boefjes) == 0:
+                    self.logger.debug(
+                        "No boefjes available for ooi %s, skipping [organisation.id=%s, scheduler_id=%s]",
+                        mutation.value,
                         self.organisation.id,
                         self.scheduler_id,
-                        exc_info=exc_running,
                     )
                     continue
 
-                try:
-                    grace_period_passed = self.has_grace_period_passed(task)
-                    if not grace_period_passed:
+                # Create a task for each boefje for this ooi
+                for boefje in boefjes:
+                    task = BoefjeTask(
+                        boefje=Boefje.parse_obj(boefje),
+                        input_ooi=ooi.primary_key,
+                        organization=self.organisation.id,
+                    )
+
+                    if not self.is_task_allowed_to_run(boefje, ooi):
                         self.logger.debug(
-                            "Task has not passed grace period: %s [organisation.id=%s, scheduler_id=%s]",
+                            "Task is not allowed to run: %s [organisation.id=%s, scheduler_id=%s]",
                             task,
                             self.organisation.id,
                             self.scheduler_id,
                         )
                         continue
-                except Exception as exc_grace_period:
-                    self.logger.warning(
-                        "Could not check if grace period has passed: %s [organisation.id=%s, scheduler_id=%s]",
-                        task,
-                        self.organisation.id,
-                        self.scheduler_id,
-                        exc_info=exc_grace_period,
-                    )
-                    continue
 
-                if self.queue.is_item_on_queue_by_hash(task.hash):
-                    self.logger.debug(
-                        "Task is already on queue: %s [organisation.id=%s, scheduler_id=%s]",
-                        task,
-                        self.organisation.id,
-                        self.scheduler_id,
-                    )
-                    continue
-
-                prior_tasks = self.ctx.task_store.get_tasks_by_hash(task.hash)
-                score = self.ranker.rank(
-                    SimpleNamespace(
-                        prior_tasks=prior_tasks,
-                        task=task,
-                    )
-                )
-
-                # We need to create a PrioritizedItem for this task, to push
-                # it to the priority queue.
-                p_item = PrioritizedItem(
-                    id=task.id,
-                    scheduler_id=self.scheduler_id,
-                    priority=score,
-                    data=task,
-                    hash=task.hash,
-                )
+                    tasks.append(task)
 
-                while not self.is_space_on_queue():
-                    self.logger.debug(
-                        "Waiting for queue to have enough space, not adding task to queue "
-                        "[queue.qsize=%d, queue.maxsize=%d, organisation.id=%s, scheduler_id=%s]",
-                        self.queue.qsize(),
-                        self.queue.maxsize,
-                        self.organisation.id,
-                        self.scheduler_id,
-                    )
-                    time.sleep(1)
+            try:
+                for p_item in self.evaluate_tasks(tasks):
+                    self.push_task(p_item, "Created boefje task")
+            except Exception:
+                self.ctx.services.scan_profile_mutation.nack(self.mutations_queue)
+                raise
 
-                self.logger.info(
-                    "Created boefje task: %s for ooi: %s "
-                    "[boefje.id=%s, ooi.primary_key=%s, organisation.id=%s, scheduler_id=%s]",
-                    boefje.name,
-                    ooi.primary_key,
-                    boefje.id,
-                    ooi.primary_key,
-                    self.organisation.id,
-                    self.scheduler_id,
-                )
+            self.ctx.services.scan_profile_mutation.ack(self.mutations_queue)
 
-                self.push_item_to_queue(p_item)
+            if processed_all:
+                return
         else:
             self.logger.warning(
                 "Boefjes queue is full, not populating with new tasks "
@@ -243,15 +281,14 @@ class BoefjeScheduler(Scheduler):
             return
 
     def push_tasks_for_random_objects(self) -> None:
-        """Push tasks for random objects from octopoes to the queue."""
+        """Push tasks for random objects from octopoes to the queue. The
+        tasks of every batch of random objects are evaluated concurrently."""
         tries = 0
         while not self.queue.full():
-            time.sleep(1)
-
             try:
                 random_oois = self.ctx.services.octopoes.get_random_objects(
                     organisation_id=self.organisation.id,
-                    n=10,
+                    n=self.POPULATE_BATCH_SIZE,
                 )
             except (requests.exceptions.RetryError, requests.exceptions.ConnectionError):
                 self.logger.warning(
@@ -271,6 +308,8 @@ class BoefjeScheduler(Scheduler):
                 )
                 break
 
+            tasks: List[BoefjeTask] = []
+            exhausted = False
             for ooi in random_oois:
                 self.logger.debug(
                     "Checking random ooi %s for rescheduling of tasks [organisation.id=%s, scheduler_id=%s]",
@@ -296,13 +335,8 @@ class BoefjeScheduler(Scheduler):
                     # will break out of the loop. We reset the tries counter to
                     # 0 when we do get new tasks from an ooi.
                     if tries >= 3:
-                        self.logger.debug(
-                            "No tasks generated for 3 tries, breaking out of loop "
-                            "[organisation.id=%s, scheduler_id=%s]",
-                            self.organisation.id,
-                            self.scheduler_id,
-                        )
-                        return
+                        exhausted = True
+                        break
 
                     task = BoefjeTask(
                         boefje=Boefje.parse_obj(boefje),
@@ -320,95 +354,36 @@ class BoefjeScheduler(Scheduler):
                         tries += 1
                         continue
 
-                    try:
-                        is_running = self.is_task_running(task)
-                        if is_running:
-                            self.logger.debug(
-                                "Task is already running: %s [organisation.id=%s, scheduler_id=%s]",
-                                task,
-                                self.organisation.id,
-                                self.scheduler_id,
-                            )
-                            continue
-                    except Exception as exc_running:
-                        self.logger.warning(
-                            "Could not check if task is running: %s [organisation.id=%s, scheduler_id=%s]",
-                            task,
-                            self.organisation.id,
-                            self.scheduler_id,
-                            exc_info=exc_running,
-                        )
-                        continue
+                    tasks.append(task)
 
-                    try:
-                        grace_period_passed = self.has_grace_period_passed(task)
-                        if not grace_period_passed:
-                            self.logger.debug(
-                                "Task has not passed grace period: %s [organisation.id=%s, scheduler_id=%s]",
-                                task,
-                                self.organisation.id,
-                                self.scheduler_id,
-                            )
-                            continue
-                    except Exception as exc_grace_period:
-                        self.logger.warning(
-                            "Could not check if grace period has passed: %s [organisation.id=%s, scheduler_id=%s]",
-                            task,
-                            self.organisation.id,
-                            self.scheduler_id,
-                            exc_info=exc_grace_period,
-                        )
-                        continue
+                if exhausted:
+                    break
 
-                    if self.queue.is_item_on_queue_by_hash(task.hash):
-                        self.logger.debug(
-                            "Task is already on queue: %s [organisation.id=%s, scheduler_id=%s]",
-                            task,
-                            self.organisation.id,
-                            self.scheduler_id,
-                        )
-                        continue
+            p_items = self.evaluate_tasks(tasks)
+            for p_item in p_items:
+                self.push_task(p_item, "Created rescheduled boefje task")
 
-                    prior_tasks = self.ctx.task_store.get_tasks_by_hash(task.hash)
-                    score = self.ranker.rank(
-                        SimpleNamespace(
-                            prior_tasks=prior_tasks,
-                            task=task,
-                        )
-                    )
-                    # We need to create a PrioritizedItem for this task, to
-                    # push it to the priority queue.
-                    p_item = PrioritizedItem(
-                        id=task.id,
-                        scheduler_id=self.scheduler_id,
-                        priority=score,
-                        data=task,
-                        hash=task.hash,
-                    )
+            # NOTE: a batch that doesn't push any tasks, e.g. because its
+            # tasks are running, queued or within their grace period, counts
+            # as a try as well.
+            if p_items:
+                tries = 0
+            elif not exhausted:
+                tries += 1
+                exhausted = tries >= 3
 
-                    while not self.is_space_on_queue():
-                        self.logger.debug(
-                            "Waiting for queue to have enough space, not adding task to queue "
-                            "[queue.qsize=%d, queue.maxsize=%d, organisation.id=%s, scheduler_id=%s]",
-                            self.queue.qsize(),
-                            self.queue.maxsize,
-                            self.organisation.id,
-                            self.scheduler_id,
-                        )
-                        time.sleep(1)
-
-                    self.logger.info(
-                        "Created rescheduled boefje task: %s for ooi: %s "
-                        "[boefje.id=%s, ooi.primary_key=%s, organisation.id=%s, scheduler_id=%s]",
-                        boefje.name,
-                        ooi.primary_key,
-                        boefje.id,
-                        ooi.primary_key,
-                        self.organisation.id,
-                        self.scheduler_id,
-                    )
+            if exhausted:
+                self.logger.debug(
+                    "No tasks generated for 3 tries, breaking out of loop [organisation.id=%s, scheduler_id=%s]",
+                    self.organisation.id,
+                    self.scheduler_id,
+                )
+                return
 
-                    self.push_item_to_queue(p_item)
+            # Don't request the next batch straight away, this returns when
+            # the scheduler is stopped.
+            if self.stop_event.wait(self.POPULATE_BATCH_INTERVAL):
+                return
         else:
             self.logger.warning(
                 "Boefjes queue is full, not populating with new tasks "
@@ -419,6 +394,170 @@ class BoefjeScheduler(Scheduler):
             )
             return
 
+    def evaluate_tasks(self, tasks: List[BoefjeTask]) -> List[PrioritizedItem]:
+        """Evaluate a batch of tasks concurrently on the populate executor,
+        so the checks of one task don't wait for the (slow) checks of the
+        tasks before it.
+
+        Args:
+            tasks: The tasks to evaluate, tasks with the same hash as a task
+                earlier in the batch, or as an item on the queue, are
+                skipped.
+
+        Returns:
+            The prioritized items of the tasks that should be pushed onto
+            the queue, ordered by priority.
+        """
+        unique: Dict[str, BoefjeTask] = {}
+        for task in tasks:
+            unique.setdefault(task.hash, task)
+
+        # Tasks that are already on the queue are looked up at once, and
+        # aren't evaluated.
+        for p_item in self.queue.get_p_items_by_hashes(list(unique.keys())):
+            if str(p_item.hash) not in unique:
+                continue
+
+            self.logger.debug(
+                "Task is already on queue: %s [organisation.id=%s, scheduler_id=%s]",
+                unique.pop(str(p_item.hash)),
+                self.organisation.id,
+                self.scheduler_id,
+            )
+
+        if not unique:
+            return []
+
+        # The latest tasks, and last runs, of the batch are looked up at once
+        states = [TaskRunState(self.ctx, task) for task in unique.values()]
+        latest = self.ctx.task_store.get_latest_by_hashes(list(unique.keys()))
+        for state in states:
+            state.latest = latest.get(state.task.hash)
+
+        try:
+            last_runs = self.ctx.services.bytes.get_last_run_boefjes(
+                [(task.boefje.id, task.input_ooi, task.organization) for task in unique.values()]
+            )
+            for state, last_run in zip(states, last_runs):
+                state.last_run = last_run
+        except Exception as exc_bytes:
+            # NOTE: the last runs are looked up per task when the batch
+            # fails, so a failure is logged for every task it affects.
+            self.logger.warning(
+                "Failed to get last runs of boefjes from bytes [organisation.id=%s, scheduler_id=%s, exc=%s]",
+                self.organisation.id,
+                self.scheduler_id,
+                exc_bytes,
+            )
+
+        p_items = [p_item for p_item in self.executor.map(self.evaluate_task, states) if p_item is not None]
+
+        # NOTE: sorting is stable, so items with the same priority keep the
+        # order in which they were found.
+        return sorted(p_items, key=lambda p_item: p_item.priority or 0)
+
+    def evaluate_task(self, state: TaskRunState) -> Optional[PrioritizedItem]:
+        """Check whether a task should be pushed onto the queue, and rank it.
+
+        Args:
+            state: The run state of the task to evaluate, which is shared by
+                the checks and the ranking of the task.
+
+        Returns:
+            The prioritized item of the task, or None when the task is
+            running or hasn't passed its grace period.
+        """
+        task = state.task
+
+        try:
+            is_running = self.is_task_running(task, state)
+            if is_running:
+                self.logger.debug(
+                    "Task is already running: %s [organisation.id=%s, scheduler_id=%s]",
+                    task,
+                    self.organisation.id,
+                    self.scheduler_id,
+                )
+                return None
+        except Exception as exc_running:
+            self.logger.warning(
+                "Could not check if task is running: %s [organisation.id=%s, scheduler_id=%s]",
+                task,
+                self.organisation.id,
+                self.scheduler_id,
+                exc_info=exc_running,
+            )
+            return None
+
+        try:
+            grace_period_passed = self.has_grace_period_passed(task, state)
+            if not grace_period_passed:
+                self.logger.debug(
+                    "Task has not passed grace period: %s [organisation.id=%s, scheduler_id=%s]",
+                    task,
+                    self.organisation.id,
+                    self.scheduler_id,
+                )
+                return None
+        except Exception as exc_grace_period:
+            self.logger.warning(
+                "Could not check if grace period has passed: %s [organisation.id=%s, scheduler_id=%s]",
+                task,
+                self.organisation.id,
+                self.scheduler_id,
+                exc_info=exc_grace_period,
+            )
+            return None
+
+        score = self.ranker.rank(
+            SimpleNamespace(
+                latest=state.latest,
+                task=task,
+            )
+        )
+
+        # We need to create a PrioritizedItem for this task, to push it to
+        # the priority queue.
+        return PrioritizedItem(
+            id=task.id,
+            scheduler_id=self.scheduler_id,
+            priority=score,
+            data=task,
+            hash=task.hash,
+        )
+
+    def push_task(self, p_item: PrioritizedItem, message: str) -> None:
+        """Push the prioritized item of an evaluated task onto the queue,
+        waiting for the queue to have space.
+
+        Args:
+            p_item: The prioritized item of the task.
+            message: The message that is logged for the created task.
+        """
+        task = BoefjeTask.parse_obj(p_item.data)
+
+        while not self.queue.wait_for_space(timeout=1):
+            self.logger.debug(
+                "Waiting for queue to have enough space, not adding task to queue "
+                "[queue.qsize=%d, queue.maxsize=%d, organisation.id=%s, scheduler_id=%s]",
+                self.queue.qsize(),
+                self.queue.maxsize,
+                self.organisation.id,
+                self.scheduler_id,
+            )
+
+        self.logger.info(
+            message + ": %s for ooi: %s [boefje.id=%s, ooi.primary_key=%s, organisation.id=%s, scheduler_id=%s]",
+            task.boefje.name,
+            task.input_ooi,
+            task.boefje.id,
+            task.input_ooi,
+            self.organisation.id,
+            self.scheduler_id,
+        )
+
+        self.push_item_to_queue(p_item)
+
     def is_task_allowed_to_run(self, boefje: Plugin, ooi: OOI) -> bool:
         """Checks whether a boefje is allowed to run on an ooi.
 
@@ -495,11 +634,22 @@ class BoefjeScheduler(Scheduler):
 
         return True
 
-    def is_task_running(self, task: BoefjeTask) -> bool:
+    def is_task_running(self, task: BoefjeTask, state: Optional[TaskRunState] = None) -> bool:
+        """Check if a task is still running according to the datastore and
+        bytes.
+
+        Args:
+            task: The task to check.
+            state: The run state of the task, when given the lookups it
+                already did are reused.
+        """
+        if state is None:
+            state = TaskRunState(self.ctx, task)
+
         # Get the last tasks that have run or are running for the hash
         # of this particular BoefjeTask.
         try:
-            task_db = self.ctx.task_store.get_latest_task_by_hash(task.hash)
+            task_db = state.latest
         except Exception as exc_db:
             self.logger.warning(
                 "Could not get latest task by hash: %s [organisation.id=%s, scheduler_id=%s]",
@@ -511,11 +661,7 @@ class BoefjeScheduler(Scheduler):
             raise exc_db
 
         try:
-            task_bytes = self.ctx.services.bytes.get_last_run_boefje(
-                boefje_id=task.boefje.id,
-                input_ooi=task.input_ooi,
-                organization_id=task.organization,
-            )
+            task_bytes = state.last_run
         except Exception as exc_bytes:
             self.logger.error(
                 "Failed to get last run boefje from bytes "
@@ -537,7 +683,7 @@ class BoefjeScheduler(Scheduler):
             self.logger.debug(
                 "Task is still running, according to the datastore "
                 "[task.id=%s, task.hash=%s, organisation.id=%s, scheduler_id=%s]",
-                task_db.id,
+                task_db.task_id,
                 task.hash,
                 self.organisation.id,
                 self.scheduler_id,
@@ -551,7 +697,7 @@ class BoefjeScheduler(Scheduler):
             self.logger.error(
                 "Task has been finished, but no results found in bytes "
                 "[task.id=%s, task.hash=%s, organisation.id=%s, scheduler_id=%s]",
-                task_db.id,
+                task_db.task_id,
                 task.hash,
                 self.organisation.id,
                 self.scheduler_id,
@@ -572,15 +718,23 @@ class BoefjeScheduler(Scheduler):
 
         return False
 
-    def has_grace_period_passed(self, task: BoefjeTask) -> bool:
+    def has_grace_period_passed(self, task: BoefjeTask, state: Optional[TaskRunState] = None) -> bool:
         """Check if the grace period has passed for a task in both the
         datastore and bytes.
 
         NOTE: We don't check the status of the task since this needs to be done
         by checking if the task is still running or not.
+
+        Args:
+            task: The task to check.
+            state: The run state of the task, when given the lookups it
+                already did are reused.
         """
+        if state is None:
+            state = TaskRunState(self.ctx, task)
+
         try:
-            task_db = self.ctx.task_store.get_latest_task_by_hash(task.hash)
+            task_db = state.latest
         except Exception as exc_db:
             self.logger.warning(
                 "Could not get latest task by hash: %s [task.hash=%s, organisation.id=%s, scheduler_id=%s]",
@@ -599,7 +753,7 @@ class BoefjeScheduler(Scheduler):
             self.logger.debug(
                 "Task has not passed grace period, according to the datastore "
                 "[task.id=%s, task.hash=%s, organisation.id=%s, scheduler_id=%s]",
-                task_db.id,
+                task_db.task_id,
                 task.hash,
                 self.organisation.id,
                 self.scheduler_id,
@@ -607,11 +761,7 @@ class BoefjeScheduler(Scheduler):
             return False
 
         try:
-            task_bytes = self.ctx.services.bytes.get_last_run_boefje(
-                boefje_id=task.boefje.id,
-                input_ooi=task.input_ooi,
-                organization_id=task.organization,
-            )
+            task_bytes = state.last_run
         except Exception as exc_bytes:
             self.logger.error(
                 "Failed to get last run boefje from bytes "
@@ -1,5 +1,5 @@
+import functools
 import logging
-import time
 from types import SimpleNamespace
 from typing import List
 
@@ -7,7 +7,15 @@ import pika
 import requests
 
 from scheduler import context, queues, rankers
-from scheduler.models import NormalizerTask, Organisation, PrioritizedItem, RawData, TaskStatus
+from scheduler.models import (
+    NormalizerMetaReceivedEvent,
+    NormalizerTask,
+    Organisation,
+    PrioritizedItem,
+    RawData,
+    RawDataReceivedEvent,
+    TaskStatus,
+)
 
 from .scheduler import Scheduler
 
@@ -39,14 +47,28 @@ class NormalizerScheduler(Scheduler):
 
         self.logger = logging.getLogger(__name__)
         self.organisation: Organisation = organisation
+        self.raw_data_queue: str = f"{organisation.id}__raw_file_received"
+        self.normalizer_meta_queue: str = f"{organisation.id}__normalizer_meta_received"
+
+    def stop(self) -> None:
+        """Stop the scheduler, and stop consuming its queues."""
+        super().stop()
+
+        self.ctx.services.raw_data.remove(self.raw_data_queue)
+        self.ctx.services.normalizer_meta.remove(self.normalizer_meta_queue)
 
     def populate_queue(self) -> None:
-        while not self.queue.full():
-            time.sleep(1)
+        """Populate the PriorityQueue with normalizer tasks for the raw data
+        that was received. Every message is acknowledged once it has been
+        processed.
 
+        The populator runs when raw data is delivered, and when items are
+        popped from the queue, the populate interval is only a fallback.
+        """
+        while not self.queue.full():
             try:
                 latest_raw_data = self.ctx.services.raw_data.get_latest_raw_data(
-                    queue=f"{self.organisation.id}__raw_file_received",
+                    queue=self.raw_data_queue,
                 )
             except (requests.exceptions.RetryError, requests.exceptions.ConnectionError):
                 self.logger.warning(
@@ -54,7 +76,7 @@ class NormalizerScheduler(Scheduler):
                     self.organisation.id,
                     self.scheduler_id,
                 )
-                continue
+                return
             except (
                 pika.exceptions.ConnectionClosed,
                 pika.exceptions.ChannelClosed,
@@ -63,15 +85,14 @@ class NormalizerScheduler(Scheduler):
             ) as e:
                 self.logger.debug(
                     "Could not connect to rabbitmq queue: %s [organisation.id=%s, scheduler_id=%s]",
-                    f"{self.organisation.id}__raw_file_received",
+                    self.raw_data_queue,
                     self.organisation.id,
                     self.scheduler_id,
                 )
                 if self.stop_event.is_set():
                     raise e
 
-                time.sleep(60)
-                continue
+                return
 
             if latest_raw_data is None:
                 self.logger.debug(
@@ -81,80 +102,83 @@ class NormalizerScheduler(Scheduler):
                 )
                 break
 
-            # Find the associated BoefjeTask (if any), the item on boefje queue
-            # has been processed, update the status of that task.
-            boefje_task_db = self.ctx.task_store.get_task_by_id(
-                latest_raw_data.raw_data.boefje_meta.id,
+            try:
+                self.process_raw_data(latest_raw_data)
+            except Exception:
+                self.ctx.services.raw_data.nack(self.raw_data_queue)
+                raise
+
+            self.ctx.services.raw_data.ack(self.raw_data_queue)
+        else:
+            self.logger.warning(
+                "Normalizer queue is full, not populating with new tasks "
+                "[queue.qsize=%d, organisation.id=%s, scheduler_id=%s]",
+                self.queue.qsize(),
+                self.organisation.id,
+                self.scheduler_id,
             )
-            if boefje_task_db is None:
-                self.logger.debug(
-                    "Could not find boefje task in database "
-                    "[raw_data.boefje_meta.id_id=%s, organisation.id=%s, scheduler_id=%s]",
-                    latest_raw_data.raw_data.boefje_meta.id,
-                    self.organisation.id,
-                    self.scheduler_id,
-                )
+            return
 
-            # Check status of the job and update status of boefje tasks, and
-            # stop creating normalizer tasks.
-            if boefje_task_db is not None:
-                status = TaskStatus.COMPLETED
-                for mime_type in latest_raw_data.raw_data.mime_types:
-                    if mime_type.get("value", "").startswith("error/"):
-                        status = TaskStatus.FAILED
-                        break
+    def process_raw_data(self, latest_raw_data: RawDataReceivedEvent) -> None:
+        """Update the status of the boefje task of received raw data, and
+        push normalizer tasks for the raw data onto the queue."""
+        # Find the associated BoefjeTask (if any), the item on boefje queue
+        # has been processed, update the status of that task.
+        # Check status of the job and update status of boefje tasks, and
+        # stop creating normalizer tasks.
+        status = TaskStatus.COMPLETED
+        for mime_type in latest_raw_data.raw_data.mime_types:
+            if mime_type.get("value", "").startswith("error/"):
+                status = TaskStatus.FAILED
+                break
 
-                boefje_task_db.status = status
-                self.ctx.task_store.update_task(boefje_task_db)
+        boefje_task_id = latest_raw_data.raw_data.boefje_meta.id
+        if not self.ctx.task_store.set_status([boefje_task_id], status):
+            self.logger.debug(
+                "Could not find boefje task in database "
+                "[raw_data.boefje_meta.id_id=%s, organisation.id=%s, scheduler_id=%s]",
+                boefje_task_id,
+                self.organisation.id,
+                self.scheduler_id,
+            )
+        else:
+            self.logger.info(
+                "Updated boefje task (%s) status to %s in datastore "
+                "[task.id=%s, organisation.id=%s, scheduler_id=%s]",
+                boefje_task_id,
+                status,
+                boefje_task_id,
+                self.organisation.id,
+                self.scheduler_id,
+            )
 
+            if status == TaskStatus.FAILED:
                 self.logger.info(
-                    "Updated boefje task (%s) status to %s in datastore "
+                    "Boefje task (%s) failed, stop creating normalizer tasks "
                     "[task.id=%s, organisation.id=%s, scheduler_id=%s]",
-                    boefje_task_db.id,
-                    status,
-                    boefje_task_db.id,
+                    boefje_task_id,
+                    boefje_task_id,
                     self.organisation.id,
                     self.scheduler_id,
                 )
+                return
 
-                if status == TaskStatus.FAILED:
-                    self.logger.info(
-                        "Boefje task (%s) failed, stop creating normalizer tasks "
-                        "[task.id=%s, organisation.id=%s, scheduler_id=%s]",
-                        boefje_task_db.id,
-                        boefje_task_db.id,
-                        self.organisation.id,
-                        self.scheduler_id,
-                    )
-                    continue
-
-            p_items = self.create_tasks_for_raw_data(latest_raw_data.raw_data)
-            if not p_items:
-                continue
-
-            # NOTE: maxsize 0 means unlimited
-            while len(p_items) > (self.queue.maxsize - self.queue.qsize()) and self.queue.maxsize != 0:
-                self.logger.debug(
-                    "Waiting for queue to have enough space, not adding %d tasks to queue "
-                    "[queue.qsize=%d, queue.maxsize=%d, organisation.id=%s, scheduler_id=%s]",
-                    len(p_items),
-                    self.queue.qsize(),
-                    self.queue.maxsize,
-                    self.organisation.id,
-                    self.scheduler_id,
-                )
-                time.sleep(1)
+        p_items = self.create_tasks_for_raw_data(latest_raw_data.raw_data)
+        if not p_items:
+            return
 
-            self.push_items_to_queue(p_items)
-        else:
-            self.logger.warning(
-                "Normalizer queue is full, not populating with new tasks "
-                "[queue.qsize=%d, organisation.id=%s, scheduler_id=%s]",
+        while not self.queue.wait_for_space(len(p_items), timeout=1):
+            self.logger.debug(
+                "Waiting for queue to have enough space, not adding %d tasks to queue "
+                "[queue.qsize=%d, queue.maxsize=%d, organisation.id=%s, scheduler_id=%s]",
+                len(p_items),
                 self.queue.qsize(),
+                self.queue.maxsize,
                 self.organisation.id,
                 self.scheduler_id,
             )
-            return
+
+        self.push_items_to_queue(p_items)
 
     def create_tasks_for_raw_data(self, raw_data: RawData) -> List[PrioritizedItem]:
         """Create normalizer tasks for every boefje that has been processed,
@@ -247,39 +271,51 @@ class NormalizerScheduler(Scheduler):
 
         return p_items
 
-    def update_normalizer_task_status(self):
-        try:
-            latest_normalizer_meta = self.ctx.services.normalizer_meta.get_latest_normalizer_meta(
-                queue=f"{self.organisation.id}__normalizer_meta_received",
-            )
-        except (
-            pika.exceptions.ConnectionClosed,
-            pika.exceptions.ChannelClosed,
-            pika.exceptions.ChannelClosedByBroker,
-            pika.exceptions.AMQPConnectionError,
-        ) as e:
-            self.logger.debug(
-                "Could not connect to rabbitmq queue: %s [organisation.id=%s, scheduler_id=%s]",
-                f"{self.organisation.id}__normalizer_meta_received",
-                self.organisation.id,
-                self.scheduler_id,
-            )
-            if self.stop_event.is_set():
-                raise e
+    def update_normalizer_task_status(self) -> None:
+        """Set the normalizer tasks of the received normalizer meta to
+        completed, until there are no messages left on the queue. Every
+        message is acknowledged once the status has been updated."""
+        while not self.stop_event.is_set():
+            try:
+                latest_normalizer_meta = self.ctx.services.normalizer_meta.get_latest_normalizer_meta(
+                    queue=self.normalizer_meta_queue,
+                )
+            except (
+                pika.exceptions.ConnectionClosed,
+                pika.exceptions.ChannelClosed,
+                pika.exceptions.ChannelClosedByBroker,
+                pika.exceptions.AMQPConnectionError,
+            ) as e:
+                self.logger.debug(
+                    "Could not connect to rabbitmq queue: %s [organisation.id=%s, scheduler_id=%s]",
+                    self.normalizer_meta_queue,
+                    self.organisation.id,
+                    self.scheduler_id,
+                )
+                if self.stop_event.is_set():
+                    raise e
 
-            time.sleep(10)
-            return
+                return
 
-        if latest_normalizer_meta is None:
-            self.logger.debug(
-                "No new normalizer meta found on message queue: %s [organisation.id=%s, scheduler_id=%s]",
-                f"{self.organisation.id}__normalizer_meta_received",
-                self.organisation.id,
-                self.scheduler_id,
-            )
-            time.sleep(10)
-            return
+            if latest_normalizer_meta is None:
+                self.logger.debug(
+                    "No new normalizer meta found on message queue: %s [organisation.id=%s, scheduler_id=%s]",
+                    self.normalizer_meta_queue,
+                    self.organisation.id,
+                    self.scheduler_id,
+                )
+                return
+
+            try:
+                self.process_normalizer_meta(latest_normalizer_meta)
+            except Exception:
+                self.ctx.services.normalizer_meta.nack(self.normalizer_meta_queue)
+                raise
+
+            self.ctx.services.normalizer_meta.ack(self.normalizer_meta_queue)
 
+    def process_normalizer_meta(self, latest_normalizer_meta: NormalizerMetaReceivedEvent) -> None:
+        """Set the normalizer task of received normalizer meta to completed."""
         self.logger.debug(
             "Received normalizer meta %s "
             "[normalizer.id=%s, latest_normalizer_meta=%s, organisation.id=%s, scheduler_id=%s]",
@@ -290,10 +326,8 @@ class NormalizerScheduler(Scheduler):
             self.scheduler_id,
         )
 
-        normalizer_task_db = self.ctx.task_store.get_task_by_id(
-            latest_normalizer_meta.normalizer_meta.id,
-        )
-        if normalizer_task_db is None:
+        normalizer_task_id = latest_normalizer_meta.normalizer_meta.id
+        if not self.ctx.task_store.set_status([normalizer_task_id], TaskStatus.COMPLETED):
             self.logger.warning(
                 "Could not find normalizer task in database "
                 "[normalizer_meta_id=%s, latest_normalizer_meta=%s, organisation.id=%s, scheduler_id=%s]",
@@ -304,14 +338,11 @@ class NormalizerScheduler(Scheduler):
             )
             return
 
-        normalizer_task_db.status = TaskStatus.COMPLETED
-        self.ctx.task_store.update_task(normalizer_task_db)
-
         self.logger.info(
             "Updated normalizer task (%s) status to %s in datastore [task.id=%s, organisation.id=%s, scheduler_id=%s]",
-            normalizer_task_db.id,
-            normalizer_task_db.status,
-            normalizer_task_db.id,
+            normalizer_task_id,
+            TaskStatus.COMPLETED,
+            normalizer_task_id,
             self.organisation.id,
             self.scheduler_id,
         )
@@ -319,7 +350,19 @@ class NormalizerScheduler(Scheduler):
     def run(self) -> None:
         super().run()
 
+        # The messages are processed when they're delivered, the populate
+        # interval is only a fallback.
         self.run_in_thread(
             name="update_normalizer_task_status",
             func=self.update_normalizer_task_status,
+            interval=self.ctx.config.pq_populate_interval,
+        )
+
+        self.ctx.services.raw_data.add_callback(
+            self.raw_data_queue,
+            functools.partial(self.wake_thread, "populator"),
+        )
+        self.ctx.services.normalizer_meta.add_callback(
+            self.normalizer_meta_queue,
+            functools.partial(self.wake_thread, "update_normalizer_task_status"),
         )
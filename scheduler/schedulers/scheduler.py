@@ -1,8 +1,8 @@
 import abc
 import logging
 import threading
-import traceback
-from datetime import datetime, timezone
+import time
+from datetime import datetime, timedelta, timezone
 from typing import Any, Callable, Dict, List, Optional
 
 from scheduler import context, models, queues, rankers, utils
@@ -37,6 +37,11 @@ class Scheduler(abc.ABC):
             concurrently.
         stop_event: A threading.Event object used for communicating a stop
             event across threads.
+        push_condition:
+            A threading.Condition that is notified when items are pushed
+            onto the queue, used to wake up callers waiting to pop.
+        push_count:
+            The number of times items have been pushed onto the queue.
     """
 
     organisation: models.Organisation
@@ -75,13 +80,17 @@ class Scheduler(abc.ABC):
         self.threads: Dict[str, thread.ThreadRunner] = {}
         self.stop_event: threading.Event = self.ctx.stop_event
 
+        self.push_condition: threading.Condition = threading.Condition()
+        self.push_count: int = 0
+
     @abc.abstractmethod
     def populate_queue(self) -> None:
         raise NotImplementedError
 
     def post_push(self, p_item: models.PrioritizedItem) -> None:
         """When a boefje task is being added to the queue. We
-        persist a task to the datastore with the status QUEUED
+        persist a task to the datastore with the status QUEUED, or update
+        the task when it already exists.
 
         Args:
             p_item: The prioritized item to post-add to queue.
@@ -92,57 +101,238 @@ class Scheduler(abc.ABC):
             id=p_item.id,
             scheduler_id=self.scheduler_id,
             type=self.queue.item_type.type,
+            hash=p_item.hash,
             p_item=p_item,
             status=models.TaskStatus.QUEUED,
             created_at=datetime.now(timezone.utc),
             modified_at=datetime.now(timezone.utc),
         )
 
-        task_db = self.ctx.task_store.get_task_by_id(str(p_item.id))
-        if task_db is not None:
-            self.ctx.task_store.update_task(task)
-            return
-
-        self.ctx.task_store.create_task(task)
+        self.ctx.task_store.upsert_task(task)
 
     def post_pop(self, p_item: models.PrioritizedItem) -> None:
-        """When a boefje task is being removed from the queue. We
-        persist a task to the datastore with the status RUNNING
+        """When a boefje task is being removed from the queue.
+
+        NOTE: the status of the task is set to DISPATCHED by the pq_store in
+        the same transaction that removes the item from the queue, so we
+        don't need to update the task in the datastore here.
 
         Args:
             p_item: The prioritized item to post-pop from queue.
         """
-        # NOTE: we set the id of the task the same as the p_item, for easier
-        # lookup.
-        task = self.ctx.task_store.get_task_by_id(str(p_item.id))
-        if task is None:
-            self.logger.error(
-                "Task %s not found in datastore, not updating status [task_id = %s]",
-                p_item.data.get("id"),
-                p_item.data.get("id"),
-            )
+        self.logger.debug(
+            "Popped item (%s) from queue %s [p_item.id=%s, queue.pq_id=%s]",
+            p_item.id,
+            self.queue.pq_id,
+            p_item.id,
+            self.queue.pq_id,
+        )
+
+    def pop_item_from_queue(
+        self, filters: Optional[List[models.Filter]] = None, wait: float = 0
+    ) -> Optional[models.PrioritizedItem]:
+        """Pop an item from the queue.
+
+        Args:
+            filters: A list of filters the item needs to match.
+            wait: The number of seconds to wait for an item to be pushed
+                when no item could be popped.
+
+        Returns:
+            A PrioritizedItem instance.
+        """
+        p_items = self._pop_with_wait(lambda: self.queue.pop(filters, self._lease_expires_at()), wait)
+        if not p_items:
             return None
 
-        task.status = models.TaskStatus.DISPATCHED
-        self.ctx.task_store.update_task(task)
+        self.post_pop(p_items[0])
+        self._wake_populator(len(p_items))
 
-        return None
+        return p_items[0]
 
-    def pop_item_from_queue(self, filters: Optional[List[models.Filter]] = None) -> Optional[models.PrioritizedItem]:
-        """Pop an item from the queue.
+    def pop_items_from_queue(
+        self, n: int, filters: Optional[List[models.Filter]] = None, wait: float = 0
+    ) -> List[models.PrioritizedItem]:
+        """Pop up to `n` items from the queue.
+
+        Args:
+            n: The maximum number of items to pop.
+            filters: A list of filters the items need to match.
+            wait: The number of seconds to wait for items to be pushed
+                when no item could be popped.
 
         Returns:
-            A PrioritizedItem instance.
+            A list of PrioritizedItem instances, ordered by priority.
         """
-        try:
-            p_item = self.queue.pop(filters)
-        except queues.QueueEmptyError as exc:
-            raise exc
+        p_items = self._pop_with_wait(lambda: self.queue.pop_many(n, filters, self._lease_expires_at()), wait)
 
-        if p_item is not None:
+        for p_item in p_items:
             self.post_pop(p_item)
 
-        return p_item
+        self._wake_populator(len(p_items))
+
+        return p_items
+
+    def _wake_populator(self, popped: int) -> None:
+        """Wake up the populator when popping `popped` items made space on a
+        queue that was full, so it doesn't wait for its interval to pass
+        before filling the queue again."""
+        if not popped or not self.queue.maxsize:
+            return
+
+        if self.queue.qsize() + popped >= self.queue.maxsize:
+            self.wake_thread("populator")
+
+    def _pop_with_wait(self, pop: Callable[[], Any], wait: float) -> List[models.PrioritizedItem]:
+        """Pop from the queue, and when nothing could be popped wait up to
+        `wait` seconds for an item to be pushed, and try again.
+
+        Raises:
+            QueueEmptyError: If the queue is still empty after waiting.
+        """
+        deadline = time.monotonic() + wait
+        while True:
+            # NOTE: we take the push count before popping, so a push that
+            # happens in between popping and waiting isn't missed.
+            push_count = self.push_count
+
+            try:
+                result = pop()
+            except queues.QueueEmptyError:
+                if time.monotonic() >= deadline:
+                    raise
+
+                result = None
+
+            if result:
+                return result if isinstance(result, list) else [result]
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return []
+
+            self.wait_for_push(push_count, remaining)
+
+    def _lease_expires_at(self) -> Optional[datetime]:
+        """Return the deadline of a lease that starts now, or None when leases
+        are disabled."""
+        if self.ctx.config.pq_lease_duration <= 0:
+            return None
+
+        return datetime.now(timezone.utc) + timedelta(seconds=self.ctx.config.pq_lease_duration)
+
+    def ack_task(self, task_id: str) -> Optional[models.Task]:
+        """Acknowledge that a leased task has been handled, this releases the
+        lease and sets the status of the task to COMPLETED.
+
+        Args:
+            task_id: The id of the task.
+
+        Returns:
+            The updated task, or None when the task doesn't hold a lease.
+        """
+        task = self.ctx.task_store.release_lease(task_id, models.TaskStatus.COMPLETED)
+        if task is None:
+            return None
+
+        self.logger.debug(
+            "Acknowledged task %s [task.id=%s, scheduler_id=%s]",
+            task_id,
+            task_id,
+            self.scheduler_id,
+        )
+
+        return task
+
+    def nack_task(self, task_id: str, requeue: bool = True) -> Optional[models.Task]:
+        """Hand back a leased task that couldn't be handled, this releases the
+        lease and puts the task back on the queue with its original priority.
+        When `requeue` is False the status of the task is set to FAILED
+        instead.
+
+        Args:
+            task_id: The id of the task.
+            requeue: Whether to put the task back on the queue.
+
+        Returns:
+            The updated task, or None when the task doesn't hold a lease.
+        """
+        if not requeue:
+            return self.ctx.task_store.release_lease(task_id, models.TaskStatus.FAILED)
+
+        if not self.queue.requeue(task_id):
+            return None
+
+        self.logger.debug(
+            "Requeued task %s [task.id=%s, scheduler_id=%s]",
+            task_id,
+            task_id,
+            self.scheduler_id,
+        )
+
+        self.notify_push()
+
+        return self.ctx.task_store.get_task_by_id(task_id)
+
+    def heartbeat_task(self, task_id: str) -> Optional[models.Task]:
+        """Extend the lease of a task, to signal that the task is still being
+        handled.
+
+        Args:
+            task_id: The id of the task.
+
+        Returns:
+            The updated task, or None when the task doesn't hold a lease.
+        """
+        lease_expires_at = self._lease_expires_at()
+        if lease_expires_at is None:
+            return None
+
+        return self.ctx.task_store.update_lease(task_id, lease_expires_at)
+
+    def requeue_expired_leases(self, batch_size: int = 1000) -> None:
+        """Put the tasks of which the lease has expired back on the queue with
+        their original priority, in batches of `batch_size` tasks."""
+        now = datetime.now(timezone.utc)
+
+        count = 0
+        while True:
+            released = self.queue.requeue_expired(now, batch_size)
+            count += released
+
+            if released < batch_size:
+                break
+
+        if count == 0:
+            return
+
+        self.logger.info(
+            "Released %d expired leases of queue %s [queue.pq_id=%s, count=%d, queue.qsize=%d]",
+            count,
+            self.queue.pq_id,
+            self.queue.pq_id,
+            count,
+            self.queue.qsize(),
+        )
+
+        self.notify_push()
+
+    def notify_push(self) -> None:
+        """Signal that items have been pushed onto the queue, this wakes up
+        the callers that are waiting to pop an item."""
+        with self.push_condition:
+            self.push_count += 1
+            self.push_condition.notify_all()
+
+    def wait_for_push(self, push_count: int, timeout: float) -> bool:
+        """Wait up to `timeout` seconds for items to be pushed onto the
+        queue after `push_count` was read.
+
+        Returns:
+            True when items have been pushed, False on timeout.
+        """
+        with self.push_condition:
+            return self.push_condition.wait_for(lambda: self.push_count != push_count, timeout)
 
     def push_item_to_queue(self, p_item: models.PrioritizedItem) -> None:
         """Push an item to the queue.
@@ -191,42 +381,90 @@ class Scheduler(abc.ABC):
 
         self.post_push(p_item)
 
-    def push_items_to_queue(self, p_items: List[models.PrioritizedItem]) -> None:
-        """Add items to a priority queue.
+        self.notify_push()
+
+    def post_push_many(self, p_items: List[models.PrioritizedItem]) -> None:
+        """When a batch of tasks is being added to the queue. We persist the
+        tasks to the datastore with the status QUEUED, and update the tasks
+        that already exist, in one go.
 
         Args:
-            pq: The priority queue to add items to.
-            items: The items to add to the queue.
+            p_items: The prioritized items to post-add to queue.
         """
-        count = 0
-        for p_item in p_items:
-            try:
-                self.push_item_to_queue(p_item)
-            except (
-                queues.errors.NotAllowedError,
-                queues.errors.QueueFullError,
-                queues.errors.InvalidPrioritizedItemError,
-            ):
-                self.logger.debug(
-                    "Unable to push item to queue %s [queue_id=%s, qsize=%d, item=%s, exc=%s]",
-                    self.queue.pq_id,
-                    self.queue.pq_id,
-                    self.queue.qsize(),
-                    p_item,
-                    traceback.format_exc(),
-                )
+        if not p_items:
+            return
+
+        now = datetime.now(timezone.utc)
+
+        # NOTE: we set the id of the task the same as the p_item, for easier
+        # lookup.
+        tasks = [
+            models.Task(
+                id=p_item.id,
+                scheduler_id=self.scheduler_id,
+                type=self.queue.item_type.type,
+                hash=p_item.hash,
+                p_item=p_item,
+                status=models.TaskStatus.QUEUED,
+                created_at=now,
+                modified_at=now,
+            )
+            for p_item in p_items
+        ]
+
+        self.ctx.task_store.upsert_tasks(tasks)
+
+    def push_items_to_queue(self, p_items: List[models.PrioritizedItem]) -> List[models.PushResult]:
+        """Add a batch of items to the priority queue.
+
+        Args:
+            p_items: The items to add to the queue.
+
+        Returns:
+            A list of PushResult objects, one for every item in `p_items`.
+        """
+        try:
+            results = self.queue.push_many(p_items)
+        except Exception as exc:
+            self.logger.error(
+                "Unable to push items to queue %s [queue_id=%s, qsize=%d, count=%d]",
+                self.queue.pq_id,
+                self.queue.pq_id,
+                self.queue.qsize(),
+                len(p_items),
+            )
+            raise exc
+
+        pushed: List[models.PrioritizedItem] = []
+        for result in results:
+            if result.status in (models.PushStatus.CREATED, models.PushStatus.UPDATED) and result.p_item is not None:
+                pushed.append(result.p_item)
                 continue
-            except Exception as exc:
-                self.logger.error(
-                    "Unable to push item to queue %s [queue_id=%s, qsize=%d, item=%s]",
-                    self.queue.pq_id,
-                    self.queue.pq_id,
-                    self.queue.qsize(),
-                    p_item,
-                )
-                raise exc
-
-            count += 1
+
+            self.logger.debug(
+                "Unable to push item to queue %s [queue_id=%s, status=%s, item=%s, detail=%s]",
+                self.queue.pq_id,
+                self.queue.pq_id,
+                result.status,
+                result.p_item,
+                result.detail,
+            )
+
+        self.logger.info(
+            "Pushed %d of %d items to queue %s [queue.pq_id=%s, queue.qsize=%d]",
+            len(pushed),
+            len(p_items),
+            self.queue.pq_id,
+            self.queue.pq_id,
+            self.queue.qsize(),
+        )
+
+        self.post_push_many(pushed)
+
+        if pushed:
+            self.notify_push()
+
+        return results
 
     def run_in_thread(
         self,
@@ -251,6 +489,17 @@ class Scheduler(abc.ABC):
         )
         self.threads[name].start()
 
+    def wake_thread(self, name: str) -> None:
+        """Run the function of a thread right away, instead of waiting for
+        its interval to pass.
+
+        Args:
+            name: The name of the thread.
+        """
+        runner = self.threads.get(name)
+        if runner is not None:
+            runner.wake()
+
     def stop(self) -> None:
         """Stop the scheduler."""
         for t in self.threads.values():
@@ -267,6 +516,14 @@ class Scheduler(abc.ABC):
                 interval=self.ctx.config.pq_populate_interval,
             )
 
+        # Lease sweeper
+        if self.ctx.config.pq_lease_duration > 0:
+            self.run_in_thread(
+                name="lease_sweeper",
+                func=self.requeue_expired_leases,
+                interval=self.ctx.config.pq_lease_sweep_interval,
+            )
+
     def dict(self) -> Dict[str, Any]:
         return {
             "id": self.scheduler_id,
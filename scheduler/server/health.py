@@ -0,0 +1,98 @@
+import datetime
+import logging
+from concurrent import futures
+from typing import Any, Dict, Optional
+
+from scheduler import context, utils
+
+
+class HealthChecker:
+    """Probes the health of the external services of the scheduler. The
+    probes run periodically in the background, and the health endpoint of
+    the server serves the result of the last probes, so requests to the
+    health endpoint don't make requests to the external services.
+
+    Attributes:
+        logger:
+            The logger for the class.
+        ctx:
+            Application context of shared data (e.g. configuration, external
+            services connections).
+        externals:
+            A dict of the health of every external service at the last probe,
+            keyed by service name.
+        checked_at:
+            The datetime of the last probe, None when the services weren't
+            probed yet.
+        single_flight:
+            A utils.SingleFlight that coalesces concurrent probes.
+    """
+
+    def __init__(self, ctx: context.AppContext) -> None:
+        self.logger: logging.Logger = logging.getLogger(__name__)
+        self.ctx: context.AppContext = ctx
+        self.externals: Dict[str, bool] = {}
+        self.checked_at: Optional[datetime.datetime] = None
+        self.single_flight: utils.SingleFlight = utils.SingleFlight()
+
+    def run(self) -> None:
+        """Probe the external services, used as the target of the thread of
+        the health checker."""
+        try:
+            self.probe()
+        except Exception as exc:
+            # NOTE: an exception would stop the thread, and with that the
+            # scheduler.
+            self.logger.warning("Could not probe the health of the external services [exc=%s]", exc)
+
+    def probe(self) -> Dict[str, bool]:
+        """Probe all external services concurrently, and update the cached
+        result. Concurrent calls share one probe.
+
+        Returns:
+            A dict of the health of every external service, keyed by service
+            name.
+        """
+        return self.single_flight.do("probe", self._probe)
+
+    def _probe(self) -> Dict[str, bool]:
+        services = [service for service in self.ctx.services.__dict__.values() if hasattr(service, "is_healthy")]
+        if not services:
+            externals: Dict[str, bool] = {}
+        else:
+            with futures.ThreadPoolExecutor(max_workers=len(services), thread_name_prefix="health_probe") as executor:
+                externals = dict(
+                    zip(
+                        [service.name for service in services],
+                        executor.map(self._probe_service, services),
+                    )
+                )
+
+        self.externals = externals
+        self.checked_at = datetime.datetime.now(datetime.timezone.utc)
+
+        unhealthy = [name for name, healthy in externals.items() if not healthy]
+        if unhealthy:
+            self.logger.warning("External services are unhealthy [services=%s]", unhealthy)
+
+        return externals
+
+    def _probe_service(self, service: Any) -> bool:
+        try:
+            return bool(service.is_healthy())
+        except Exception as exc:
+            self.logger.warning(
+                "Could not probe the health of %s [service=%s, exc=%s]",
+                service.name,
+                service.name,
+                exc,
+            )
+            return False
+
+    def get(self) -> Dict[str, bool]:
+        """Return the cached result of the last probe, and probe the services
+        when they weren't probed yet."""
+        if self.checked_at is None:
+            return self.probe()
+
+        return self.externals
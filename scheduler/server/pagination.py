@@ -1,3 +1,6 @@
+import base64
+import binascii
+import json
 from typing import Any, List, Optional
 
 from fastapi import Request
@@ -5,12 +8,39 @@ from pydantic import BaseModel
 
 
 class PaginatedResponse(BaseModel):
-    count: int
+    count: Optional[int]
     next: Optional[str]
     previous: Optional[str]
     results: List[Any]
 
 
+class CursorPaginatedResponse(BaseModel):
+    next: Optional[str]
+    results: List[Any]
+
+
+def encode_cursor(values: List[Any]) -> str:
+    """Encode the sort key of the last item of a page into an opaque cursor."""
+    return base64.urlsafe_b64encode(json.dumps(values, default=str).encode()).decode()
+
+
+def decode_cursor(cursor: str) -> List[Any]:
+    """Decode a cursor created by `encode_cursor`.
+
+    Raises:
+        ValueError: If the cursor is invalid.
+    """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (binascii.Error, UnicodeDecodeError, json.JSONDecodeError) as exc:
+        raise ValueError("invalid cursor") from exc
+
+    if not isinstance(values, list):
+        raise ValueError("invalid cursor")
+
+    return values
+
+
 def create_next_url(request: Request, offset: int, limit: int, count: int) -> Optional[str]:
     if offset + limit <= count:
         return str(request.url.include_query_params(limit=limit, offset=offset + limit))
@@ -25,10 +55,47 @@ def create_previous_url(request: Request, offset: int, limit: int) -> Optional[s
     return None
 
 
-def paginate(request: Request, items: List[Any], count: int, offset: int, limit: int) -> PaginatedResponse:
+def paginate(
+    request: Request,
+    items: List[Any],
+    count: Optional[int],
+    offset: int,
+    limit: int,
+    next_cursor: Optional[str] = None,
+) -> PaginatedResponse:
+    """Create a page of results. When `next_cursor` is given, or the page was
+    requested by cursor, the next page is linked by cursor, otherwise by
+    offset. When `count` is None, the next page is linked when this page is
+    full."""
+    if next_cursor is not None or "cursor" in request.query_params:
+        next_url: Optional[str] = None
+        if next_cursor is not None:
+            next_url = str(
+                request.url.remove_query_params("offset").include_query_params(limit=limit, cursor=next_cursor)
+            )
+
+        # NOTE: cursors only point forward
+        previous_url = None
+    else:
+        next_url = create_next_url(request, offset, limit, count if count is not None else offset + len(items))
+        previous_url = create_previous_url(request, offset, limit)
+
     return PaginatedResponse(
         count=count,
-        next=create_next_url(request, offset, limit, count),
-        previous=create_previous_url(request, offset, limit),
+        next=next_url,
+        previous=previous_url,
+        results=items,
+    )
+
+
+def paginate_cursor(
+    request: Request, items: List[Any], next_cursor: Optional[str], limit: int
+) -> CursorPaginatedResponse:
+    next_url = None
+    if next_cursor is not None:
+        next_url = str(request.url.include_query_params(limit=limit, cursor=next_cursor))
+
+    return CursorPaginatedResponse(
+        next=next_url,
         results=items,
     )
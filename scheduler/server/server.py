@@ -1,12 +1,23 @@
 import datetime
+import functools
 import logging
 from typing import Any, Dict, List, Optional, Union
 
+import anyio
 import fastapi
 import uvicorn
 from scheduler import context, models, queues, schedulers, version
+from scheduler.connectors import services
 
-from .pagination import PaginatedResponse, paginate
+from .health import HealthChecker
+from .pagination import (
+    CursorPaginatedResponse,
+    PaginatedResponse,
+    decode_cursor,
+    encode_cursor,
+    paginate,
+    paginate_cursor,
+)
 
 
 class Server:
@@ -20,6 +31,8 @@ class Server:
         self.logger: logging.Logger = logging.getLogger(__name__)
         self.ctx: context.AppContext = ctx
         self.schedulers: Dict[str, schedulers.Scheduler] = s
+        self.health_checker: HealthChecker = HealthChecker(ctx)
+        self.pop_limiter: Optional[anyio.CapacityLimiter] = None
 
         self.api = fastapi.FastAPI()
 
@@ -38,6 +51,14 @@ class Server:
             status_code=200,
         )
 
+        self.api.add_api_route(
+            path="/startup",
+            endpoint=self.startup,
+            methods=["GET"],
+            response_model=models.Startup,
+            status_code=200,
+        )
+
         self.api.add_api_route(
             path="/schedulers",
             endpoint=self.get_schedulers,
@@ -94,6 +115,30 @@ class Server:
             status_code=200,
         )
 
+        self.api.add_api_route(
+            path="/tasks/{task_id}/ack",
+            endpoint=self.ack_task,
+            methods=["POST"],
+            response_model=models.Task,
+            status_code=200,
+        )
+
+        self.api.add_api_route(
+            path="/tasks/{task_id}/nack",
+            endpoint=self.nack_task,
+            methods=["POST"],
+            response_model=models.Task,
+            status_code=200,
+        )
+
+        self.api.add_api_route(
+            path="/tasks/{task_id}/heartbeat",
+            endpoint=self.heartbeat_task,
+            methods=["POST"],
+            response_model=models.Task,
+            status_code=200,
+        )
+
         self.api.add_api_route(
             path="/queues",
             endpoint=self.get_queues,
@@ -110,11 +155,19 @@ class Server:
             status_code=200,
         )
 
+        self.api.add_api_route(
+            path="/queues/{queue_id}/items",
+            endpoint=self.list_queue_items,
+            methods=["GET"],
+            response_model=CursorPaginatedResponse,
+            status_code=200,
+        )
+
         self.api.add_api_route(
             path="/queues/{queue_id}/pop",
             endpoint=self.pop_queue,
             methods=["GET"],
-            response_model=Optional[models.PrioritizedItem],
+            response_model=Union[models.PrioritizedItem, List[models.PrioritizedItem], None],
             status_code=200,
         )
 
@@ -125,21 +178,48 @@ class Server:
             status_code=201,
         )
 
+        self.api.add_api_route(
+            path="/queues/{queue_id}/push_many",
+            endpoint=self.push_queue_many,
+            methods=["POST"],
+            response_model=List[models.PushResult],
+            status_code=201,
+        )
+
     def root(self) -> Any:
         return None
 
-    def health(self) -> Any:
+    def health(self, deep: bool = False) -> Any:
+        """Return the health of the scheduler, and of its external services
+        at the last probe. With `deep` the external services are probed
+        first."""
+        externals = self.health_checker.probe() if deep else self.health_checker.get()
+
         response = models.ServiceHealth(
             service="scheduler",
             healthy=True,
             version=version.__version__,
+            externals=externals,
+            checked_at=self.health_checker.checked_at,
         )
 
-        for service in self.ctx.services.__dict__.values():
-            response.externals[service.name] = service.is_healthy()
+        # The number of requests to the external services that were made,
+        # and that were coalesced with an identical request in flight.
+        response.additional = {
+            "requests": {
+                service.name: service.single_flight.stats()
+                for service in self.ctx.services.__dict__.values()
+                if isinstance(service, services.HTTPService)
+            }
+        }
 
         return response
 
+    def startup(self) -> Any:
+        """Return the duration of the phases of the startup of the
+        scheduler."""
+        return models.Startup(**self.ctx.startup.dict())
+
     def get_schedulers(self) -> Any:
         return [models.Scheduler(**s.dict()) for s in self.schedulers.values()]
 
@@ -195,12 +275,25 @@ class Server:
         min_created_at: Union[datetime.datetime, None] = None,
         max_created_at: Union[datetime.datetime, None] = None,
         filters: Optional[List[models.Filter]] = None,
+        cursor: Optional[str] = None,
+        count: models.CountMode = models.CountMode.EXACT,
     ) -> Any:
         try:
             if (min_created_at is not None and max_created_at is not None) and min_created_at > max_created_at:
                 raise ValueError("min_date must be less than max_date")
 
-            results, count = self.ctx.task_store.get_tasks(
+            if cursor is not None and offset != 0:
+                raise ValueError("offset can't be combined with cursor")
+
+            after = None
+            if cursor is not None:
+                try:
+                    created_at, task_id = decode_cursor(cursor)
+                    after = (datetime.datetime.fromisoformat(created_at), str(task_id))
+                except (ValueError, TypeError) as exc:
+                    raise ValueError("invalid cursor") from exc
+
+            results, total = self.ctx.task_store.get_tasks(
                 scheduler_id=scheduler_id,
                 type=type,
                 status=status,
@@ -209,6 +302,8 @@ class Server:
                 min_created_at=min_created_at,
                 max_created_at=max_created_at,
                 filters=filters,
+                after=after,
+                count=count,
             )
         except ValueError as exc:
             raise fastapi.HTTPException(
@@ -222,7 +317,15 @@ class Server:
                 detail="failed to get tasks",
             ) from exc
 
-        return paginate(request, results, count=count, offset=offset, limit=limit)
+        # NOTE: pages that aren't requested by offset link to the next page
+        # by a cursor that points to the last task of this page, this is
+        # served from the index regardless of how deep the page is.
+        next_cursor = None
+        if offset == 0 and results and len(results) == limit:
+            last = results[-1]
+            next_cursor = encode_cursor([last.created_at.isoformat(), str(last.id)])
+
+        return paginate(request, results, count=total, offset=offset, limit=limit, next_cursor=next_cursor)
 
     def get_task(self, task_id: str) -> Any:
         try:
@@ -270,6 +373,10 @@ class Server:
 
         updated_task = task_db.copy(update=item)
 
+        # A task that isn't dispatched or running anymore doesn't hold a lease
+        if updated_task.status not in (models.TaskStatus.DISPATCHED, models.TaskStatus.RUNNING):
+            updated_task.lease_expires_at = None
+
         # Update task in database
         try:
             self.ctx.task_store.update_task(updated_task)
@@ -282,6 +389,95 @@ class Server:
 
         return updated_task
 
+    def ack_task(self, task_id: str) -> Any:
+        s = self._get_task_scheduler(task_id)
+
+        try:
+            task = s.ack_task(task_id)
+        except Exception as exc:
+            self.logger.exception(exc)
+            raise fastapi.HTTPException(
+                status_code=500,
+                detail="failed to acknowledge task",
+            ) from exc
+
+        if task is None:
+            raise fastapi.HTTPException(
+                status_code=409,
+                detail="task doesn't hold a lease",
+            )
+
+        return task
+
+    def nack_task(self, task_id: str, requeue: bool = True) -> Any:
+        s = self._get_task_scheduler(task_id)
+
+        try:
+            task = s.nack_task(task_id, requeue=requeue)
+        except Exception as exc:
+            self.logger.exception(exc)
+            raise fastapi.HTTPException(
+                status_code=500,
+                detail="failed to requeue task",
+            ) from exc
+
+        if task is None:
+            raise fastapi.HTTPException(
+                status_code=409,
+                detail="task doesn't hold a lease",
+            )
+
+        return task
+
+    def heartbeat_task(self, task_id: str) -> Any:
+        s = self._get_task_scheduler(task_id)
+
+        try:
+            task = s.heartbeat_task(task_id)
+        except Exception as exc:
+            self.logger.exception(exc)
+            raise fastapi.HTTPException(
+                status_code=500,
+                detail="failed to extend lease of task",
+            ) from exc
+
+        if task is None:
+            raise fastapi.HTTPException(
+                status_code=409,
+                detail="task doesn't hold a lease",
+            )
+
+        return task
+
+    def _get_task_scheduler(self, task_id: str) -> schedulers.Scheduler:
+        """Return the scheduler of a task.
+
+        Raises:
+            fastapi.HTTPException: When the task or its scheduler is not found.
+        """
+        try:
+            task = self.ctx.task_store.get_task_by_id(task_id)
+        except ValueError as exc:
+            raise fastapi.HTTPException(
+                status_code=400,
+                detail=str(exc),
+            ) from exc
+
+        if task is None:
+            raise fastapi.HTTPException(
+                status_code=404,
+                detail="task not found",
+            )
+
+        s = self.schedulers.get(task.scheduler_id)
+        if s is None:
+            raise fastapi.HTTPException(
+                status_code=404,
+                detail="scheduler not found",
+            )
+
+        return s
+
     def get_queues(self) -> Any:
         return [models.Queue(**s.queue.dict()) for s in self.schedulers.values()]
 
@@ -302,7 +498,13 @@ class Server:
 
         return models.Queue(**q.dict())
 
-    def pop_queue(self, queue_id: str, filters: Optional[List[models.Filter]] = None) -> Any:
+    def list_queue_items(
+        self,
+        request: fastapi.Request,
+        queue_id: str,
+        limit: int = 10,
+        cursor: Optional[str] = None,
+    ) -> Any:
         s = self.schedulers.get(queue_id)
         if s is None:
             raise fastapi.HTTPException(
@@ -310,10 +512,119 @@ class Server:
                 detail="queue not found",
             )
 
+        if limit < 1:
+            raise fastapi.HTTPException(
+                status_code=400,
+                detail="limit must be greater than 0",
+            )
+
+        try:
+            after = None
+            if cursor is not None:
+                priority, created_at, item_id = decode_cursor(cursor)
+                after = (priority, datetime.datetime.fromisoformat(created_at), item_id)
+
+            p_items = s.queue.get_items(limit, after)
+        except (ValueError, TypeError) as exc:
+            raise fastapi.HTTPException(
+                status_code=400,
+                detail="invalid cursor",
+            ) from exc
+
+        # NOTE: when the page is full there might be more items, the cursor
+        # points to the last item of this page.
+        next_cursor = None
+        if len(p_items) == limit:
+            last = p_items[-1]
+            next_cursor = encode_cursor([last.priority, last.created_at.isoformat(), str(last.id)])
+
+        return paginate_cursor(request, p_items, next_cursor=next_cursor, limit=limit)
+
+    async def pop_queue(
+        self,
+        queue_id: str,
+        filters: Optional[List[models.Filter]] = None,
+        n: Optional[int] = None,
+        wait: float = 0,
+    ) -> Any:
+        s = self.schedulers.get(queue_id)
+        if s is None:
+            raise fastapi.HTTPException(
+                status_code=404,
+                detail="queue not found",
+            )
+
+        # When `wait` is given we block for at most `wait` seconds until an
+        # item is pushed onto the queue, instead of returning immediately.
+        if wait < 0 or wait > self.ctx.config.pq_pop_max_wait:
+            raise fastapi.HTTPException(
+                status_code=400,
+                detail=f"wait must be between 0 and {self.ctx.config.pq_pop_max_wait} seconds",
+            )
+
+        # When `n` is given we return a list of at most `n` items, instead
+        # of a single item.
+        if n is not None and n < 1:
+            raise fastapi.HTTPException(
+                status_code=400,
+                detail="n must be greater than 0",
+            )
+
+        # NOTE: waiting pops run on threads of their own, bounded by
+        # `pq_pop_max_waiters`, so idle runners don't take up the threadpool
+        # that serves the other endpoints, e.g. the pushes that wake them up.
+        # When all waiters are taken, we pop without waiting.
+        limiter = self._pop_limiter()
+        if wait > 0 and (limiter is None or limiter.available_tokens < 1):
+            self.logger.debug(
+                "Too many callers waiting to pop, popping without waiting [queue_id=%s, max_waiters=%s]",
+                queue_id,
+                self.ctx.config.pq_pop_max_waiters,
+            )
+            wait = 0
+
+        return await anyio.to_thread.run_sync(
+            functools.partial(self._pop_queue, s, filters, n, wait),
+            limiter=limiter if wait > 0 else None,
+        )
+
+    def _pop_limiter(self) -> Optional[anyio.CapacityLimiter]:
+        # NOTE: the limiter is bound to the event loop, so it is created
+        # when it is first used.
+        if self.pop_limiter is None and self.ctx.config.pq_pop_max_waiters > 0:
+            self.pop_limiter = anyio.CapacityLimiter(self.ctx.config.pq_pop_max_waiters)
+
+        return self.pop_limiter
+
+    def _pop_queue(
+        self,
+        s: schedulers.Scheduler,
+        filters: Optional[List[models.Filter]],
+        n: Optional[int],
+        wait: float,
+    ) -> Any:
+        if n is not None:
+            try:
+                p_items = s.pop_items_from_queue(n, filters, wait=wait)
+            except queues.QueueEmptyError:
+                return []
+            except ValueError as exc:
+                raise fastapi.HTTPException(
+                    status_code=400,
+                    detail=str(exc),
+                ) from exc
+
+            return [models.PrioritizedItem(**p_item.dict()) for p_item in p_items]
+
         try:
-            p_item = s.pop_item_from_queue(filters)
+            p_item = s.pop_item_from_queue(filters, wait=wait)
         except queues.QueueEmptyError:
             return None
+        except ValueError as exc:
+            raise fastapi.HTTPException(
+                status_code=400,
+                detail=str(exc),
+            ) from exc
 
         if p_item is None:
             raise fastapi.HTTPException(
@@ -332,14 +643,7 @@ class Server:
             )
 
         try:
-            p_item = models.PrioritizedItem(**item.dict())
-            if p_item.scheduler_id is None:
-                p_item.scheduler_id = s.scheduler_id
-
-            if s.queue.item_type == models.BoefjeTask:
-                p_item.data = models.BoefjeTask(**p_item.data).dict()
-            elif s.queue.item_type == models.NormalizerTask:
-                p_item.data = models.NormalizerTask(**p_item.data).dict()
+            p_item = self._create_p_item(s, item)
         except Exception as exc:
             raise fastapi.HTTPException(
                 status_code=400,
@@ -366,6 +670,51 @@ class Server:
 
         return models.PrioritizedItem(**p_item.dict())
 
+    def push_queue_many(self, queue_id: str, items: List[models.PrioritizedItem]) -> Any:
+        s = self.schedulers.get(queue_id)
+        if s is None:
+            raise fastapi.HTTPException(
+                status_code=404,
+                detail="queue not found",
+            )
+
+        # Items that can't be converted to the item type of the queue are
+        # reported as invalid, the rest of the batch is pushed in one go.
+        results: List[Optional[models.PushResult]] = []
+        p_items: List[models.PrioritizedItem] = []
+        for item in items:
+            try:
+                p_items.append(self._create_p_item(s, item))
+                results.append(None)
+            except Exception as exc:
+                results.append(models.PushResult(status=models.PushStatus.INVALID, p_item=item, detail=str(exc)))
+
+        try:
+            pushed = iter(s.push_items_to_queue(p_items))
+        except Exception as exc:
+            self.logger.exception(exc)
+            raise fastapi.HTTPException(
+                status_code=500,
+                detail="failed to push items",
+            ) from exc
+
+        return [result if result is not None else next(pushed) for result in results]
+
+    def _create_p_item(self, s: schedulers.Scheduler, item: models.PrioritizedItem) -> models.PrioritizedItem:
+        """Create a PrioritizedItem for the queue of the scheduler, with the
+        data converted to the item type of the queue.
+        """
+        p_item = models.PrioritizedItem(**item.dict())
+        if p_item.scheduler_id is None:
+            p_item.scheduler_id = s.scheduler_id
+
+        if s.queue.item_type == models.BoefjeTask:
+            p_item.data = models.BoefjeTask(**p_item.data).dict()
+        elif s.queue.item_type == models.NormalizerTask:
+            p_item.data = models.NormalizerTask(**p_item.data).dict()
+
+        return p_item
+
     def run(self) -> None:
         uvicorn.run(
             self.api,
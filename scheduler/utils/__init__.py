@@ -1,3 +1,6 @@
+from .cache import Cache
 from .datastore import GUID
 from .dict_utils import ExpiredError, ExpiringDict, deep_get
+from .phases import PhaseTimer
+from .singleflight import SingleFlight
 from .thread import ThreadRunner
@@ -0,0 +1,215 @@
+import math
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, List, NamedTuple, Optional
+
+
+class _Entry(NamedTuple):
+    value: Any
+    expires_at: Optional[float]
+    size: int
+
+
+class _Stripe:
+    """A part of the cache with its own lock, its entries are ordered from
+    least to most recently used."""
+
+    def __init__(self) -> None:
+        self.lock: threading.Lock = threading.Lock()
+        self.entries: "OrderedDict[Hashable, _Entry]" = OrderedDict()
+        self.size: int = 0
+        self.hits: int = 0
+        self.misses: int = 0
+        self.evictions: int = 0
+        self.expirations: int = 0
+
+
+# Stored for keys of which the value is known to be absent, when negative
+# caching is enabled.
+_NEGATIVE = object()
+
+_MISSING = object()
+
+
+class Cache:
+    """A thread-safe cache with a time-to-live per key, and least recently
+    used eviction when it exceeds a number of entries or an estimate of the
+    number of bytes of its values.
+
+    The keys are spread over stripes by their hash, every stripe has its
+    own lock, so threads using different keys rarely wait for each other.
+    The bounds and the LRU order are kept per stripe, so eviction is an
+    approximation of global LRU.
+
+    Attributes:
+        ttl:
+            Default number of seconds after which an entry expires, None
+            means entries don't expire.
+        maxsize:
+            Maximum number of entries, None means unbounded.
+        maxbytes:
+            Maximum estimate of the number of bytes of the values, None means
+            unbounded.
+        sizeof:
+            Function that estimates the number of bytes of a value.
+        negative_ttl:
+            Number of seconds to remember that a loader didn't find a value
+            (returned None), None disables negative caching.
+    """
+
+    def __init__(
+        self,
+        ttl: Optional[float] = 300,
+        maxsize: Optional[int] = None,
+        maxbytes: Optional[int] = None,
+        sizeof: Callable[[Any], int] = sys.getsizeof,
+        negative_ttl: Optional[float] = None,
+        stripes: int = 16,
+    ) -> None:
+        self.ttl: Optional[float] = ttl
+        self.maxsize: Optional[int] = maxsize
+        self.maxbytes: Optional[int] = maxbytes
+        self.sizeof: Callable[[Any], int] = sizeof
+        self.negative_ttl: Optional[float] = negative_ttl
+
+        # NOTE: every stripe holds at least one entry, so with bounds that
+        # are smaller than the number of stripes, we use fewer stripes.
+        n = max(1, min(stripes, maxsize or stripes))
+        self.stripes: List[_Stripe] = [_Stripe() for _ in range(n)]
+        self.stripe_maxsize: Optional[int] = math.ceil(maxsize / n) if maxsize is not None else None
+        self.stripe_maxbytes: Optional[int] = math.ceil(maxbytes / n) if maxbytes is not None else None
+
+    def _stripe(self, key: Hashable) -> _Stripe:
+        return self.stripes[hash(key) % len(self.stripes)]
+
+    def _lookup(self, key: Hashable) -> Any:
+        """Return the value of a key, _NEGATIVE when it is negatively cached,
+        or _MISSING when it isn't cached."""
+        stripe = self._stripe(key)
+        with stripe.lock:
+            entry = stripe.entries.get(key)
+            if entry is None:
+                stripe.misses += 1
+                return _MISSING
+
+            if entry.expires_at is not None and entry.expires_at <= time.monotonic():
+                del stripe.entries[key]
+                stripe.size -= entry.size
+                stripe.expirations += 1
+                stripe.misses += 1
+                return _MISSING
+
+            stripe.entries.move_to_end(key)
+            stripe.hits += 1
+
+            return entry.value
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Return the value of a key, or `default` when it isn't cached, has
+        expired, or is negatively cached."""
+        value = self._lookup(key)
+        if value is _MISSING or value is _NEGATIVE:
+            return default
+
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = _MISSING) -> None:  # type: ignore
+        """Cache the value of a key.
+
+        Args:
+            key: The key.
+            value: The value.
+            ttl:
+                Number of seconds after which the entry expires, defaults to
+                the ttl of the cache. None means the entry doesn't expire.
+        """
+        if ttl is _MISSING:
+            ttl = self.ttl
+
+        size = 0 if value is _NEGATIVE else self.sizeof(value)
+        expires_at = time.monotonic() + ttl if ttl is not None else None
+
+        stripe = self._stripe(key)
+        with stripe.lock:
+            previous = stripe.entries.pop(key, None)
+            if previous is not None:
+                stripe.size -= previous.size
+
+            stripe.entries[key] = _Entry(value, expires_at, size)
+            stripe.size += size
+
+            # Evict the least recently used entries, but never the entry
+            # that was just set.
+            while len(stripe.entries) > 1 and (
+                (self.stripe_maxsize is not None and len(stripe.entries) > self.stripe_maxsize)
+                or (self.stripe_maxbytes is not None and stripe.size > self.stripe_maxbytes)
+            ):
+                _, evicted = stripe.entries.popitem(last=False)
+                stripe.size -= evicted.size
+                stripe.evictions += 1
+
+    def get_or_load(self, key: Hashable, loader: Callable[[], Any], ttl: Optional[float] = _MISSING) -> Any:  # type: ignore
+        """Return the value of a key, and load and cache it when it isn't
+        cached.
+
+        When negative caching is enabled and the loader returns None, that is
+        remembered for `negative_ttl` seconds, and the loader isn't called
+        again for the key in the meantime.
+
+        NOTE: concurrent misses of the same key each call the loader, use
+        utils.SingleFlight in the loader to coalesce them.
+        """
+        value = self._lookup(key)
+        if value is _NEGATIVE:
+            return None
+
+        if value is not _MISSING:
+            return value
+
+        value = loader()
+        if value is None:
+            if self.negative_ttl is not None:
+                self.set(key, _NEGATIVE, ttl=self.negative_ttl)
+
+            return None
+
+        self.set(key, value, ttl)
+
+        return value
+
+    def delete(self, key: Hashable) -> None:
+        stripe = self._stripe(key)
+        with stripe.lock:
+            entry = stripe.entries.pop(key, None)
+            if entry is not None:
+                stripe.size -= entry.size
+
+    def clear(self) -> None:
+        for stripe in self.stripes:
+            with stripe.lock:
+                stripe.entries.clear()
+                stripe.size = 0
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self.get(key, _MISSING) is not _MISSING
+
+    def __len__(self) -> int:
+        """Return the number of entries, including expired entries that
+        weren't removed yet."""
+        return sum(len(stripe.entries) for stripe in self.stripes)
+
+    def stats(self) -> Dict[str, int]:
+        """Return the metrics of the cache."""
+        stats = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0, "entries": 0, "bytes": 0}
+        for stripe in self.stripes:
+            with stripe.lock:
+                stats["hits"] += stripe.hits
+                stats["misses"] += stripe.misses
+                stats["evictions"] += stripe.evictions
+                stats["expirations"] += stripe.expirations
+                stats["entries"] += len(stripe.entries)
+                stats["bytes"] += stripe.size
+
+        return stats
@@ -17,9 +17,15 @@ class ExpiringDict:
     """ExpiringDict enables us to create a Dict that expires after a certain
     time. It will clear the cache when the expiration time is reached and
     return an ExpiredError.
+
+    NOTE: prefer utils.Cache, which expires keys individually and is bounded
+    in size.
     """
 
-    def __init__(self, lifetime: int = 300, start_time: datetime = datetime.now(timezone.utc)) -> None:
+    def __init__(self, lifetime: int = 300, start_time: Optional[datetime] = None) -> None:
+        if start_time is None:
+            start_time = datetime.now(timezone.utc)
+
         self.lifetime: timedelta = timedelta(seconds=lifetime)
         self.start_time = start_time
         self.expiration_time: datetime = start_time + self.lifetime
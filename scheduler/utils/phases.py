@@ -0,0 +1,95 @@
+import contextlib
+import datetime
+import logging
+import threading
+import time
+from typing import Any, Dict, Iterator, List, Optional
+
+
+class PhaseTimer:
+    """Records the duration of the phases of a process, e.g. the startup of
+    the scheduler. Phases can run concurrently, every phase is logged when
+    it is done.
+
+    Attributes:
+        logger:
+            The logger for the class.
+        name:
+            The name of the process.
+        started_at:
+            The datetime the process started.
+        finished_at:
+            The datetime the process finished, None while it is running.
+        phases:
+            A list of dicts with the name, start, duration and the error of
+            every phase, in the order the phases started.
+    """
+
+    def __init__(self, name: str) -> None:
+        self.logger: logging.Logger = logging.getLogger(__name__)
+        self.name: str = name
+        self.started_at: datetime.datetime = datetime.datetime.now(datetime.timezone.utc)
+        self.finished_at: Optional[datetime.datetime] = None
+        self.phases: List[Dict[str, Any]] = []
+        self.lock: threading.Lock = threading.Lock()
+        self._start: float = time.perf_counter()
+
+    @contextlib.contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """Time the phase that runs within the context."""
+        phase: Dict[str, Any] = {
+            "name": name,
+            "started_at": datetime.datetime.now(datetime.timezone.utc),
+            "duration": None,
+            "error": None,
+        }
+        with self.lock:
+            self.phases.append(phase)
+
+        start = time.perf_counter()
+        try:
+            yield
+        except BaseException as exc:
+            phase["error"] = str(exc) or exc.__class__.__name__
+            raise
+        finally:
+            phase["duration"] = time.perf_counter() - start
+            self.logger.info(
+                "Phase %s of %s done in %.2f seconds [name=%s, phase=%s, duration=%s, error=%s]",
+                name,
+                self.name,
+                phase["duration"],
+                self.name,
+                name,
+                phase["duration"],
+                phase["error"],
+            )
+
+    def finish(self) -> None:
+        """Mark the process as finished."""
+        self.finished_at = datetime.datetime.now(datetime.timezone.utc)
+        self.logger.info(
+            "Finished %s in %.2f seconds [name=%s, duration=%s]",
+            self.name,
+            self.duration(),
+            self.name,
+            self.duration(),
+        )
+
+    def duration(self) -> float:
+        """Return the number of seconds the process ran, or has been running
+        for when it didn't finish yet."""
+        if self.finished_at is None:
+            return time.perf_counter() - self._start
+
+        return (self.finished_at - self.started_at).total_seconds()
+
+    def dict(self) -> Dict[str, Any]:
+        with self.lock:
+            return {
+                "name": self.name,
+                "started_at": self.started_at,
+                "finished_at": self.finished_at,
+                "duration": self.duration(),
+                "phases": [dict(phase) for phase in self.phases],
+            }
@@ -0,0 +1,66 @@
+import threading
+from concurrent import futures
+from typing import Any, Callable, Dict, Hashable
+
+
+class SingleFlight:
+    """SingleFlight coalesces concurrent calls with the same key into a
+    single call. The first caller of a key makes the call, the callers that
+    arrive while it is in flight wait for it, and share its result or
+    error. Calls that arrive after it finished make a new call.
+
+    Attributes:
+        lock:
+            A threading.Lock that guards the calls in flight and the
+            counters.
+        in_flight:
+            A dict of the futures of the calls in flight, keyed by key.
+        calls:
+            The number of calls that were made.
+        coalesced:
+            The number of calls that shared the result of a call in flight,
+            instead of making their own.
+    """
+
+    def __init__(self) -> None:
+        self.lock: threading.Lock = threading.Lock()
+        self.in_flight: Dict[Hashable, futures.Future] = {}
+        self.calls: int = 0
+        self.coalesced: int = 0
+
+    def do(self, key: Hashable, func: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        """Call `func(*args, **kwargs)`, unless a call with the same key is
+        in flight, in which case its result is returned, or its error is
+        raised."""
+        with self.lock:
+            in_flight = self.in_flight.get(key)
+            if in_flight is None:
+                future: futures.Future = futures.Future()
+                self.in_flight[key] = future
+                self.calls += 1
+            else:
+                self.coalesced += 1
+
+        if in_flight is not None:
+            return in_flight.result()
+
+        try:
+            result = func(*args, **kwargs)
+        except BaseException as exc:
+            with self.lock:
+                del self.in_flight[key]
+
+            future.set_exception(exc)
+            raise
+
+        with self.lock:
+            del self.in_flight[key]
+
+        future.set_result(result)
+
+        return result
+
+    def stats(self) -> Dict[str, int]:
+        """Return the counters of the calls."""
+        with self.lock:
+            return {"calls": self.calls, "coalesced": self.coalesced}
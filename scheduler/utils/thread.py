@@ -1,5 +1,6 @@
 import logging
 import threading
+import time
 from typing import Any, Callable, Optional
 
 
@@ -14,12 +15,19 @@ class ThreadRunner(threading.Thread):
         stop_event:
             A threading.Event object used for signalling thread stop events.
         interval:
-            A float describing the time between loop iterations.
+            A float describing the maximum time between loop iterations.
+        wake_event:
+            A threading.Event that is set to run the next loop iteration
+            right away, instead of waiting for the interval to pass.
         exception:
             A python Exception that can be set in order to signify that
             an exception has occured during the execution of the thread.
     """
 
+    # Maximum number of seconds between checks of the stop event while
+    # waiting for the interval to pass.
+    STOP_CHECK_INTERVAL: float = 1.0
+
     def __init__(
         self,
         target: Callable[[], Any],
@@ -30,6 +38,7 @@ class ThreadRunner(threading.Thread):
         self.logger: logging.Logger = logging.getLogger(__name__)
         self.stop_event: threading.Event = stop_event
         self.interval: float = interval
+        self.wake_event: threading.Event = threading.Event()
         self.exception: Optional[Exception] = None
         self._target: Callable[[], Any] = target
 
@@ -44,15 +53,35 @@ class ThreadRunner(threading.Thread):
                 self.logger.exception(e)
                 self.stop()
 
-            self.stop_event.wait(self.interval)
+            self._wait()
+
+    def _wait(self) -> None:
+        """Wait for the interval to pass, or until the thread is woken up or
+        stopped. The stop event can be shared by many threads, and is set
+        without waking them up, so it is checked at least every
+        STOP_CHECK_INTERVAL seconds."""
+        deadline = time.monotonic() + self.interval
+        while not self.stop_event.is_set():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or self.wake_event.wait(min(remaining, self.STOP_CHECK_INTERVAL)):
+                break
+
+        self.wake_event.clear()
+
+    def wake(self) -> None:
+        """Run the next loop iteration right away. When the target is
+        running, it is run again after it is done."""
+        self.wake_event.set()
 
     def join(self, timeout: Optional[float] = None) -> None:
         self.logger.debug("Stopping thread")
 
         self.stop_event.set()
+        self.wake_event.set()
         super().join(timeout)
 
         self.logger.debug("Thread stopped")
 
     def stop(self) -> None:
         self.stop_event.set()
+        self.wake_event.set()
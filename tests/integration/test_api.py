@@ -1,9 +1,14 @@
 import copy
 import json
+import threading
+import time
 import unittest
 import uuid
-from datetime import datetime, timedelta
+from concurrent import futures
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
 from unittest import mock
+from urllib.parse import parse_qs, urlparse
 
 from fastapi.testclient import TestClient
 from scheduler import config, models, queues, rankers, repositories, schedulers, server
@@ -93,6 +98,46 @@ class APITestCase(APITemplateTestCase):
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response.json().get("id"), self.scheduler.scheduler_id)
 
+    def test_get_queue_summary(self):
+        for priority in [3, 1, 2]:
+            self.scheduler.push_item_to_queue(create_p_item(self.organisation.id, priority))
+
+        response = self.client.get(f"/queues/{self.scheduler.scheduler_id}")
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(3, response.json().get("size"))
+        self.assertEqual(1, response.json().get("min_priority"))
+        self.assertEqual(3, response.json().get("max_priority"))
+        self.assertNotIn("pq", response.json())
+
+    def test_list_queue_items(self):
+        items = [create_p_item(self.organisation.id, priority) for priority in [4, 0, 3, 1, 2]]
+        for item in items:
+            self.scheduler.push_item_to_queue(item)
+
+        # Follow the next links until all items are retrieved
+        priorities = []
+        url = f"/queues/{self.scheduler.scheduler_id}/items?limit=2"
+        while url is not None:
+            response = self.client.get(url)
+            self.assertEqual(200, response.status_code)
+            self.assertLessEqual(len(response.json()["results"]), 2)
+
+            priorities.extend([p_item.get("priority") for p_item in response.json()["results"]])
+            url = response.json()["next"]
+
+        self.assertEqual([0, 1, 2, 3, 4], priorities)
+
+        # Listing items should not remove them from the queue
+        self.assertEqual(5, self.scheduler.queue.qsize())
+
+    def test_list_queue_items_invalid_cursor(self):
+        response = self.client.get(f"/queues/{self.scheduler.scheduler_id}/items?cursor=invalid")
+        self.assertEqual(400, response.status_code)
+
+    def test_list_queue_items_not_found(self):
+        response = self.client.get("/queues/123/items")
+        self.assertEqual(404, response.status_code)
+
     def test_push_queue(self):
         self.assertEqual(0, self.scheduler.queue.qsize())
 
@@ -337,11 +382,260 @@ class APITestCase(APITemplateTestCase):
         self.assertEqual(str(second_item.id), response.json().get("id"))
         self.assertEqual(0, self.scheduler.queue.qsize())
 
+    def test_push_queue_many(self):
+        items = [create_p_item(self.organisation.id, priority) for priority in [0, 1, 2]]
+
+        response = self.client.post(
+            f"/queues/{self.scheduler.scheduler_id}/push_many",
+            json=[json.loads(item.json()) for item in items],
+        )
+        self.assertEqual(201, response.status_code)
+        self.assertEqual(["created"] * 3, [result.get("status") for result in response.json()])
+        self.assertEqual(3, self.scheduler.queue.qsize())
+
+        # Tasks should be created
+        for item in items:
+            task = self.client.get(f"/tasks/{item.id}").json()
+            self.assertEqual("queued", task.get("status"))
+
+    def test_push_queue_many_queue_full(self):
+        self.scheduler.queue.maxsize = 2
+
+        items = [create_p_item(self.organisation.id, priority) for priority in [0, 1, 2]]
+
+        response = self.client.post(
+            f"/queues/{self.scheduler.scheduler_id}/push_many",
+            json=[json.loads(item.json()) for item in items],
+        )
+        self.assertEqual(201, response.status_code)
+        self.assertEqual(
+            ["created", "created", "queue_full"],
+            [result.get("status") for result in response.json()],
+        )
+        self.assertEqual(2, self.scheduler.queue.qsize())
+
+    def test_push_queue_many_partial(self):
+        """Items that are not allowed or invalid should be reported per item,
+        and the other items should still be pushed.
+        """
+        first_item = create_p_item(self.organisation.id, 0)
+        response = self.client.post(f"/queues/{self.scheduler.scheduler_id}/push", json=json.loads(first_item.json()))
+        self.assertEqual(201, response.status_code)
+
+        # Same item with a different priority, priority updates not allowed
+        self.scheduler.queue.allow_priority_updates = False
+        updated_item = first_item.copy()
+        updated_item.priority = 1
+
+        second_item = create_p_item(self.organisation.id, 2)
+
+        response = self.client.post(
+            f"/queues/{self.scheduler.scheduler_id}/push_many",
+            json=[
+                json.loads(updated_item.json()),
+                {"priority": 3, "data": {"unknown": "data"}},
+                json.loads(second_item.json()),
+            ],
+        )
+        self.assertEqual(201, response.status_code)
+        self.assertEqual(
+            ["not_allowed", "invalid", "created"],
+            [result.get("status") for result in response.json()],
+        )
+        self.assertEqual(2, self.scheduler.queue.qsize())
+
+    def test_push_queue_many_not_found(self):
+        response = self.client.post("/queues/123/push_many", json=[])
+        self.assertEqual(404, response.status_code)
+
     def test_pop_empty(self):
         """When queue is empty it should return an empty response"""
         response = self.client.get(f"/queues/{self.scheduler.scheduler_id}/pop")
         self.assertEqual(200, response.status_code)
 
+    def test_pop_queue_filters_invalid(self):
+        item = create_p_item(self.organisation.id, 0)
+        response = self.client.post(f"/queues/{self.scheduler.scheduler_id}/push", json=json.loads(item.json()))
+        self.assertEqual(response.status_code, 201)
+
+        response = self.client.get(
+            f"/queues/{self.scheduler.scheduler_id}/pop", json=[{"field": "name", "operator": "lt", "value": ["a"]}]
+        )
+        self.assertEqual(400, response.status_code)
+        self.assertEqual(1, self.scheduler.queue.qsize())
+
+    def test_pop_queue_wait(self):
+        """When popping from an empty queue with wait, the request should
+        block until an item is pushed."""
+        item = create_p_item(self.organisation.id, 0)
+
+        timer = threading.Timer(0.2, self.scheduler.push_item_to_queue, args=(item,))
+        timer.start()
+
+        start = time.monotonic()
+        response = self.client.get(f"/queues/{self.scheduler.scheduler_id}/pop?wait=5")
+        timer.join()
+
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(str(item.id), response.json().get("id"))
+        self.assertLess(time.monotonic() - start, 5)
+        self.assertEqual(0, self.scheduler.queue.qsize())
+
+    def test_pop_queue_many_wait(self):
+        items = [create_p_item(self.organisation.id, priority) for priority in [0, 1]]
+
+        timer = threading.Timer(0.2, self.scheduler.push_items_to_queue, args=(items,))
+        timer.start()
+
+        response = self.client.get(f"/queues/{self.scheduler.scheduler_id}/pop?n=5&wait=5")
+        timer.join()
+
+        self.assertEqual(200, response.status_code)
+        self.assertEqual([str(item.id) for item in items], [p_item.get("id") for p_item in response.json()])
+
+    def test_pop_queue_wait_timeout(self):
+        """When no item is pushed while waiting, the queue is still empty."""
+        start = time.monotonic()
+        response = self.client.get(f"/queues/{self.scheduler.scheduler_id}/pop?wait=0.2")
+
+        self.assertEqual(200, response.status_code)
+        self.assertIsNone(response.json())
+        self.assertGreaterEqual(time.monotonic() - start, 0.2)
+
+    def test_pop_queue_wait_max_waiters(self):
+        """When the maximum number of callers are waiting, popping doesn't
+        wait."""
+        self.mock_ctx.config.pq_pop_max_waiters = 0
+
+        start = time.monotonic()
+        response = self.client.get(f"/queues/{self.scheduler.scheduler_id}/pop?wait=5")
+
+        self.assertEqual(200, response.status_code)
+        self.assertIsNone(response.json())
+        self.assertLess(time.monotonic() - start, 5)
+
+    def test_pop_queue_wait_concurrent(self):
+        """Callers waiting to pop don't block the other endpoints."""
+
+        def pop():
+            return self.client.get(f"/queues/{self.scheduler.scheduler_id}/pop?wait=5")
+
+        with futures.ThreadPoolExecutor(max_workers=10) as executor:
+            waiters = [executor.submit(pop) for _ in range(10)]
+            time.sleep(0.5)
+
+            start = time.monotonic()
+            response = self.client.get("/schedulers")
+            self.assertEqual(200, response.status_code)
+            self.assertLess(time.monotonic() - start, 2)
+
+            items = [create_p_item(self.organisation.id, 0) for _ in range(10)]
+            self.scheduler.push_items_to_queue(items)
+
+            popped = {waiter.result().json()["id"] for waiter in waiters}
+
+        self.assertEqual({str(item.id) for item in items}, popped)
+
+    def test_pop_queue_wait_invalid(self):
+        response = self.client.get(f"/queues/{self.scheduler.scheduler_id}/pop?wait=-1")
+        self.assertEqual(400, response.status_code)
+
+        response = self.client.get(f"/queues/{self.scheduler.scheduler_id}/pop?wait=3600")
+        self.assertEqual(400, response.status_code)
+
+    def test_pop_queue_many(self):
+        # Add three tasks to the queue
+        for priority in [2, 0, 1]:
+            item = create_p_item(self.organisation.id, priority)
+            response = self.client.post(f"/queues/{self.scheduler.scheduler_id}/push", json=json.loads(item.json()))
+            self.assertEqual(response.status_code, 201)
+
+        self.assertEqual(3, self.scheduler.queue.qsize())
+
+        # Should get the two items with the highest priority, in order
+        response = self.client.get(f"/queues/{self.scheduler.scheduler_id}/pop?n=2")
+        self.assertEqual(200, response.status_code)
+        self.assertEqual([0, 1], [p_item.get("priority") for p_item in response.json()])
+        self.assertEqual(1, self.scheduler.queue.qsize())
+
+        # Tasks should be dispatched
+        for p_item in response.json():
+            task = self.client.get(f"/tasks/{p_item.get('id')}").json()
+            self.assertEqual("dispatched", task.get("status"))
+
+        # Should get the remaining item, even though more are requested
+        response = self.client.get(f"/queues/{self.scheduler.scheduler_id}/pop?n=2")
+        self.assertEqual(200, response.status_code)
+        self.assertEqual([2], [p_item.get("priority") for p_item in response.json()])
+        self.assertEqual(0, self.scheduler.queue.qsize())
+
+    def test_pop_queue_many_filters(self):
+        first_item = create_p_item(self.organisation.id, 0, data=functions.TestModel(id="123", name="test"))
+        second_item = create_p_item(self.organisation.id, 1, data=functions.TestModel(id="456", name="other"))
+        third_item = create_p_item(self.organisation.id, 2, data=functions.TestModel(id="789", name="test"))
+        for item in [first_item, second_item, third_item]:
+            response = self.client.post(f"/queues/{self.scheduler.scheduler_id}/push", json=json.loads(item.json()))
+            self.assertEqual(response.status_code, 201)
+
+        response = self.client.get(
+            f"/queues/{self.scheduler.scheduler_id}/pop?n=10",
+            json=[{"field": "name", "operator": "eq", "value": "test"}],
+        )
+        self.assertEqual(200, response.status_code)
+        self.assertEqual([str(first_item.id), str(third_item.id)], [p_item.get("id") for p_item in response.json()])
+        self.assertEqual(1, self.scheduler.queue.qsize())
+
+    def test_pop_queue_many_empty(self):
+        """When queue is empty it should return an empty list"""
+        response = self.client.get(f"/queues/{self.scheduler.scheduler_id}/pop?n=5")
+        self.assertEqual(200, response.status_code)
+        self.assertEqual([], response.json())
+
+    def test_pop_queue_many_invalid(self):
+        response = self.client.get(f"/queues/{self.scheduler.scheduler_id}/pop?n=0")
+        self.assertEqual(400, response.status_code)
+
+
+class APIHealthTestCase(APITemplateTestCase):
+    def setUp(self):
+        super().setUp()
+
+        self.katalogus = mock.Mock(is_healthy=mock.Mock(return_value=True))
+        self.katalogus.name = "katalogus"
+        self.octopoes = mock.Mock(is_healthy=mock.Mock(side_effect=Exception("timeout")))
+        self.octopoes.name = "octopoes"
+        self.mock_ctx.services = SimpleNamespace(katalogus=self.katalogus, octopoes=self.octopoes)
+
+    def test_health(self):
+        """The external services are probed once, after which the cached
+        result is served."""
+        response = self.client.get("/health")
+        self.assertEqual(200, response.status_code)
+        self.assertEqual({"katalogus": True, "octopoes": False}, response.json()["externals"])
+        self.assertIsNotNone(response.json()["checked_at"])
+
+        response = self.client.get("/health")
+        self.assertEqual({"katalogus": True, "octopoes": False}, response.json()["externals"])
+        self.katalogus.is_healthy.assert_called_once()
+
+    def test_health_background_probe(self):
+        self.server.health_checker.run()
+        checked_at = self.server.health_checker.checked_at
+
+        response = self.client.get("/health")
+        self.assertEqual(checked_at.isoformat(), datetime.fromisoformat(response.json()["checked_at"]).isoformat())
+        self.katalogus.is_healthy.assert_called_once()
+
+    def test_health_deep(self):
+        """A deep health check probes the external services on every
+        request."""
+        self.client.get("/health")
+        self.katalogus.is_healthy.return_value = False
+
+        response = self.client.get("/health", params={"deep": True})
+        self.assertEqual({"katalogus": False, "octopoes": False}, response.json()["externals"])
+        self.assertEqual(2, self.katalogus.is_healthy.call_count)
+
 
 class APITasksEndpointTestCase(APITemplateTestCase):
     def setUp(self):
@@ -390,6 +684,67 @@ class APITasksEndpointTestCase(APITemplateTestCase):
         self.assertEqual(2, response.json()["count"])
         self.assertEqual(2, len(response.json()["results"]))
 
+    def test_get_tasks_cursor(self):
+        """Following the next links should return every task once, newest
+        first."""
+        for priority in range(3):
+            self.scheduler.push_item_to_queue(create_p_item(self.organisation.id, priority))
+
+        ids = []
+        url = "/tasks?limit=2"
+        while url is not None:
+            response = self.client.get(url)
+            self.assertEqual(200, response.status_code)
+            self.assertEqual(5, response.json()["count"])
+            self.assertIsNone(response.json()["previous"])
+
+            ids.extend(task["id"] for task in response.json()["results"])
+            url = response.json()["next"]
+
+        tasks, _ = self.task_store.get_tasks(None, None, None, None, None, None, limit=10)
+        self.assertEqual([str(task.id) for task in tasks], ids)
+
+    def test_get_tasks_cursor_invalid(self):
+        response = self.client.get("/tasks?cursor=invalid")
+        self.assertEqual(400, response.status_code)
+        self.assertEqual("invalid cursor", response.json().get("detail"))
+
+    def test_get_tasks_cursor_and_offset(self):
+        response = self.client.get("/tasks?limit=1")
+        cursor = parse_qs(urlparse(response.json()["next"]).query)["cursor"][0]
+
+        response = self.client.get(f"/tasks?limit=1&offset=1&cursor={cursor}")
+        self.assertEqual(400, response.status_code)
+
+    def test_get_tasks_offset(self):
+        """Pages that are requested by offset should link to the next page by
+        offset."""
+        response = self.client.get("/tasks?limit=1&offset=1")
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(1, len(response.json()["results"]))
+        self.assertIn("offset=0", response.json()["previous"])
+
+    def test_get_tasks_count_none(self):
+        response = self.client.get("/tasks?limit=1&count=none")
+        self.assertEqual(200, response.status_code)
+        self.assertIsNone(response.json()["count"])
+        self.assertIsNotNone(response.json()["next"])
+
+        response = self.client.get("/tasks?limit=1&offset=2&count=none")
+        self.assertEqual([], response.json()["results"])
+        self.assertIsNone(response.json()["next"])
+
+    def test_get_tasks_count_estimate(self):
+        """SQLite doesn't expose planner estimates, so the tasks are
+        counted."""
+        response = self.client.get("/tasks?count=estimate")
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(2, response.json()["count"])
+
+    def test_get_tasks_count_invalid(self):
+        response = self.client.get("/tasks?count=invalid")
+        self.assertEqual(422, response.status_code)
+
     def test_get_task(self):
         # First add a task
         item = create_p_item(self.organisation.id, 0)
@@ -423,6 +778,36 @@ class APITasksEndpointTestCase(APITemplateTestCase):
         self.assertEqual(1, len(response.json()["results"]))
         self.assertEqual("123.123", response.json()["results"][0]["p_item"]["data"]["child"]["id"])
 
+    def test_get_tasks_value_operators(self):
+        # Get tasks with embedded value not equal to "123", should return 1 item
+        response = self.client.get("/tasks", json=[{"field": "data__id", "operator": "ne", "value": "123"}])
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(1, len(response.json()["results"]))
+        self.assertEqual("456", response.json()["results"][0]["p_item"]["data"]["id"])
+
+        # Get tasks with embedded value in a list, should return 2 items
+        response = self.client.get(
+            "/tasks", json=[{"field": "data__id", "operator": "in_", "value": ["123", "456", "789"]}]
+        )
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(2, len(response.json()["results"]))
+
+        # Get tasks with embedded value not in a list, should return 1 item
+        response = self.client.get("/tasks", json=[{"field": "data__id", "operator": "notin_", "value": ["456"]}])
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(1, len(response.json()["results"]))
+        self.assertEqual("123", response.json()["results"][0]["p_item"]["data"]["id"])
+
+        # Get tasks with a priority greater than 0, compared as number
+        response = self.client.get("/tasks", json=[{"field": "priority", "operator": "gt", "value": 0}])
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(1, len(response.json()["results"]))
+        self.assertEqual("456", response.json()["results"][0]["p_item"]["data"]["id"])
+
+    def test_get_tasks_value_operator_invalid(self):
+        response = self.client.get("/tasks", json=[{"field": "data__id", "operator": "in_", "value": "123"}])
+        self.assertEqual(400, response.status_code)
+
     def test_get_tasks_min_and_max_created_at(self):
         # Get tasks based on datetime, both min_created_at and max_created_at, should return 2 items
         min_created_at = self.first_item_api.get("created_at")
@@ -499,3 +884,108 @@ class APITasksEndpointTestCase(APITemplateTestCase):
         response = self.client.patch("/tasks/123.123", json={"status": "completed"})
         self.assertEqual(400, response.status_code)
         self.assertIn("failed to get task", response.json().get("detail"))
+
+
+class APITaskLeasesTestCase(APITemplateTestCase):
+    def setUp(self):
+        super().setUp()
+
+        self.mock_ctx.config.pq_lease_duration = 60
+
+        self.item = create_p_item(self.organisation.id, 3)
+        self.scheduler.push_item_to_queue(self.item)
+
+    def pop(self):
+        response = self.client.get(f"/queues/{self.scheduler.scheduler_id}/pop")
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(str(self.item.id), response.json().get("id"))
+
+        task = self.client.get(f"/tasks/{self.item.id}").json()
+        self.assertEqual("dispatched", task.get("status"))
+        self.assertIsNotNone(task.get("lease_expires_at"))
+
+        return task
+
+    def test_ack_task(self):
+        self.pop()
+
+        response = self.client.post(f"/tasks/{self.item.id}/ack")
+        self.assertEqual(200, response.status_code)
+        self.assertEqual("completed", response.json().get("status"))
+        self.assertIsNone(response.json().get("lease_expires_at"))
+
+        # The lease is released, so the task can't be acknowledged again
+        response = self.client.post(f"/tasks/{self.item.id}/ack")
+        self.assertEqual(409, response.status_code)
+
+    def test_ack_task_not_found(self):
+        response = self.client.post(f"/tasks/{uuid.uuid4()}/ack")
+        self.assertEqual(404, response.status_code)
+        self.assertEqual("task not found", response.json().get("detail"))
+
+    def test_ack_task_leases_disabled(self):
+        self.mock_ctx.config.pq_lease_duration = 0
+
+        response = self.client.get(f"/queues/{self.scheduler.scheduler_id}/pop")
+        self.assertEqual(200, response.status_code)
+
+        response = self.client.post(f"/tasks/{self.item.id}/ack")
+        self.assertEqual(409, response.status_code)
+
+    def test_nack_task(self):
+        """When a task is handed back, it should be put back on the queue
+        with its original priority."""
+        self.pop()
+
+        response = self.client.post(f"/tasks/{self.item.id}/nack")
+        self.assertEqual(200, response.status_code)
+        self.assertEqual("queued", response.json().get("status"))
+        self.assertIsNone(response.json().get("lease_expires_at"))
+
+        response = self.client.get(f"/queues/{self.scheduler.scheduler_id}/pop")
+        self.assertEqual(str(self.item.id), response.json().get("id"))
+        self.assertEqual(3, response.json().get("priority"))
+
+    def test_nack_task_no_requeue(self):
+        self.pop()
+
+        response = self.client.post(f"/tasks/{self.item.id}/nack?requeue=false")
+        self.assertEqual(200, response.status_code)
+        self.assertEqual("failed", response.json().get("status"))
+        self.assertEqual(0, self.scheduler.queue.qsize())
+
+    def test_heartbeat_task(self):
+        task = self.pop()
+
+        time.sleep(0.01)
+
+        response = self.client.post(f"/tasks/{self.item.id}/heartbeat")
+        self.assertEqual(200, response.status_code)
+        # NOTE: SQLite doesn't store the timezone of the lease deadline
+        self.assertGreater(
+            datetime.fromisoformat(response.json().get("lease_expires_at")).replace(tzinfo=None),
+            datetime.fromisoformat(task.get("lease_expires_at")).replace(tzinfo=None),
+        )
+
+    def test_heartbeat_task_completed(self):
+        """When the runner set the task to completed, it doesn't hold a lease
+        anymore."""
+        self.pop()
+
+        response = self.client.patch(f"/tasks/{self.item.id}", json={"status": "completed"})
+        self.assertEqual(200, response.status_code)
+        self.assertIsNone(response.json().get("lease_expires_at"))
+
+        response = self.client.post(f"/tasks/{self.item.id}/heartbeat")
+        self.assertEqual(409, response.status_code)
+
+    def test_requeue_expired_leases(self):
+        """When the lease of a task expires, the sweeper should put it back
+        on the queue."""
+        self.pop()
+        self.task_store.update_lease(str(self.item.id), datetime.now(timezone.utc) - timedelta(seconds=1))
+
+        self.scheduler.requeue_expired_leases()
+
+        self.assertEqual(1, self.scheduler.queue.qsize())
+        self.assertEqual("queued", self.client.get(f"/tasks/{self.item.id}").json().get("status"))
@@ -3,7 +3,7 @@ from unittest import mock
 
 import scheduler
 from fastapi.testclient import TestClient
-from scheduler import config, models, repositories
+from scheduler import config, models, repositories, utils
 from tests.factories import OrganisationFactory
 
 
@@ -24,6 +24,8 @@ class AppTestCase(unittest.TestCase):
         self.mock_ctx.pq_store = self.pq_store
         self.mock_ctx.task_store = self.task_store
 
+        self.mock_ctx.startup = utils.PhaseTimer("startup")
+
         self.organisation = OrganisationFactory()
 
         self.app = scheduler.App(self.mock_ctx)
@@ -86,3 +88,17 @@ class AppTestCase(unittest.TestCase):
         response = self.client.get("/queues")
         self.assertEqual(0, len(response.json()))
         self.assertEqual([], response.json())
+
+    def test_startup(self):
+        """The duration of the startup phases are served while starting up,
+        and after the startup finished."""
+        response = self.client.get("/startup")
+        self.assertEqual(200, response.status_code)
+        self.assertIsNone(response.json()["finished_at"])
+        self.assertEqual(["schedulers"], [phase["name"] for phase in response.json()["phases"]])
+
+        self.mock_ctx.startup.finish()
+
+        response = self.client.get("/startup")
+        self.assertIsNotNone(response.json()["finished_at"])
+        self.assertIsNotNone(response.json()["phases"][0]["duration"])
@@ -1,5 +1,8 @@
+import threading
+import time
 import unittest
 import uuid
+from concurrent import futures
 from datetime import datetime, timedelta, timezone
 from unittest import mock
 
@@ -21,6 +24,7 @@ class SchedulerTestCase(unittest.TestCase):
 
         self.mock_ctx = mock.patch("scheduler.context.AppContext").start()
         self.mock_ctx.config = cfg
+        self.mock_ctx.stop_event = threading.Event()
 
         # Mock connectors: octopoes
         self.mock_octopoes = mock.create_autospec(
@@ -82,6 +86,9 @@ class SchedulerTestCase(unittest.TestCase):
             organisation=self.organisation,
         )
 
+        # Don't wait between batches of random objects
+        self.scheduler.POPULATE_BATCH_INTERVAL = 0
+
     @mock.patch("scheduler.schedulers.BoefjeScheduler.is_task_running")
     @mock.patch("scheduler.schedulers.BoefjeScheduler.is_task_allowed_to_run")
     @mock.patch("scheduler.schedulers.BoefjeScheduler.has_grace_period_passed")
@@ -125,6 +132,9 @@ class SchedulerTestCase(unittest.TestCase):
         self.assertEqual(task_db.id.hex, task_pq.id)
         self.assertEqual(task_db.status, models.TaskStatus.QUEUED)
 
+        # Message should be acknowledged after the task was persisted
+        self.mock_scan_profile_mutation.ack.assert_called_with(f"{self.organisation.id}__scan_profile_mutations")
+
     @mock.patch("scheduler.schedulers.BoefjeScheduler.get_boefjes_for_ooi")
     @mock.patch("scheduler.context.AppContext.services.scan_profile_mutation.get_scan_profile_mutation")
     def test_push_tasks_for_scan_profile_mutations_no_boefjes_found(
@@ -297,7 +307,7 @@ class SchedulerTestCase(unittest.TestCase):
         self.assertEqual(task_db.id.hex, task_pq.id)
         self.assertEqual(task_db.status, models.TaskStatus.QUEUED)
 
-    @mock.patch("scheduler.context.AppContext.task_store.get_tasks_by_hash")
+    @mock.patch("scheduler.context.AppContext.task_store.get_latest_by_hash")
     @mock.patch("scheduler.schedulers.BoefjeScheduler.is_task_running")
     @mock.patch("scheduler.schedulers.BoefjeScheduler.is_task_allowed_to_run")
     @mock.patch("scheduler.schedulers.BoefjeScheduler.has_grace_period_passed")
@@ -310,7 +320,7 @@ class SchedulerTestCase(unittest.TestCase):
         mock_has_grace_period_passed,
         mock_is_task_allowed_to_run,
         mock_is_task_running,
-        mock_get_tasks_by_hash,
+        mock_get_latest_by_hash,
     ):
         # Arrange
         scan_profile = ScanProfileFactory(level=0)
@@ -330,11 +340,9 @@ class SchedulerTestCase(unittest.TestCase):
             hash=task.hash,
         )
 
-        task_db = models.Task(
-            id=p_item.id,
-            scheduler_id=self.scheduler.scheduler_id,
-            type="boefje",
-            p_item=p_item,
+        task_db = models.TaskLatest(
+            hash=p_item.hash,
+            task_id=p_item.id,
             status=models.TaskStatus.COMPLETED,
             created_at=datetime.now(timezone.utc),
             modified_at=datetime.now(timezone.utc),
@@ -346,7 +354,7 @@ class SchedulerTestCase(unittest.TestCase):
         mock_is_task_running.return_value = False
         mock_is_task_allowed_to_run.return_value = True
         mock_has_grace_period_passed.return_value = True
-        mock_get_tasks_by_hash.return_value = [task_db]
+        mock_get_latest_by_hash.return_value = task_db
 
         # Act
         self.scheduler.push_tasks_for_random_objects()
@@ -530,6 +538,150 @@ class SchedulerTestCase(unittest.TestCase):
         self.assertEqual(task_db.id.hex, task_pq.id)
         self.assertEqual(task_db.status, models.TaskStatus.QUEUED)
 
+    @mock.patch("scheduler.schedulers.BoefjeScheduler.is_task_running")
+    @mock.patch("scheduler.schedulers.BoefjeScheduler.has_grace_period_passed")
+    def test_evaluate_tasks(self, mock_has_grace_period_passed, mock_is_task_running):
+        """Tasks should be evaluated concurrently, and returned ordered by
+        their priority."""
+        # Arrange
+        self.scheduler.executor = futures.ThreadPoolExecutor(max_workers=4)
+
+        ooi = OOIFactory(scan_profile=ScanProfileFactory(level=0))
+        tasks = [
+            models.BoefjeTask(
+                boefje=BoefjeFactory(),
+                input_ooi=ooi.primary_key,
+                organization=self.organisation.id,
+            )
+            for _ in range(4)
+        ]
+        priorities = {task.hash: 10 - i for i, task in enumerate(tasks)}
+
+        # Mocks
+        def is_task_running(task, state):
+            time.sleep(0.5)
+            return False
+
+        mock_is_task_running.side_effect = is_task_running
+        mock_has_grace_period_passed.return_value = True
+        self.scheduler.ranker = mock.Mock()
+        self.scheduler.ranker.rank.side_effect = lambda obj: priorities[obj.task.hash]
+
+        # Act
+        start = time.monotonic()
+        p_items = self.scheduler.evaluate_tasks(tasks + [tasks[0]])
+        elapsed = time.monotonic() - start
+
+        # Assert
+        self.assertLess(elapsed, 1.5)
+        self.assertEqual(4, mock_is_task_running.call_count)
+        self.assertEqual([task.hash for task in reversed(tasks)], [p_item.hash for p_item in p_items])
+        self.assertEqual([7, 8, 9, 10], [p_item.priority for p_item in p_items])
+
+    @mock.patch("scheduler.schedulers.BoefjeScheduler.is_task_running")
+    @mock.patch("scheduler.schedulers.BoefjeScheduler.has_grace_period_passed")
+    def test_evaluate_tasks_skipped(self, mock_has_grace_period_passed, mock_is_task_running):
+        """Tasks that are running, or of which the check fails, are skipped."""
+        # Arrange
+        ooi = OOIFactory(scan_profile=ScanProfileFactory(level=0))
+        tasks = [
+            models.BoefjeTask(
+                boefje=BoefjeFactory(),
+                input_ooi=ooi.primary_key,
+                organization=self.organisation.id,
+            )
+            for _ in range(3)
+        ]
+        running = {tasks[0].hash: True, tasks[1].hash: RuntimeError("bytes"), tasks[2].hash: False}
+
+        # Mocks
+        def is_task_running(task, state):
+            if isinstance(running[task.hash], Exception):
+                raise running[task.hash]
+            return running[task.hash]
+
+        mock_is_task_running.side_effect = is_task_running
+        mock_has_grace_period_passed.return_value = True
+
+        # Act
+        p_items = self.scheduler.evaluate_tasks(tasks)
+
+        # Assert
+        self.assertEqual([tasks[2].hash], [p_item.hash for p_item in p_items])
+
+    @mock.patch("scheduler.schedulers.BoefjeScheduler.is_task_running")
+    @mock.patch("scheduler.schedulers.BoefjeScheduler.has_grace_period_passed")
+    def test_evaluate_tasks_on_queue(self, mock_has_grace_period_passed, mock_is_task_running):
+        """Tasks that are already on the queue are looked up at once, and
+        skipped before they are evaluated."""
+        # Arrange
+        ooi = OOIFactory(scan_profile=ScanProfileFactory(level=0))
+        tasks = [
+            models.BoefjeTask(
+                boefje=BoefjeFactory(),
+                input_ooi=ooi.primary_key,
+                organization=self.organisation.id,
+            )
+            for _ in range(3)
+        ]
+        self.scheduler.push_item_to_queue(
+            models.PrioritizedItem(
+                id=tasks[0].id,
+                scheduler_id=self.scheduler.scheduler_id,
+                priority=1,
+                data=tasks[0],
+                hash=tasks[0].hash,
+            )
+        )
+
+        mock_is_task_running.return_value = False
+        mock_has_grace_period_passed.return_value = True
+
+        # Act
+        with mock.patch.object(
+            self.pq_store, "get_items_by_hashes", wraps=self.pq_store.get_items_by_hashes
+        ) as mock_get_items_by_hashes:
+            p_items = self.scheduler.evaluate_tasks(tasks)
+
+        # Assert
+        self.assertEqual({tasks[1].hash, tasks[2].hash}, {p_item.hash for p_item in p_items})
+        mock_get_items_by_hashes.assert_called_once()
+        self.assertEqual(2, mock_is_task_running.call_count)
+
+    def test_evaluate_tasks_run_state(self):
+        """The run state of a task should be looked up once, and shared by
+        the checks and the ranking of the task."""
+        # Arrange
+        ooi = OOIFactory(scan_profile=ScanProfileFactory(level=0))
+        tasks = [
+            models.BoefjeTask(
+                boefje=BoefjeFactory(),
+                input_ooi=ooi.primary_key,
+                organization=self.organisation.id,
+            )
+            for _ in range(3)
+        ]
+
+        # Mocks
+        self.mock_bytes.get_last_run_boefjes.return_value = [None, None, None]
+
+        # Act
+        with mock.patch.object(
+            self.task_store, "get_latest_by_hashes", wraps=self.task_store.get_latest_by_hashes
+        ) as mock_get_latest_by_hashes, mock.patch.object(
+            self.task_store, "get_latest_by_hash", wraps=self.task_store.get_latest_by_hash
+        ) as mock_get_latest_by_hash:
+            p_items = self.scheduler.evaluate_tasks(tasks)
+
+        # Assert
+        self.assertEqual(3, len(p_items))
+        self.mock_bytes.get_last_run_boefjes.assert_called_once_with(
+            [(task.boefje.id, task.input_ooi, task.organization) for task in tasks]
+        )
+        self.mock_bytes.get_last_run_boefje.assert_not_called()
+        mock_get_latest_by_hashes.assert_called_once()
+        mock_get_latest_by_hash.assert_not_called()
+
     def test_is_allowed_to_run(self):
         # Arrange
         scan_profile = ScanProfileFactory(level=0)
@@ -556,9 +708,9 @@ class SchedulerTestCase(unittest.TestCase):
         self.assertFalse(allowed_to_run)
         self.assertIn("is too intense", cm.output[-1])
 
-    @mock.patch("scheduler.context.AppContext.task_store.get_latest_task_by_hash")
+    @mock.patch("scheduler.context.AppContext.task_store.get_latest_by_hash")
     @mock.patch("scheduler.context.AppContext.services.bytes.get_last_run_boefje")
-    def test_is_task_not_running(self, mock_get_last_run_boefje, mock_get_latest_task_by_hash):
+    def test_is_task_not_running(self, mock_get_last_run_boefje, mock_get_latest_by_hash):
         """When both the task cannot be found in the datastore and bytes
         the task is not running.
         """
@@ -573,7 +725,7 @@ class SchedulerTestCase(unittest.TestCase):
         )
 
         # Mock
-        mock_get_latest_task_by_hash.return_value = None
+        mock_get_latest_by_hash.return_value = None
         mock_get_last_run_boefje.return_value = None
 
         # Act
@@ -582,9 +734,9 @@ class SchedulerTestCase(unittest.TestCase):
         # Assert
         self.assertFalse(is_running)
 
-    @mock.patch("scheduler.context.AppContext.task_store.get_latest_task_by_hash")
+    @mock.patch("scheduler.context.AppContext.task_store.get_latest_by_hash")
     @mock.patch("scheduler.context.AppContext.services.bytes.get_last_run_boefje")
-    def test_is_task_running_datastore_running(self, mock_get_last_run_boefje, mock_get_latest_task_by_hash):
+    def test_is_task_running_datastore_running(self, mock_get_last_run_boefje, mock_get_latest_by_hash):
         """When the task is found in the datastore and the status isn't
         failed or completed, then the task is still running.
         """
@@ -606,18 +758,16 @@ class SchedulerTestCase(unittest.TestCase):
             hash=task.hash,
         )
 
-        task_db = models.Task(
-            id=p_item.id,
-            scheduler_id=self.scheduler.scheduler_id,
-            type="boefje",
-            p_item=p_item,
+        task_db = models.TaskLatest(
+            hash=p_item.hash,
+            task_id=p_item.id,
             status=models.TaskStatus.QUEUED,
             created_at=datetime.utcnow(),
             modified_at=datetime.utcnow(),
         )
 
         # Mock
-        mock_get_latest_task_by_hash.return_value = task_db
+        mock_get_latest_by_hash.return_value = task_db
         mock_get_last_run_boefje.return_value = None
 
         # Act
@@ -626,9 +776,9 @@ class SchedulerTestCase(unittest.TestCase):
         # Assert
         self.assertTrue(is_running)
 
-    @mock.patch("scheduler.context.AppContext.task_store.get_latest_task_by_hash")
+    @mock.patch("scheduler.context.AppContext.task_store.get_latest_by_hash")
     @mock.patch("scheduler.context.AppContext.services.bytes.get_last_run_boefje")
-    def test_is_task_running_datastore_not_running(self, mock_get_last_run_boefje, mock_get_latest_task_by_hash):
+    def test_is_task_running_datastore_not_running(self, mock_get_last_run_boefje, mock_get_latest_by_hash):
         """When the task is found in the datastore and the status is
         failed or completed, then the task is not running.
         """
@@ -650,21 +800,17 @@ class SchedulerTestCase(unittest.TestCase):
             hash=task.hash,
         )
 
-        task_db_first = models.Task(
-            id=p_item.id,
-            scheduler_id=self.scheduler.scheduler_id,
-            type="boefje",
-            p_item=p_item,
+        task_db_first = models.TaskLatest(
+            hash=p_item.hash,
+            task_id=p_item.id,
             status=models.TaskStatus.COMPLETED,
             created_at=datetime.now(timezone.utc),
             modified_at=datetime.now(timezone.utc),
         )
 
-        task_db_second = models.Task(
-            id=p_item.id,
-            scheduler_id=self.scheduler.scheduler_id,
-            type="boefje",
-            p_item=p_item,
+        task_db_second = models.TaskLatest(
+            hash=p_item.hash,
+            task_id=p_item.id,
             status=models.TaskStatus.FAILED,
             created_at=datetime.now(timezone.utc),
             modified_at=datetime.now(timezone.utc),
@@ -677,7 +823,7 @@ class SchedulerTestCase(unittest.TestCase):
         )
 
         # Mock
-        mock_get_latest_task_by_hash.side_effect = [
+        mock_get_latest_by_hash.side_effect = [
             task_db_first,
             task_db_second,
         ]
@@ -691,9 +837,9 @@ class SchedulerTestCase(unittest.TestCase):
         is_running = self.scheduler.is_task_running(task)
         self.assertFalse(is_running)
 
-    @mock.patch("scheduler.context.AppContext.task_store.get_latest_task_by_hash")
+    @mock.patch("scheduler.context.AppContext.task_store.get_latest_by_hash")
     @mock.patch("scheduler.context.AppContext.services.bytes.get_last_run_boefje")
-    def test_is_task_running_bytes_running(self, mock_get_last_run_boefje, mock_get_latest_task_by_hash):
+    def test_is_task_running_bytes_running(self, mock_get_last_run_boefje, mock_get_latest_by_hash):
         """When task is found in bytes and the started_at field is not None, and
         the ended_at field is None. The task is still running."""
         # Arrange
@@ -712,7 +858,7 @@ class SchedulerTestCase(unittest.TestCase):
         )
 
         # Mock
-        mock_get_latest_task_by_hash.return_value = None
+        mock_get_latest_by_hash.return_value = None
         mock_get_last_run_boefje.return_value = last_run_boefje
 
         # Act
@@ -721,9 +867,9 @@ class SchedulerTestCase(unittest.TestCase):
         # Assert
         self.assertTrue(is_running)
 
-    @mock.patch("scheduler.context.AppContext.task_store.get_latest_task_by_hash")
+    @mock.patch("scheduler.context.AppContext.task_store.get_latest_by_hash")
     @mock.patch("scheduler.context.AppContext.services.bytes.get_last_run_boefje")
-    def test_is_task_running_bytes_not_running(self, mock_get_last_run_boefje, mock_get_latest_task_by_hash):
+    def test_is_task_running_bytes_not_running(self, mock_get_last_run_boefje, mock_get_latest_by_hash):
         """When task is found in bytes and the started_at field is not None, and
         the ended_at field is not None. The task is not running."""
         # Arrange
@@ -742,7 +888,7 @@ class SchedulerTestCase(unittest.TestCase):
         )
 
         # Mock
-        mock_get_latest_task_by_hash.return_value = None
+        mock_get_latest_by_hash.return_value = None
         mock_get_last_run_boefje.return_value = last_run_boefje
 
         # Act
@@ -751,12 +897,12 @@ class SchedulerTestCase(unittest.TestCase):
         # Assert
         self.assertFalse(is_running)
 
-    @mock.patch("scheduler.context.AppContext.task_store.get_latest_task_by_hash")
+    @mock.patch("scheduler.context.AppContext.task_store.get_latest_by_hash")
     @mock.patch("scheduler.context.AppContext.services.bytes.get_last_run_boefje")
     def test_is_task_running_mismatch(
         self,
         mock_get_last_run_boefje,
-        mock_get_latest_task_by_hash,
+        mock_get_latest_by_hash,
     ):
         """When a task has finished according to the datastore, (e.g. failed
         or completed), but there are no results in bytes, we have a problem.
@@ -779,30 +925,28 @@ class SchedulerTestCase(unittest.TestCase):
             hash=task.hash,
         )
 
-        task_db = models.Task(
-            id=p_item.id,
-            scheduler_id=self.scheduler.scheduler_id,
-            type="boefje",
-            p_item=p_item,
+        task_db = models.TaskLatest(
+            hash=p_item.hash,
+            task_id=p_item.id,
             status=models.TaskStatus.COMPLETED,
             created_at=datetime.now(timezone.utc),
             modified_at=datetime.now(timezone.utc),
         )
 
         # Mock
-        mock_get_latest_task_by_hash.return_value = task_db
+        mock_get_latest_by_hash.return_value = task_db
         mock_get_last_run_boefje.return_value = None
 
         # Act
         with self.assertRaises(RuntimeError):
             self.scheduler.is_task_running(task)
 
-    @mock.patch("scheduler.context.AppContext.task_store.get_latest_task_by_hash")
+    @mock.patch("scheduler.context.AppContext.task_store.get_latest_by_hash")
     @mock.patch("scheduler.context.AppContext.services.bytes.get_last_run_boefje")
     def test_has_grace_period_passed_datastore_passed(
         self,
         mock_get_last_run_boefje,
-        mock_get_latest_task_by_hash,
+        mock_get_latest_by_hash,
     ):
         """Grace period passed according to datastore, and the status is completed"""
         # Arrange
@@ -823,18 +967,16 @@ class SchedulerTestCase(unittest.TestCase):
             hash=task.hash,
         )
 
-        task_db = models.Task(
-            id=p_item.id,
-            scheduler_id=self.scheduler.scheduler_id,
-            type="boefje",
-            p_item=p_item,
+        task_db = models.TaskLatest(
+            hash=p_item.hash,
+            task_id=p_item.id,
             status=models.TaskStatus.COMPLETED,
             created_at=datetime.now(timezone.utc),
             modified_at=datetime.now(timezone.utc) - timedelta(seconds=self.mock_ctx.config.pq_populate_grace_period),
         )
 
         # Mock
-        mock_get_latest_task_by_hash.return_value = task_db
+        mock_get_latest_by_hash.return_value = task_db
         mock_get_last_run_boefje.return_value = None
 
         # Act
@@ -843,12 +985,12 @@ class SchedulerTestCase(unittest.TestCase):
         # Assert
         self.assertTrue(has_passed)
 
-    @mock.patch("scheduler.context.AppContext.task_store.get_latest_task_by_hash")
+    @mock.patch("scheduler.context.AppContext.task_store.get_latest_by_hash")
     @mock.patch("scheduler.context.AppContext.services.bytes.get_last_run_boefje")
     def test_has_grace_period_passed_datastore_not_passed(
         self,
         mock_get_last_run_boefje,
-        mock_get_latest_task_by_hash,
+        mock_get_latest_by_hash,
     ):
         """Grace period not passed according to datastore."""
         # Arrange
@@ -869,18 +1011,16 @@ class SchedulerTestCase(unittest.TestCase):
             hash=task.hash,
         )
 
-        task_db = models.Task(
-            id=p_item.id,
-            scheduler_id=self.scheduler.scheduler_id,
-            type="boefje",
-            p_item=p_item,
+        task_db = models.TaskLatest(
+            hash=p_item.hash,
+            task_id=p_item.id,
             status=models.TaskStatus.COMPLETED,
             created_at=datetime.now(timezone.utc),
             modified_at=datetime.now(timezone.utc),
         )
 
         # Mock
-        mock_get_latest_task_by_hash.return_value = task_db
+        mock_get_latest_by_hash.return_value = task_db
         mock_get_last_run_boefje.return_value = None
 
         # Act
@@ -889,12 +1029,12 @@ class SchedulerTestCase(unittest.TestCase):
         # Assert
         self.assertFalse(has_passed)
 
-    @mock.patch("scheduler.context.AppContext.task_store.get_latest_task_by_hash")
+    @mock.patch("scheduler.context.AppContext.task_store.get_latest_by_hash")
     @mock.patch("scheduler.context.AppContext.services.bytes.get_last_run_boefje")
     def test_has_grace_period_passed_bytes_passed(
         self,
         mock_get_last_run_boefje,
-        mock_get_latest_task_by_hash,
+        mock_get_latest_by_hash,
     ):
         # Arrange
         scan_profile = ScanProfileFactory(level=0)
@@ -914,11 +1054,9 @@ class SchedulerTestCase(unittest.TestCase):
             hash=task.hash,
         )
 
-        task_db = models.Task(
-            id=p_item.id,
-            scheduler_id=self.scheduler.scheduler_id,
-            type="boefje",
-            p_item=p_item,
+        task_db = models.TaskLatest(
+            hash=p_item.hash,
+            task_id=p_item.id,
             status=models.TaskStatus.COMPLETED,
             created_at=datetime.now(timezone.utc),
             modified_at=datetime.now(timezone.utc) - timedelta(seconds=self.mock_ctx.config.pq_populate_grace_period),
@@ -931,7 +1069,7 @@ class SchedulerTestCase(unittest.TestCase):
         )
 
         # Mock
-        mock_get_latest_task_by_hash.return_value = task_db
+        mock_get_latest_by_hash.return_value = task_db
         mock_get_last_run_boefje.return_value = last_run_boefje
 
         # Act
@@ -940,12 +1078,12 @@ class SchedulerTestCase(unittest.TestCase):
         # Assert
         self.assertTrue(has_passed)
 
-    @mock.patch("scheduler.context.AppContext.task_store.get_latest_task_by_hash")
+    @mock.patch("scheduler.context.AppContext.task_store.get_latest_by_hash")
     @mock.patch("scheduler.context.AppContext.services.bytes.get_last_run_boefje")
     def test_has_grace_period_passed_bytes_not_passed(
         self,
         mock_get_last_run_boefje,
-        mock_get_latest_task_by_hash,
+        mock_get_latest_by_hash,
     ):
         # Arrange
         scan_profile = ScanProfileFactory(level=0)
@@ -965,11 +1103,9 @@ class SchedulerTestCase(unittest.TestCase):
             hash=task.hash,
         )
 
-        task_db = models.Task(
-            id=p_item.id,
-            scheduler_id=self.scheduler.scheduler_id,
-            type="boefje",
-            p_item=p_item,
+        task_db = models.TaskLatest(
+            hash=p_item.hash,
+            task_id=p_item.id,
             status=models.TaskStatus.COMPLETED,
             created_at=datetime.now(timezone.utc),
             modified_at=datetime.now(timezone.utc) - timedelta(seconds=self.mock_ctx.config.pq_populate_grace_period),
@@ -982,7 +1118,7 @@ class SchedulerTestCase(unittest.TestCase):
         )
 
         # Mock
-        mock_get_latest_task_by_hash.return_value = task_db
+        mock_get_latest_by_hash.return_value = task_db
         mock_get_last_run_boefje.return_value = last_run_boefje
 
         # Act
@@ -1035,6 +1171,81 @@ class SchedulerTestCase(unittest.TestCase):
         self.assertEqual(task_db.id.hex, task_pq.id)
         self.assertEqual(task_db.status, models.TaskStatus.QUEUED)
 
+    @mock.patch("scheduler.schedulers.BoefjeScheduler.push_tasks_for_random_objects")
+    @mock.patch("scheduler.schedulers.BoefjeScheduler.push_tasks_for_scan_profile_mutations")
+    def test_populate_queue_random_objects_interval(
+        self, mock_push_tasks_for_scan_profile_mutations, mock_push_tasks_for_random_objects
+    ):
+        """The populator is woken up by mutations and pops, but random
+        objects should only be fetched once every populate interval."""
+        self.scheduler.populate_queue()
+        self.scheduler.populate_queue()
+
+        self.assertEqual(2, mock_push_tasks_for_scan_profile_mutations.call_count)
+        self.assertEqual(1, mock_push_tasks_for_random_objects.call_count)
+
+        # After the interval has passed
+        self.scheduler.random_objects_populated_at -= self.mock_ctx.config.pq_populate_interval
+        self.scheduler.populate_queue()
+
+        self.assertEqual(2, mock_push_tasks_for_random_objects.call_count)
+
+    def _push_boefje_task(self) -> None:
+        task = models.BoefjeTask(
+            boefje=BoefjeFactory(),
+            input_ooi=OOIFactory(scan_profile=ScanProfileFactory(level=0)).primary_key,
+            organization=self.organisation.id,
+        )
+        p_item = models.PrioritizedItem(
+            id=task.id,
+            scheduler_id=self.scheduler.scheduler_id,
+            priority=1,
+            data=task,
+            hash=task.hash,
+        )
+        self.scheduler.push_item_to_queue(p_item)
+
+    def test_wake_populator_on_pop(self):
+        """Popping an item from a full queue should wake up the populator,
+        instead of waiting for the populate interval."""
+        self.scheduler.threads["populator"] = mock.Mock()
+        self.scheduler.queue.maxsize = 2
+
+        self._push_boefje_task()
+        self._push_boefje_task()
+        self.scheduler.pop_item_from_queue()
+
+        self.scheduler.threads["populator"].wake.assert_called_once()
+
+    def test_wake_populator_on_pop_not_full(self):
+        """Popping an item from a queue that wasn't full shouldn't wake up
+        the populator."""
+        self.scheduler.threads["populator"] = mock.Mock()
+        self.scheduler.queue.maxsize = 3
+
+        self._push_boefje_task()
+        self._push_boefje_task()
+        self.scheduler.pop_item_from_queue()
+
+        self.scheduler.threads["populator"].wake.assert_not_called()
+
+    @mock.patch("scheduler.schedulers.BoefjeScheduler.is_task_running")
+    def test_push_tasks_for_random_objects_nothing_pushed(self, mock_is_task_running):
+        """Batches of random objects of which no tasks are pushed count as
+        tries, so the populator stops instead of requesting random objects
+        over and over."""
+        ooi = OOIFactory(scan_profile=ScanProfileFactory(level=0))
+        boefje = PluginFactory(scan_level=0, consumes=[ooi.object_type])
+
+        self.mock_octopoes.get_random_objects.return_value = [ooi]
+        self.mock_katalogus.get_boefjes_by_type_and_org_id.return_value = [boefje]
+        mock_is_task_running.return_value = True
+
+        self.scheduler.push_tasks_for_random_objects()
+
+        self.assertEqual(3, self.mock_octopoes.get_random_objects.call_count)
+        self.assertEqual(0, self.scheduler.queue.qsize())
+
     @mock.patch("scheduler.schedulers.BoefjeScheduler.push_tasks_for_random_objects")
     @mock.patch("scheduler.schedulers.BoefjeScheduler.has_grace_period_passed")
     @mock.patch("scheduler.schedulers.BoefjeScheduler.is_task_running")
@@ -1,9 +1,21 @@
-from unittest import TestCase
+import gzip
+import os
+import shutil
+import tempfile
+import threading
+import uuid
+from concurrent import futures
+from datetime import datetime, timedelta, timezone
+from unittest import TestCase, mock
 
+from scheduler import models
 from scheduler.models import Base
-from scheduler.repositories import sqlalchemy
+from scheduler.repositories import memory, sqlalchemy
+from scheduler.repositories.sqlalchemy.retention import DEFAULT_PARTITION
+from sqlalchemy import text
 from sqlalchemy.orm import sessionmaker
 from tests.integration.test_api import create_p_item
+from tests.utils import functions
 
 
 class TestRepositories(TestCase):
@@ -12,6 +24,7 @@ class TestRepositories(TestCase):
         Base.metadata.create_all(self.datastore.engine)
 
         self.pq_store = sqlalchemy.PriorityQueueStore(datastore=self.datastore)
+        self.task_store = sqlalchemy.TaskStore(datastore=self.datastore)
 
     def tearDown(self) -> None:
         session = sessionmaker(bind=self.datastore.engine)()
@@ -36,3 +49,476 @@ class TestRepositories(TestCase):
         self.assertEqual(scheduler_id, p_item.scheduler_id)
         self.assertEqual(3, p_item.priority)
         self.assertEqual({"organization": "test"}, p_item.data)
+
+    def test_pop_highest_priority(self) -> None:
+        scheduler_id = "scheduler_1"
+
+        for priority in [3, 1, 2]:
+            self.pq_store.push(scheduler_id, create_p_item(scheduler_id, priority))
+
+        self.assertEqual(1, self.pq_store.pop(scheduler_id).priority)
+        self.assertEqual(2, self.pq_store.pop(scheduler_id).priority)
+        self.assertEqual(3, self.pq_store.pop(scheduler_id).priority)
+        self.assertIsNone(self.pq_store.pop(scheduler_id))
+
+    def test_pop_dispatches_task(self) -> None:
+        scheduler_id = "scheduler_1"
+
+        item = create_p_item(scheduler_id, 1)
+        self.pq_store.push(scheduler_id, item)
+        self.task_store.create_task(functions.create_task(item))
+
+        p_item = self.pq_store.pop(scheduler_id)
+
+        self.assertEqual(item.id, p_item.id)
+        self.assertEqual(0, self.pq_store.qsize(scheduler_id))
+        self.assertEqual(models.TaskStatus.DISPATCHED, self.task_store.get_task_by_id(str(item.id)).status)
+
+    def test_upsert_task(self) -> None:
+        """Upserting a task should create it, and update it when a task with
+        the same id exists, keeping its creation date."""
+        item = create_p_item("scheduler_1", 1)
+        task = functions.create_task(item)
+
+        self.task_store.upsert_task(task)
+        created = self.task_store.get_task_by_id(str(task.id))
+        self.assertEqual(models.TaskStatus.QUEUED, created.status)
+
+        updated_item = create_p_item("scheduler_1", 5)
+        updated_item.id = item.id
+        updated = functions.create_task(updated_item)
+        updated.status = models.TaskStatus.RUNNING
+
+        self.task_store.upsert_tasks([updated, functions.create_task(create_p_item("scheduler_1", 2))])
+
+        task_db = self.task_store.get_task_by_id(str(task.id))
+        self.assertEqual(models.TaskStatus.RUNNING, task_db.status)
+        self.assertEqual(5, task_db.p_item.priority)
+        self.assertEqual(created.created_at, task_db.created_at)
+
+        _, count = self.task_store.get_tasks(None, None, None, None, None, None)
+        self.assertEqual(2, count)
+
+    def test_set_status(self) -> None:
+        """Only the status and lease of existing tasks should be updated."""
+        items = [create_p_item("scheduler_1", priority) for priority in range(2)]
+        for item in items:
+            self.task_store.create_task(functions.create_task(item))
+
+        missing = str(uuid.uuid4())
+        updated = self.task_store.set_status(
+            [str(item.id) for item in items] + [missing],
+            models.TaskStatus.COMPLETED,
+        )
+
+        self.assertEqual({str(item.id) for item in items}, set(updated))
+        for item in items:
+            task_db = self.task_store.get_task_by_id(str(item.id))
+            self.assertEqual(models.TaskStatus.COMPLETED, task_db.status)
+            self.assertEqual(item.priority, task_db.p_item.priority)
+
+        self.assertEqual([], self.task_store.set_status([missing], models.TaskStatus.COMPLETED))
+
+    def test_task_latest(self) -> None:
+        """The latest task of a hash should be kept up to date on every write
+        of a task, and count the tasks that were created with the hash."""
+        items = [create_p_item("scheduler_1", 1) for _ in range(3)]
+        for item in items:
+            item.hash = "hash"
+
+        # Tasks are created oldest first
+        self.task_store.create_task(functions.create_task(items[0]))
+        self.task_store.upsert_tasks([functions.create_task(items[1])])
+
+        latest = self.task_store.get_latest_by_hash("hash")
+        self.assertEqual(items[1].id, latest.task_id)
+        self.assertEqual(models.TaskStatus.QUEUED, latest.status)
+        self.assertEqual(2, latest.run_count)
+
+        # Updating the latest task doesn't count as a run
+        task = self.task_store.get_task_by_id(str(items[1].id))
+        self.task_store.upsert_task(task)
+        self.task_store.set_status([str(items[1].id)], models.TaskStatus.COMPLETED)
+
+        latest = self.task_store.get_latest_by_hash("hash")
+        self.assertEqual(models.TaskStatus.COMPLETED, latest.status)
+        self.assertEqual(2, latest.run_count)
+
+        # Updating an older task doesn't replace the latest task
+        self.task_store.set_status([str(items[0].id)], models.TaskStatus.FAILED)
+        self.task_store.upsert_task(self.task_store.get_task_by_id(str(items[0].id)))
+
+        latest = self.task_store.get_latest_by_hash("hash")
+        self.assertEqual(items[1].id, latest.task_id)
+        self.assertEqual(models.TaskStatus.COMPLETED, latest.status)
+
+        # Popping the task of a new item dispatches the latest task
+        self.pq_store.push("scheduler_1", items[2])
+        self.task_store.create_task(functions.create_task(items[2]))
+        self.pq_store.pop("scheduler_1")
+
+        latest = self.task_store.get_latest_by_hash("hash")
+        self.assertEqual(items[2].id, latest.task_id)
+        self.assertEqual(models.TaskStatus.DISPATCHED, latest.status)
+        self.assertEqual(3, latest.run_count)
+
+    def test_get_latest_by_hashes(self) -> None:
+        items = [create_p_item("scheduler_1", 1) for _ in range(2)]
+        for i, item in enumerate(items):
+            item.hash = f"hash_{i}"
+
+        self.task_store.create_tasks([functions.create_task(item) for item in items])
+
+        latest = self.task_store.get_latest_by_hashes(["hash_0", "hash_1", "hash_2"])
+        self.assertEqual({"hash_0", "hash_1"}, set(latest.keys()))
+        self.assertEqual(items[0].id, latest["hash_0"].task_id)
+        self.assertIsNone(self.task_store.get_latest_by_hash("hash_2"))
+
+    def test_pop_concurrent(self) -> None:
+        """Concurrent pops should never return the same item twice."""
+        scheduler_id = "scheduler_1"
+
+        for priority in range(50):
+            self.pq_store.push(scheduler_id, create_p_item(scheduler_id, priority))
+
+        self.assertEqual(50, self.pq_store.qsize(scheduler_id))
+
+        popped = []
+
+        def pop() -> None:
+            while True:
+                p_item = self.pq_store.pop(scheduler_id)
+                if p_item is None:
+                    return
+
+                popped.append(p_item.id)
+
+        threads = [threading.Thread(target=pop) for _ in range(8)]
+        for t in threads:
+            t.start()
+
+        for t in threads:
+            t.join()
+
+        self.assertEqual(50, len(popped))
+        self.assertEqual(50, len(set(popped)))
+        self.assertEqual(0, self.pq_store.qsize(scheduler_id))
+
+    def test_qsize_counter(self) -> None:
+        """The size of the queue should be kept up to date after the first
+        count, without counting the items in the database again."""
+        scheduler_id = "scheduler_1"
+
+        self.assertEqual(0, self.pq_store.qsize(scheduler_id))
+
+        with mock.patch.object(self.pq_store, "_count", wraps=self.pq_store._count) as count:
+            items = [create_p_item(scheduler_id, priority) for priority in range(5)]
+            self.pq_store.push(scheduler_id, items[0])
+            self.pq_store.push_many(scheduler_id, items[1:])
+            self.assertEqual(5, self.pq_store.qsize(scheduler_id))
+
+            self.pq_store.pop_many(scheduler_id, 2)
+            self.assertEqual(3, self.pq_store.qsize(scheduler_id))
+
+            self.pq_store.remove(scheduler_id, str(items[4].id))
+            self.assertEqual(2, self.pq_store.qsize(scheduler_id))
+            self.assertFalse(self.pq_store.empty(scheduler_id))
+
+            count.assert_not_called()
+
+    def test_qsize_counter_reconcile(self) -> None:
+        """The size counter should be reconciled with the database after the
+        reconcile interval."""
+        scheduler_id = "scheduler_1"
+
+        self.pq_store.push(scheduler_id, create_p_item(scheduler_id, 0))
+        self.assertEqual(1, self.pq_store.qsize(scheduler_id))
+
+        # Remove the items bypassing the store, the counter is out of sync
+        with self.datastore.session.begin() as session:
+            session.query(models.PrioritizedItemORM).delete()
+
+        self.assertEqual(1, self.pq_store.qsize(scheduler_id))
+
+        self.pq_store.size_reconcile_interval = 0
+        self.assertEqual(0, self.pq_store.qsize(scheduler_id))
+        self.assertTrue(self.pq_store.empty(scheduler_id))
+
+    def test_qsize_counter_reconcile_concurrent(self) -> None:
+        """Reconciling the size counter of a queue shouldn't block the size
+        checks of other queues, and changes made while counting should be
+        kept."""
+        self.pq_store.push("scheduler_1", create_p_item("scheduler_1", 0))
+        self.pq_store.push("scheduler_2", create_p_item("scheduler_2", 0))
+        self.assertEqual(1, self.pq_store.qsize("scheduler_1"))
+        self.assertEqual(1, self.pq_store.qsize("scheduler_2"))
+
+        counting = threading.Event()
+        release = threading.Event()
+        count = self.pq_store._count
+
+        def blocking_count(scheduler_id: str) -> int:
+            result = count(scheduler_id)
+            counting.set()
+            release.wait(5)
+            return result
+
+        self.pq_store.size_reconcile_interval = 0
+        with mock.patch.object(self.pq_store, "_count", side_effect=blocking_count):
+            with futures.ThreadPoolExecutor(max_workers=1) as executor:
+                reconcile = executor.submit(self.pq_store.qsize, "scheduler_1")
+                self.assertTrue(counting.wait(5))
+
+                self.pq_store.size_reconcile_interval = 60
+                self.assertEqual(1, self.pq_store.qsize("scheduler_2"))
+                self.pq_store.push("scheduler_1", create_p_item("scheduler_1", 1))
+
+                release.set()
+                self.assertEqual(2, reconcile.result(5))
+
+        self.assertEqual(2, self.pq_store.qsize("scheduler_1"))
+
+
+class TestMemoryRepositories(TestCase):
+    def setUp(self) -> None:
+        self.datastore = sqlalchemy.SQLAlchemy("sqlite:///")
+        Base.metadata.create_all(self.datastore.engine)
+
+        self.task_store = sqlalchemy.TaskStore(datastore=self.datastore)
+
+        self.path = tempfile.mkdtemp()
+        self.dsn = f"memory+journal://{self.path}"
+        self.journal = memory.Journal(self.dsn)
+        self.pq_store = memory.PriorityQueueStore(journal=self.journal, task_store=self.task_store)
+
+    def tearDown(self) -> None:
+        self.journal.stop()
+        shutil.rmtree(self.path)
+
+    def restart(self) -> memory.PriorityQueueStore:
+        self.journal.stop()
+        self.journal = memory.Journal(self.dsn)
+
+        return memory.PriorityQueueStore(journal=self.journal, task_store=self.task_store)
+
+    def test_pop_dispatches_task(self) -> None:
+        scheduler_id = "scheduler_1"
+
+        p_item = create_p_item(scheduler_id, 1)
+        self.pq_store.push(scheduler_id, p_item)
+        self.task_store.create_task(functions.create_task(p_item))
+
+        popped = self.pq_store.pop(scheduler_id)
+        self.assertEqual(p_item.id, popped.id)
+
+        task = self.task_store.get_task_by_id(str(p_item.id))
+        self.assertEqual(models.TaskStatus.DISPATCHED, task.status)
+
+    def test_restore_from_journal(self) -> None:
+        scheduler_id = "scheduler_1"
+
+        items = [create_p_item(scheduler_id, priority) for priority in range(5)]
+        items[0].hash = "hash"
+        self.pq_store.push_many(scheduler_id, items)
+        self.pq_store.pop(scheduler_id)
+        self.pq_store.remove(scheduler_id, str(items[4].id))
+
+        items[3].priority = 0
+        self.pq_store.update(scheduler_id, items[3])
+
+        pq_store = self.restart()
+
+        self.assertEqual(3, pq_store.qsize(scheduler_id))
+        self.assertIsNone(pq_store.get_item_by_hash(scheduler_id, "hash"))
+        self.assertEqual(
+            [items[3].id, items[1].id, items[2].id], [p_item.id for p_item in pq_store.pop_many(scheduler_id, 3)]
+        )
+
+    def test_restore_from_snapshot(self) -> None:
+        scheduler_id = "scheduler_1"
+        self.pq_store.snapshot_interval = 3
+
+        items = [create_p_item(scheduler_id, priority) for priority in range(5)]
+        items[2].hash = "hash"
+        for p_item in items:
+            self.pq_store.push(scheduler_id, p_item)
+
+        # The snapshot is written after 3 changes, and the journal is
+        # truncated.
+        with open(self.journal.journal_path, encoding="utf-8") as f:
+            self.assertEqual(2, len(f.readlines()))
+
+        pq_store = self.restart()
+
+        self.assertEqual(5, pq_store.qsize(scheduler_id))
+        self.assertEqual(items[2].id, pq_store.get_item_by_hash(scheduler_id, "hash").id)
+        self.assertEqual(items[0].id, pq_store.peek(scheduler_id, 0).id)
+
+    def test_restore_from_rotated_journal(self) -> None:
+        """The changes in a rotated journal are restored when the process
+        stopped before the snapshot was written."""
+        scheduler_id = "scheduler_1"
+
+        items = [create_p_item(scheduler_id, priority) for priority in range(4)]
+        self.pq_store.push_many(scheduler_id, items[:2])
+
+        # NOTE: the journal is rotated, but the snapshot isn't written
+        self.journal.rotate()
+        self.pq_store.push_many(scheduler_id, items[2:])
+        self.pq_store.remove(scheduler_id, str(items[0].id))
+
+        pq_store = self.restart()
+        self.assertTrue(os.path.exists(self.journal.rotated_journal_path))
+        self.assertEqual(
+            [items[1].id, items[2].id, items[3].id], [p_item.id for p_item in pq_store.pop_many(scheduler_id, 3)]
+        )
+
+        # Writing the snapshot removes the rotated journal
+        pq_store.snapshot()
+        self.assertFalse(os.path.exists(self.journal.rotated_journal_path))
+
+        pq_store = self.restart()
+        self.assertEqual(0, pq_store.qsize(scheduler_id))
+
+    def test_pop_concurrent(self) -> None:
+        """Concurrent pops should never return the same item twice."""
+        scheduler_id = "scheduler_1"
+
+        self.pq_store.push_many(scheduler_id, [create_p_item(scheduler_id, priority) for priority in range(50)])
+
+        popped = []
+
+        def pop() -> None:
+            while True:
+                p_item = self.pq_store.pop(scheduler_id)
+                if p_item is None:
+                    return
+
+                popped.append(p_item.id)
+
+        threads = [threading.Thread(target=pop) for _ in range(8)]
+        for t in threads:
+            t.start()
+
+        for t in threads:
+            t.join()
+
+        self.assertEqual(50, len(popped))
+        self.assertEqual(50, len(set(popped)))
+        self.assertEqual(0, self.pq_store.qsize(scheduler_id))
+
+    def test_pop_many_filters(self) -> None:
+        """Items that don't match the filters should stay on the queue, in
+        priority order."""
+        scheduler_id = "scheduler_1"
+
+        items = [
+            functions.create_p_item(scheduler_id, priority, functions.TestModel(id=str(priority), name=name))
+            for priority, name in enumerate(["a", "b", "a", "b", "a"])
+        ]
+        self.pq_store.push_many(scheduler_id, items)
+
+        popped = self.pq_store.pop_many(scheduler_id, 2, [models.Filter(field="name", operator="eq", value="a")])
+        self.assertEqual([items[0].id, items[2].id], [p_item.id for p_item in popped])
+
+        with self.assertRaises(ValueError):
+            self.pq_store.pop_many(scheduler_id, 2, [models.Filter(field="name", operator="in_", value="a")])
+
+        self.assertEqual(3, self.pq_store.qsize(scheduler_id))
+        self.assertEqual(
+            [items[1].id, items[3].id, items[4].id], [p_item.id for p_item in self.pq_store.pop_many(scheduler_id, 3)]
+        )
+
+
+class TestTaskRetention(TestCase):
+    def setUp(self) -> None:
+        self.datastore = sqlalchemy.SQLAlchemy("sqlite:///")
+        Base.metadata.create_all(self.datastore.engine)
+
+        self.task_store = sqlalchemy.TaskStore(datastore=self.datastore)
+
+        self.path = tempfile.mkdtemp()
+
+        now = datetime.now(timezone.utc)
+        self.expired = []
+        for days in [40, 35, 31]:
+            task = functions.create_task(create_p_item("scheduler_1", 1))
+            task.hash = f"hash-{days}"
+            task.created_at = now - timedelta(days=days)
+            self.task_store.create_task(task)
+            self.expired.append(task)
+
+        self.recent = functions.create_task(create_p_item("scheduler_1", 1))
+        self.recent.hash = "hash-recent"
+        self.task_store.create_task(self.recent)
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.path)
+
+    def test_run(self) -> None:
+        """Tasks created before the retention period should be removed."""
+        retention = sqlalchemy.TaskRetention(self.datastore, max_age=timedelta(days=30))
+        retention.run()
+
+        tasks, count = self.task_store.get_tasks(None, None, None, None, None, None)
+        self.assertEqual(1, count)
+        self.assertEqual(self.recent.id, tasks[0].id)
+        self.assertEqual([], os.listdir(self.path))
+
+        # The latest tasks of the hashes of the removed tasks are removed
+        latest = self.task_store.get_latest_by_hashes([task.hash for task in self.expired] + ["hash-recent"])
+        self.assertEqual(["hash-recent"], list(latest))
+
+    def test_run_archive(self) -> None:
+        """Removed tasks should be archived per batch, oldest first."""
+        retention = sqlalchemy.TaskRetention(
+            self.datastore,
+            max_age=timedelta(days=30),
+            archive_dir=self.path,
+            batch_size=2,
+        )
+        retention.run()
+
+        _, count = self.task_store.get_tasks(None, None, None, None, None, None)
+        self.assertEqual(1, count)
+
+        archived = []
+        for name in sorted(os.listdir(self.path)):
+            self.assertTrue(name.endswith(".ndjson.gz"))
+            with gzip.open(os.path.join(self.path, name), "rt") as f:
+                archived.extend(models.Task.parse_raw(line) for line in f)
+
+        self.assertEqual(2, len(os.listdir(self.path)))
+        self.assertEqual([task.id for task in self.expired], [task.id for task in archived])
+
+    def test_run_keep_forever(self) -> None:
+        retention = sqlalchemy.TaskRetention(self.datastore, archive_dir=self.path)
+        retention.run()
+
+        _, count = self.task_store.get_tasks(None, None, None, None, None, None)
+        self.assertEqual(4, count)
+        self.assertEqual([], os.listdir(self.path))
+
+    def test_expire_default_partition(self) -> None:
+        """Expired tasks in the default partition should be archived and
+        removed in batches, with their latest tasks."""
+        # NOTE: SQLite doesn't support partitioning, a copy of the tasks
+        # table stands in for the default partition.
+        with self.datastore.engine.begin() as connection:
+            connection.execute(text(f"CREATE TABLE {DEFAULT_PARTITION} AS SELECT * FROM tasks"))
+
+        retention = sqlalchemy.TaskRetention(
+            self.datastore,
+            max_age=timedelta(days=30),
+            archive_dir=self.path,
+            batch_size=2,
+        )
+        retention.expire_default_partition(datetime.now(timezone.utc) - timedelta(days=30))
+
+        with self.datastore.engine.connect() as connection:
+            remaining = connection.execute(text(f"SELECT id FROM {DEFAULT_PARTITION}")).all()
+        self.assertEqual(1, len(remaining))
+
+        latest = self.task_store.get_latest_by_hashes([task.hash for task in self.expired] + ["hash-recent"])
+        self.assertEqual(["hash-recent"], list(latest))
+        self.assertEqual(2, len(os.listdir(self.path)))
@@ -0,0 +1,309 @@
+import json
+import socket
+import threading
+import time
+import unittest
+import urllib.parse
+from concurrent import futures
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+
+from scheduler.connectors import services
+
+
+class BytesStub(BaseHTTPRequestHandler):
+    """A stub of the bytes api, that counts the requests it receives."""
+
+    calls: Dict[str, int]
+    lock: threading.Lock
+    token: str
+    boefje_meta: Dict[str, List[Dict[str, Any]]]
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+    def _count(self, path: str) -> None:
+        with self.lock:
+            self.calls[path] = self.calls.get(path, 0) + 1
+
+    def _respond(self, status: int, body: Any) -> None:
+        content = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def do_GET(self) -> None:
+        url = urllib.parse.urlparse(self.path)
+        self._count(url.path)
+
+        if url.path == "/health":
+            self._respond(200, {"healthy": True})
+            return
+
+        if self.headers.get("Authorization") != f"bearer {self.token}":
+            self._respond(401, {"detail": "Unauthorized"})
+            return
+
+        params = urllib.parse.parse_qs(url.query)
+        self._respond(200, self.boefje_meta.get(params["boefje_id"][0], []))
+
+    def do_POST(self) -> None:
+        self._count(self.path)
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self._respond(200, {"access_token": self.token})
+
+
+class BytesTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        self.calls: Dict[str, int] = {}
+        handler = type(
+            "Handler",
+            (BytesStub,),
+            {
+                "calls": self.calls,
+                "lock": threading.Lock(),
+                "token": "token",
+                "boefje_meta": {
+                    "boefje_1": [
+                        {
+                            "id": "e2b4d5c6-0000-0000-0000-000000000001",
+                            "boefje": {"id": "boefje_1"},
+                            "input_ooi": "Hostname|internet|example.com",
+                            "arguments": {},
+                            "organization": "org",
+                            "started_at": "2023-04-01T10:00:00+00:00",
+                            "ended_at": "2023-04-01T10:05:00+00:00",
+                        }
+                    ],
+                },
+            },
+        )
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+        self.bytes = services.Bytes(
+            host=f"http://127.0.0.1:{self.server.server_address[1]}",
+            source="scheduler/test",
+            user="user",
+            password="password",
+            max_concurrency=4,
+        )
+
+    def tearDown(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+        self.bytes.executor.shutdown()
+
+    def test_get_last_run_boefjes(self):
+        """The last runs should be returned in the order of the keys, with a
+        single login for the whole batch."""
+        keys = [(f"boefje_{i}", "Hostname|internet|example.com", "org") for i in range(8)]
+
+        last_runs = self.bytes.get_last_run_boefjes(keys)
+
+        self.assertEqual(8, len(last_runs))
+        self.assertEqual("boefje_1", last_runs[1].boefje.id)
+        self.assertEqual([None] * 7, last_runs[:1] + last_runs[2:])
+
+        # All requests are unauthorized until we login, after which all of
+        # them are made again.
+        self.assertEqual(1, self.calls["/token"])
+        self.assertEqual(16, self.calls["/bytes/boefje_meta"])
+
+        # With a token, every key is a single request
+        self.bytes.get_last_run_boefjes(keys)
+        self.assertEqual(1, self.calls["/token"])
+        self.assertEqual(24, self.calls["/bytes/boefje_meta"])
+
+    def test_get_last_run_boefjes_empty(self):
+        self.assertEqual([], self.bytes.get_last_run_boefjes([]))
+        self.assertNotIn("/bytes/boefje_meta", self.calls)
+
+
+class KatalogusStub(BaseHTTPRequestHandler):
+    """A stub of the katalogus api, that counts the requests it receives,
+    and supports conditional requests on the plugins of an organisation."""
+
+    calls: Dict[str, int]
+    lock: threading.Lock
+    state: Dict[str, Any]
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+    def _respond(self, status: int, body: Any = None, headers: Optional[Dict[str, str]] = None) -> None:
+        content = json.dumps(body).encode() if body is not None else b""
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(content)
+
+    def do_GET(self) -> None:
+        with self.lock:
+            self.calls[self.path] = self.calls.get(self.path, 0) + 1
+
+        if self.path == "/health":
+            self._respond(200, {"healthy": True})
+        elif self.path == "/v1/organisations":
+            self._respond(200, {"org": {"id": "org", "name": "org"}})
+        elif self.path == "/v1/organisations/org/plugins":
+            time.sleep(self.state.get("delay", 0))
+
+            etag = f'"{self.state["version"]}"'
+            if self.headers.get("If-None-Match") == etag:
+                self._respond(304)
+                return
+
+            self._respond(200, self.state["plugins"], {"ETag": etag})
+        else:
+            self._respond(404, {"detail": "Not found"})
+
+
+class KatalogusTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        self.calls: Dict[str, int] = {}
+        self.state: Dict[str, Any] = {
+            "version": 1,
+            "plugins": [
+                {"id": "dns", "type": "boefje", "consumes": ["Hostname"], "produces": [], "enabled": True},
+                {"id": "nmap", "type": "boefje", "consumes": "IPAddressV4", "produces": [], "enabled": True},
+                {"id": "dns-norm", "type": "normalizer", "consumes": ["dns"], "produces": [], "enabled": True},
+            ],
+        }
+        handler = type(
+            "Handler",
+            (KatalogusStub,),
+            {"calls": self.calls, "lock": threading.Lock(), "state": self.state},
+        )
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+        self.katalogus = services.Katalogus(
+            host=f"http://127.0.0.1:{self.server.server_address[1]}",
+            source="scheduler/test",
+            cache_ttl=60,
+        )
+
+    def tearDown(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+        self.katalogus.executor.shutdown()
+
+    def _wait_for_refresh(self) -> None:
+        for _ in range(100):
+            if not self.katalogus.refreshing:
+                return
+            time.sleep(0.01)
+
+        self.fail("Snapshot wasn't refreshed")
+
+    def test_lookups(self):
+        """All lookups are served from a single fetch of the plugins."""
+        self.assertEqual("dns", self.katalogus.get_plugin_by_id_and_org_id("dns", "org").id)
+        self.assertEqual(["dns"], [p.id for p in self.katalogus.get_boefjes_by_type_and_org_id("Hostname", "org")])
+        self.assertEqual(["nmap"], [p.id for p in self.katalogus.get_boefjes_by_type_and_org_id("IPAddressV4", "org")])
+        self.assertEqual(["dns-norm"], [p.id for p in self.katalogus.get_normalizers_by_org_id_and_type("org", "dns")])
+        self.assertIsNone(self.katalogus.get_boefjes_by_type_and_org_id("Network", "org"))
+
+        self.assertEqual(1, self.calls["/v1/organisations/org/plugins"])
+
+    def test_warm_up(self):
+        """The plugins of all organisations are fetched in the background."""
+        self.katalogus.warm_up().result()
+        self._wait_for_refresh()
+
+        self.assertEqual(1, self.calls["/v1/organisations"])
+        self.assertEqual(1, self.calls["/v1/organisations/org/plugins"])
+
+        self.assertIsNotNone(self.katalogus.get_plugin_by_id_and_org_id("dns", "org"))
+        self.assertEqual(1, self.calls["/v1/organisations/org/plugins"])
+
+    def test_refresh_not_modified(self):
+        """A stale snapshot is served while it is revalidated in the
+        background, with a conditional request."""
+        snapshot = self.katalogus.get_snapshot("org")
+        snapshot.fetched_at -= 61
+
+        self.assertIs(snapshot, self.katalogus.get_snapshot("org"))
+        self._wait_for_refresh()
+
+        self.assertEqual(2, self.calls["/v1/organisations/org/plugins"])
+        self.assertIs(snapshot, self.katalogus.get_snapshot("org"))
+        self.assertLess(time.monotonic() - snapshot.fetched_at, 60)
+
+    def test_refresh_modified(self):
+        snapshot = self.katalogus.get_snapshot("org")
+
+        self.state["version"] = 2
+        self.state["plugins"] = self.state["plugins"][:1]
+        snapshot.fetched_at -= 61
+
+        # The stale plugins are served until the refresh is done
+        self.assertIsNotNone(self.katalogus.get_plugin_by_id_and_org_id("nmap", "org"))
+        self._wait_for_refresh()
+
+        self.assertIsNone(self.katalogus.get_plugin_by_id_and_org_id("nmap", "org"))
+        self.assertEqual('"2"', self.katalogus.get_snapshot("org").etag)
+
+    def test_refresh_coalesced(self):
+        """Concurrent refreshes of the plugins of an organisation share one
+        request to katalogus."""
+        self.katalogus.get_snapshot("org")
+        self.state["delay"] = 0.5
+
+        with futures.ThreadPoolExecutor(max_workers=8) as executor:
+            snapshots = list(executor.map(lambda _: self.katalogus.refresh_snapshot("org"), range(8)))
+
+        self.assertEqual(2, self.calls["/v1/organisations/org/plugins"])
+        self.assertEqual(1, len({id(snapshot) for snapshot in snapshots}))
+        self.assertEqual(7, self.katalogus.single_flight.stats()["coalesced"])
+
+    def test_refresh_removed(self):
+        """A refresh that is in flight while the snapshot is removed doesn't
+        bring the snapshot back."""
+        snapshot = self.katalogus.get_snapshot("org")
+
+        self.state["version"] = 2
+        self.state["delay"] = 0.5
+        snapshot.fetched_at -= 61
+
+        self.katalogus.get_snapshot("org")
+        time.sleep(0.1)
+        self.katalogus.remove_snapshot("org")
+        self._wait_for_refresh()
+
+        self.assertNotIn("org", self.katalogus.snapshots)
+        self.assertEqual(2, self.calls["/v1/organisations/org/plugins"])
+
+    def test_unknown_organisation(self):
+        """An organisation of which the plugins can't be fetched has no
+        plugins, and isn't fetched again on every lookup."""
+        self.assertIsNone(self.katalogus.get_plugin_by_id_and_org_id("dns", "unknown"))
+        self.assertIsNone(self.katalogus.get_plugin_by_id_and_org_id("dns", "unknown"))
+
+        # NOTE: the requests session retries on server errors only
+        self.assertEqual(1, self.calls["/v1/organisations/unknown/plugins"])
+
+
+class HTTPServiceTestCase(unittest.TestCase):
+    def test_deadline(self):
+        """The checks of an unavailable host give up at the deadline."""
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            port = sock.getsockname()[1]
+
+        start = time.monotonic()
+        with self.assertRaises(RuntimeError):
+            services.Katalogus(
+                host=f"http://127.0.0.1:{port}",
+                source="scheduler/test",
+                deadline=time.monotonic() + 0.5,
+            )
+
+        self.assertLess(time.monotonic() - start, 5)
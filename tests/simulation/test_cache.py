@@ -0,0 +1,65 @@
+import logging
+import threading
+import time
+import unittest
+from typing import Any, Callable
+
+from scheduler import utils
+
+logger = logging.getLogger(__name__)
+
+
+class CacheBenchmarkTestCase(unittest.TestCase):
+    """Compares the read throughput of utils.Cache and utils.ExpiringDict
+    with many concurrent readers, e.g. the schedulers of all organisations
+    looking up plugins."""
+
+    readers = 64
+    reads = 20_000
+    keys = 1_000
+
+    def run_readers(self, name: str, get: Callable[[Any], Any]) -> float:
+        barrier = threading.Barrier(self.readers + 1)
+
+        def reader(offset: int) -> None:
+            barrier.wait()
+            for i in range(self.reads):
+                get(f"org-{(offset + i) % self.keys}")
+
+        threads = [threading.Thread(target=reader, args=(i,)) for i in range(self.readers)]
+        for thread in threads:
+            thread.start()
+
+        barrier.wait()
+        start_time = time.perf_counter()
+        for thread in threads:
+            thread.join()
+        elapsed_time = time.perf_counter() - start_time
+
+        throughput = self.readers * self.reads / elapsed_time
+        logger.info(
+            "%s: %d readers, %.0f reads/s, exec time: %.2f [readers=%d, throughput=%.0f, elapsed_time=%.2f]",
+            name,
+            self.readers,
+            throughput,
+            elapsed_time,
+            self.readers,
+            throughput,
+            elapsed_time,
+        )
+
+        return throughput
+
+    def test_read_throughput(self):
+        expiring_dict = utils.ExpiringDict(lifetime=300)
+        cache = utils.Cache(ttl=300)
+        for i in range(self.keys):
+            expiring_dict[f"org-{i}"] = i
+            cache.set(f"org-{i}", i)
+
+        self.run_readers("ExpiringDict", expiring_dict.get)
+        self.run_readers("Cache", cache.get)
+
+        stats = cache.stats()
+        self.assertEqual(self.readers * self.reads, stats["hits"])
+        self.assertEqual(0, stats["evictions"])
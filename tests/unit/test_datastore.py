@@ -0,0 +1,201 @@
+import unittest
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+from typing import Any, List, Tuple
+from unittest import mock
+
+from scheduler import models
+from scheduler.models import Base
+from scheduler.repositories import sqlalchemy
+from scheduler.repositories.sqlalchemy import retention, task_store
+from sqlalchemy import event, orm
+from sqlalchemy.dialects import postgresql
+from tests.utils import functions
+
+
+class DatastoreQueryPlanTestCase(unittest.TestCase):
+    """Check with EXPLAIN that the hot queue and task lookups are served by
+    an index, and don't regress to full table scans or sorts."""
+
+    def setUp(self) -> None:
+        self.datastore = sqlalchemy.SQLAlchemy("sqlite:///")
+        Base.metadata.create_all(self.datastore.engine)
+
+        self.pq_store = sqlalchemy.PriorityQueueStore(datastore=self.datastore)
+        self.task_store = sqlalchemy.TaskStore(datastore=self.datastore)
+
+        p_item = functions.create_p_item(scheduler_id="test", priority=1)
+        p_item.hash = "hash"
+        self.pq_store.push("test", p_item)
+        self.task_store.create_task(functions.create_task(p_item))
+
+        self.statements: List[Tuple[str, Any]] = []
+        event.listen(self.datastore.engine, "before_cursor_execute", self._capture)
+
+    def tearDown(self) -> None:
+        event.remove(self.datastore.engine, "before_cursor_execute", self._capture)
+
+    def _capture(self, conn, cursor, statement, parameters, context, executemany) -> None:
+        if statement.lstrip().upper().startswith("SELECT"):
+            self.statements.append((statement, parameters))
+
+    def assert_uses_index(self, index: str) -> None:
+        """Run EXPLAIN on the captured statements, and check that they search
+        by the index without scanning the table or sorting the results."""
+        self.assertTrue(self.statements)
+
+        with self.datastore.engine.connect() as conn:
+            for statement, parameters in self.statements:
+                plan = [row[-1] for row in conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters)]
+
+                self.assertTrue(any(index in detail for detail in plan), plan)
+                self.assertFalse(any(detail.startswith("SCAN") for detail in plan), plan)
+                self.assertFalse(any("TEMP B-TREE" in detail for detail in plan), plan)
+
+    def test_get_item_by_hash(self):
+        self.pq_store.get_item_by_hash("test", "hash")
+        self.assert_uses_index("ix_items_scheduler_id_hash_created_at")
+
+    def test_peek(self):
+        self.pq_store.peek("test", 0)
+        self.assert_uses_index("ix_items_scheduler_id_priority_created_at")
+
+    def test_pop(self):
+        self.pq_store.pop("test")
+        self.assert_uses_index("ix_items_scheduler_id_priority_created_at")
+
+    def test_get_tasks_by_hash(self):
+        self.task_store.get_tasks_by_hash("hash")
+        self.assert_uses_index("ix_tasks_hash_created_at")
+
+    def test_get_latest_task_by_hash(self):
+        self.task_store.get_latest_task_by_hash("hash")
+        self.assert_uses_index("ix_tasks_hash_created_at")
+
+    def test_get_latest_by_hash(self):
+        self.task_store.get_latest_by_hash("hash")
+        self.assert_uses_index("sqlite_autoindex_task_latest_1")
+
+    def test_get_latest_by_hashes(self):
+        self.task_store.get_latest_by_hashes(["hash", "other"])
+        self.assert_uses_index("sqlite_autoindex_task_latest_1")
+
+    def test_get_tasks_after(self):
+        self.task_store.get_tasks(
+            scheduler_id=None,
+            type=None,
+            status=None,
+            min_created_at=None,
+            max_created_at=None,
+            filters=None,
+            after=(datetime.now(timezone.utc), "0" * 32),
+            count=models.CountMode.NONE,
+        )
+        self.assert_uses_index("ix_tasks_created_at_id")
+
+    def test_get_tasks_by_scheduler_id_after(self):
+        self.task_store.get_tasks(
+            scheduler_id="test",
+            type=None,
+            status=None,
+            min_created_at=None,
+            max_created_at=None,
+            filters=None,
+            after=(datetime.now(timezone.utc), "0" * 32),
+            count=models.CountMode.NONE,
+        )
+        self.assert_uses_index("ix_tasks_scheduler_id_created_at_id")
+
+    def test_requeue_expired(self):
+        self.pq_store.requeue_expired("test", datetime.now(timezone.utc), 100)
+        self.assert_uses_index("ix_tasks_scheduler_id_lease_expires_at")
+
+    def test_get_expired_tasks(self):
+        self.task_store.get_expired_tasks("test", datetime.now(timezone.utc), 100)
+        self.assert_uses_index("ix_tasks_scheduler_id_lease_expires_at")
+
+
+class ExplainTestCase(unittest.TestCase):
+    def test_compile(self):
+        """Filters with a list of values are expanded, like in the query
+        itself."""
+        query = (
+            orm.Session()
+            .query(models.TaskORM)
+            .filter(models.TaskORM.status.in_([models.TaskStatus.QUEUED, models.TaskStatus.FAILED]))
+        )
+
+        compiled = task_store.Explain(query.statement).compile(
+            dialect=postgresql.psycopg2.dialect(),
+            compile_kwargs={"render_postcompile": True},
+        )
+
+        self.assertTrue(str(compiled).startswith("EXPLAIN (FORMAT JSON) SELECT"))
+        self.assertNotIn("POSTCOMPILE", str(compiled))
+        self.assertEqual(
+            [models.TaskStatus.QUEUED, models.TaskStatus.FAILED],
+            list(compiled.construct_params().values()),
+        )
+
+
+class PartitionTestCase(unittest.TestCase):
+    def test_partition_name(self):
+        self.assertEqual("tasks_p2023_03", retention.partition_name(datetime(2023, 3, 31, 23, tzinfo=timezone.utc)))
+
+        # The partitions are in UTC
+        tz = timezone(timedelta(hours=2))
+        self.assertEqual("tasks_p2023_03", retention.partition_name(datetime(2023, 4, 1, 1, tzinfo=tz)))
+
+    def test_partition_range(self):
+        self.assertEqual(
+            (datetime(2023, 12, 1, tzinfo=timezone.utc), datetime(2024, 1, 1, tzinfo=timezone.utc)),
+            retention.partition_range("tasks_p2023_12"),
+        )
+        self.assertIsNone(retention.partition_range("tasks_default"))
+
+    def test_is_partitioned(self):
+        """Only PostgreSQL supports partitioning."""
+        datastore = sqlalchemy.SQLAlchemy("sqlite:///")
+        with datastore.engine.connect() as connection:
+            self.assertFalse(retention.is_partitioned(connection))
+
+
+class PushListenerTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        self.callback = mock.Mock()
+        self.listener = sqlalchemy.PushListener(mock.Mock(), callback=self.callback, timeout=0)
+        self.listener.connection = mock.Mock(notifies=[])
+
+    @mock.patch("select.select")
+    def test_listen(self, mock_select):
+        """Every notification should be passed to the callback."""
+        mock_select.return_value = ([self.listener.connection], [], [])
+        self.listener.connection.notifies.extend(
+            [SimpleNamespace(payload="scheduler_1"), SimpleNamespace(payload="scheduler_2")]
+        )
+
+        self.listener.listen()
+
+        self.assertEqual([mock.call("scheduler_1"), mock.call("scheduler_2")], self.callback.call_args_list)
+        self.assertEqual([], self.listener.connection.notifies)
+
+    @mock.patch("select.select")
+    def test_listen_timeout(self, mock_select):
+        mock_select.return_value = ([], [], [])
+
+        self.listener.listen()
+
+        self.callback.assert_not_called()
+        self.listener.connection.poll.assert_not_called()
+
+    @mock.patch("select.select")
+    def test_listen_reconnect(self, mock_select):
+        """When the connection fails, it should be closed and reopened on
+        the next call."""
+        mock_select.side_effect = OSError("connection lost")
+        connection = self.listener.connection
+
+        self.listener.listen()
+
+        connection.close.assert_called_once()
+        self.assertIsNone(self.listener.connection)
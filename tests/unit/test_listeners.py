@@ -0,0 +1,212 @@
+import json
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+import pika
+
+from scheduler.connectors import listeners
+
+
+class ConsumerTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        self.consumer = listeners.Consumer("queue", prefetch_count=2)
+        self.consumer.connection = mock.Mock()
+        self.channel = mock.Mock(is_open=True)
+
+        # Run the callbacks that are scheduled on the consuming thread
+        # directly.
+        self.consumer.connection.add_callback_threadsafe.side_effect = lambda callback: callback()
+
+    def deliver(self, delivery_tag: int, body: bytes) -> None:
+        self.consumer.on_message(self.channel, SimpleNamespace(delivery_tag=delivery_tag), None, body)
+
+    def test_get(self):
+        self.deliver(1, b"a")
+        self.deliver(2, b"b")
+
+        self.assertEqual([b"a"], self.consumer.get(1))
+        self.assertEqual([b"b"], self.consumer.get(5))
+        self.assertEqual([], self.consumer.get(1))
+
+    def test_callbacks(self):
+        """The callbacks are called for every delivered message."""
+        callback = mock.Mock()
+        self.consumer.add_callback(callback)
+
+        self.deliver(1, b"a")
+        self.deliver(2, b"b")
+
+        self.assertEqual(2, callback.call_count)
+
+    def test_buffer_full(self):
+        """Messages that don't fit in the buffer are returned to the queue."""
+        self.deliver(1, b"a")
+        self.deliver(2, b"b")
+        self.deliver(3, b"c")
+
+        self.channel.basic_nack.assert_called_once_with(3, requeue=True)
+        self.assertEqual([b"a", b"b"], self.consumer.get(5))
+
+    def test_ack(self):
+        """All taken messages are acknowledged at once."""
+        self.deliver(1, b"a")
+        self.deliver(2, b"b")
+        self.consumer.get(2)
+
+        self.consumer.ack()
+
+        self.channel.basic_ack.assert_called_once_with(2, multiple=True)
+
+        # Nothing is taken anymore
+        self.consumer.ack()
+        self.channel.basic_ack.assert_called_once()
+
+    def test_nack(self):
+        self.deliver(1, b"a")
+        self.consumer.get(1)
+
+        self.consumer.nack()
+
+        self.channel.basic_nack.assert_called_once_with(1, multiple=True, requeue=True)
+        self.channel.basic_ack.assert_not_called()
+
+    def test_close(self):
+        """Messages delivered on a closed connection can't be acknowledged
+        anymore."""
+        self.deliver(1, b"a")
+        self.deliver(2, b"b")
+        self.consumer.get(1)
+
+        self.consumer.close()
+        self.consumer.ack()
+
+        self.assertEqual([], self.consumer.get(1))
+        self.channel.basic_ack.assert_not_called()
+
+    def test_ack_closed_channel(self):
+        """Settling messages on a closed channel shouldn't fail the shared
+        connection."""
+        self.deliver(1, b"a")
+        self.consumer.get(1)
+        self.channel.is_open = False
+
+        self.consumer.ack()
+
+        self.channel.basic_ack.assert_not_called()
+
+
+class ConnectionManagerTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        self.manager = listeners.ConnectionManager("amqp://", prefetch_count=2, pool_size=2)
+        for connection in self.manager.connections:
+            connection.start = mock.Mock()
+
+    def test_consumer(self):
+        """Consumers are spread over the connections, and created once per
+        queue."""
+        consumer_1 = self.manager.consumer("org1__queue")
+        consumer_2 = self.manager.consumer("org2__queue")
+
+        self.assertIs(consumer_1, self.manager.consumer("org1__queue"))
+        self.assertEqual(2, consumer_1.prefetch_count)
+        self.assertEqual(
+            [{"org1__queue": consumer_1}, {"org2__queue": consumer_2}],
+            [connection.consumers for connection in self.manager.connections],
+        )
+        for connection in self.manager.connections:
+            connection.start.assert_called_once()
+
+    def test_remove(self):
+        consumer = self.manager.consumer("org1__queue")
+        connection = self.manager.connections[0]
+        connection.connection = mock.Mock()
+
+        self.manager.remove("org1__queue")
+
+        self.assertEqual({}, connection.consumers)
+        connection.connection.add_callback_threadsafe.assert_called_once_with(consumer.close)
+
+        self.assertIsNone(self.manager.get_consumer("org1__queue"))
+
+        # A new consumer is created when the queue is consumed again
+        self.assertIsNot(consumer, self.manager.consumer("org1__queue"))
+
+
+class BrokerConnectionTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        self.connection = listeners.BrokerConnection("amqp://", name="test", min_backoff=1, max_backoff=4)
+        self.consumer = listeners.Consumer("queue")
+        self.connection.add(self.consumer)
+
+    @mock.patch("pika.BlockingConnection")
+    def test_connect(self, mock_connection):
+        """The channels of the consumers are opened when connected."""
+        self.connection.connect()
+
+        channel = mock_connection.return_value.channel.return_value
+        channel.basic_consume.assert_called_once_with("queue", on_message_callback=self.consumer.on_message)
+        self.assertIs(channel, self.consumer.channel)
+
+    @mock.patch("pika.BlockingConnection")
+    def test_connect_channel_closed(self, mock_connection):
+        """A queue that can't be consumed doesn't fail the connection, it is
+        retried later."""
+        mock_connection.return_value.channel.return_value.basic_consume.side_effect = (
+            pika.exceptions.ChannelClosedByBroker(404, "NOT_FOUND")
+        )
+
+        self.connection.connect()
+
+        self.assertIsNone(self.consumer.channel)
+        mock_connection.return_value.call_later.assert_called_once()
+
+    @mock.patch("pika.BlockingConnection")
+    def test_run_backoff(self, mock_connection):
+        """Reconnecting backs off exponentially, up to max_backoff."""
+        mock_connection.side_effect = pika.exceptions.AMQPConnectionError()
+
+        waits = []
+
+        def wait(timeout):
+            waits.append(timeout)
+            if len(waits) == 5:
+                self.connection.stop_event.set()
+
+        with mock.patch.object(self.connection.stop_event, "wait", side_effect=wait):
+            self.connection.run()
+
+        self.assertEqual([1, 2, 4, 4, 4], waits)
+
+
+class RabbitMQTestCase(unittest.TestCase):
+    def test_get(self):
+        """A consumer is created once per queue, on the shared manager."""
+        manager = mock.create_autospec(listeners.ConnectionManager, instance=True)
+        manager.consumer.return_value.get.side_effect = [[json.dumps({"a": 1}).encode()], []]
+        listener = listeners.RabbitMQ("amqp://", manager=manager)
+
+        self.assertEqual({"a": 1}, listener.get("queue"))
+        self.assertIsNone(listener.get("queue"))
+        listener.ack("queue")
+        listener.remove("queue")
+
+        manager.consumer.assert_called_with("queue")
+        manager.get_consumer.return_value.ack.assert_called_once()
+        manager.remove.assert_called_once_with("queue")
+
+    def test_ack_removed(self):
+        """Acknowledging messages of a removed queue shouldn't start
+        consuming the queue again."""
+        manager = listeners.ConnectionManager("amqp://")
+        for connection in manager.connections:
+            connection.start = mock.Mock()
+        listener = listeners.RabbitMQ("amqp://", manager=manager)
+
+        listener.get("queue")
+        listener.remove("queue")
+        listener.ack("queue")
+        listener.nack("queue")
+
+        self.assertEqual({}, manager.consumers)
+        self.assertEqual({}, manager.connections[0].consumers)
@@ -1,11 +1,16 @@
 import copy
 import queue as _queue
+import shutil
+import tempfile
+import threading
+import time
 import unittest
 import uuid
+from datetime import datetime, timedelta, timezone
 
-from scheduler import queues
+from scheduler import models, queues
 from scheduler.models import Base
-from scheduler.repositories import sqlalchemy
+from scheduler.repositories import memory, sqlalchemy
 from sqlalchemy.orm import sessionmaker
 from tests.utils import functions
 
@@ -21,6 +26,7 @@ class PriorityQueueTestCase(unittest.TestCase):
         Base.metadata.create_all(self.datastore.engine)
 
         self.pq_store = sqlalchemy.PriorityQueueStore(datastore=self.datastore)
+        self.task_store = sqlalchemy.TaskStore(datastore=self.datastore)
 
         self.pq = TestPriorityQueue(
             pq_id="test",
@@ -317,3 +323,305 @@ class PriorityQueueTestCase(unittest.TestCase):
         # Pop the item
         popped_item = self.pq.pop()
         self.assertEqual(first_item.priority, popped_item.priority)
+
+    def test_pop_many(self):
+        """When popping multiple items, it should return the items with the
+        highest priority, in order of priority.
+        """
+        for priority in [3, 1, 2]:
+            self.pq.push(p_item=functions.create_p_item(scheduler_id=self.pq.pq_id, priority=priority))
+
+        popped_items = self.pq.pop_many(2)
+        self.assertEqual([1, 2], [p_item.priority for p_item in popped_items])
+
+        # The queue should now have 1 item
+        self.assertEqual(1, self.pq.qsize())
+
+    def test_pop_many_queue_empty(self):
+        """When popping multiple items from an empty queue, it should raise an
+        exception.
+        """
+        with self.assertRaises(queues.errors.QueueEmptyError):
+            self.pq.pop_many(2)
+
+    def test_push_many(self):
+        """When pushing a batch of items, all items should be added"""
+        items = [functions.create_p_item(scheduler_id=self.pq.pq_id, priority=i) for i in range(3)]
+
+        results = self.pq.push_many(items)
+
+        self.assertEqual([models.PushStatus.CREATED] * 3, [result.status for result in results])
+        self.assertEqual(3, self.pq.qsize())
+        self.assertEqual(0, self.pq.peek(0).priority)
+
+    def test_push_many_duplicates(self):
+        """When pushing a batch of items that contains the same item twice,
+        only the first one should be added.
+        """
+        item = functions.create_p_item(scheduler_id=self.pq.pq_id, priority=1)
+
+        results = self.pq.push_many([item, copy.deepcopy(item)])
+
+        self.assertEqual(
+            [models.PushStatus.CREATED, models.PushStatus.NOT_ALLOWED],
+            [result.status for result in results],
+        )
+        self.assertEqual(1, self.pq.qsize())
+
+    def test_push_many_update(self):
+        """When pushing a batch of items that are already on the queue, the
+        items should be updated.
+        """
+        self.pq.allow_priority_updates = True
+
+        item = functions.create_p_item(scheduler_id=self.pq.pq_id, priority=1)
+        self.pq.push(item)
+
+        updated_item = copy.deepcopy(item)
+        updated_item.priority = 0
+        new_item = functions.create_p_item(scheduler_id=self.pq.pq_id, priority=2)
+
+        results = self.pq.push_many([updated_item, new_item])
+
+        self.assertEqual(
+            [models.PushStatus.UPDATED, models.PushStatus.CREATED],
+            [result.status for result in results],
+        )
+        self.assertEqual(2, self.pq.qsize())
+        self.assertEqual(0, self.pq.peek(0).priority)
+
+    def test_push_many_queue_full(self):
+        """When pushing a batch of items that doesn't fit on the queue, the
+        items that don't fit should be rejected.
+        """
+        self.pq.maxsize = 2
+        items = [functions.create_p_item(scheduler_id=self.pq.pq_id, priority=i) for i in range(3)]
+
+        results = self.pq.push_many(items)
+
+        self.assertEqual(
+            [models.PushStatus.CREATED, models.PushStatus.CREATED, models.PushStatus.QUEUE_FULL],
+            [result.status for result in results],
+        )
+        self.assertEqual(2, self.pq.qsize())
+
+    def test_push_many_invalid_item(self):
+        """When pushing a batch with an item that is not of the correct type,
+        only that item should be rejected.
+        """
+        item = functions.create_p_item(scheduler_id=self.pq.pq_id, priority=1)
+
+        results = self.pq.push_many([{"priority": 1, "data": {}}, item])
+
+        self.assertEqual(
+            [models.PushStatus.INVALID, models.PushStatus.CREATED],
+            [result.status for result in results],
+        )
+        self.assertEqual(1, self.pq.qsize())
+
+    def test_pop_filters_operators(self):
+        """When popping with filters, every operator should be applied, and
+        numeric values should be compared as numbers."""
+        items = [
+            functions.create_p_item(
+                scheduler_id=self.pq.pq_id,
+                priority=i,
+                data=functions.TestModel(id=str(i), name=name, child=child),
+            )
+            for i, (name, child) in enumerate([("a", 2), ("b", 10), ("c", 30)])
+        ]
+        self.pq.push_many(items)
+
+        tests = [
+            ([models.Filter(field="name", operator="ne", value="a")], [items[1].id, items[2].id]),
+            ([models.Filter(field="child", operator="gt", value=5)], [items[1].id, items[2].id]),
+            ([models.Filter(field="child", operator="le", value=10)], [items[0].id, items[1].id]),
+            ([models.Filter(field="name", operator="in_", value=["a", "c"])], [items[0].id, items[2].id]),
+            ([models.Filter(field="name", operator="notin_", value=["a", "c"])], [items[1].id]),
+            (
+                [
+                    models.Filter(field="child", operator="ge", value=10),
+                    models.Filter(field="child", operator="lt", value=30),
+                ],
+                [items[1].id],
+            ),
+        ]
+
+        for filters, expected in tests:
+            with self.subTest(filters=filters):
+                popped = self.pq.pop_many(3, filters)
+                self.assertEqual(expected, [p_item.id for p_item in popped])
+
+                # Put the items back on the queue
+                self.pq.push_many([copy.deepcopy(item) for item in items if item.id in expected])
+
+    def test_pop_filters_invalid(self):
+        """When a filter operator doesn't fit the value, it should raise a
+        ValueError."""
+        self.pq.push(functions.create_p_item(scheduler_id=self.pq.pq_id, priority=1))
+
+        with self.assertRaises(ValueError):
+            self.pq.pop(filters=[models.Filter(field="name", operator="in_", value="a")])
+
+    def test_get_items(self):
+        """When getting items page by page, all items should be returned in
+        order of priority, without removing them from the queue."""
+        items = [functions.create_p_item(scheduler_id=self.pq.pq_id, priority=priority) for priority in [2, 1, 1, 0]]
+        self.pq.push_many(items)
+
+        first_page = self.pq.get_items(3)
+        self.assertEqual([0, 1, 1], [p_item.priority for p_item in first_page])
+
+        last = first_page[-1]
+        second_page = self.pq.get_items(3, (last.priority, last.created_at, str(last.id)))
+        self.assertEqual([2], [p_item.priority for p_item in second_page])
+
+        self.assertEqual(4, len({p_item.id for p_item in first_page + second_page}))
+        self.assertEqual(4, self.pq.qsize())
+
+    def test_dict(self):
+        """The dict representation of the queue should be a summary, without
+        the items on the queue."""
+        self.assertEqual((None, None), (self.pq.dict()["min_priority"], self.pq.dict()["max_priority"]))
+
+        self.pq.push_many([functions.create_p_item(scheduler_id=self.pq.pq_id, priority=p) for p in [5, 2, 9]])
+
+        summary = self.pq.dict()
+        self.assertEqual(3, summary["size"])
+        self.assertEqual(2, summary["min_priority"])
+        self.assertEqual(9, summary["max_priority"])
+        self.assertNotIn("pq", summary)
+
+    def _push_task(self, priority: int) -> models.PrioritizedItem:
+        p_item = functions.create_p_item(scheduler_id=self.pq.pq_id, priority=priority)
+        self.pq.push(p_item=p_item)
+        self.task_store.create_task(functions.create_task(p_item))
+
+        return p_item
+
+    def test_pop_lease(self):
+        """When popping an item with a lease, its task should be dispatched
+        and hold the lease."""
+        p_item = self._push_task(priority=1)
+        lease_expires_at = datetime.now(timezone.utc) + timedelta(seconds=60)
+
+        popped_item = self.pq.pop(lease_expires_at=lease_expires_at)
+        self.assertEqual(p_item.id, popped_item.id)
+
+        task = self.task_store.get_task_by_id(str(p_item.id))
+        self.assertEqual(models.TaskStatus.DISPATCHED, task.status)
+        self.assertIsNotNone(task.lease_expires_at)
+
+    def test_requeue(self):
+        """When requeueing a leased item, it should be put back on the queue
+        with its original priority, and its lease should be released."""
+        p_item = self._push_task(priority=3)
+        self.pq.pop(lease_expires_at=datetime.now(timezone.utc) + timedelta(seconds=60))
+        self.assertEqual(0, self.pq.qsize())
+
+        self.assertTrue(self.pq.requeue(str(p_item.id)))
+        self.assertEqual(1, self.pq.qsize())
+
+        task = self.task_store.get_task_by_id(str(p_item.id))
+        self.assertEqual(models.TaskStatus.QUEUED, task.status)
+        self.assertIsNone(task.lease_expires_at)
+
+        popped_item = self.pq.pop()
+        self.assertEqual(p_item.id, popped_item.id)
+        self.assertEqual(3, popped_item.priority)
+
+        # Without a lease the item can't be requeued
+        self.assertFalse(self.pq.requeue(str(p_item.id)))
+        self.assertEqual(0, self.pq.qsize())
+
+    def test_requeue_expired(self):
+        """Only the items of which the lease expired should be put back on
+        the queue, at most `limit` at a time."""
+        now = datetime.now(timezone.utc)
+        expired = [self._push_task(priority=i) for i in range(2)]
+        self.pq.pop_many(2, lease_expires_at=now - timedelta(seconds=1))
+
+        leased = self._push_task(priority=5)
+        self.pq.pop(lease_expires_at=now + timedelta(seconds=60))
+        self.assertEqual(0, self.pq.qsize())
+
+        self.assertEqual(1, self.pq.requeue_expired(now, limit=1))
+        self.assertEqual(1, self.pq.requeue_expired(now, limit=10))
+        self.assertEqual(0, self.pq.requeue_expired(now, limit=10))
+
+        self.assertEqual(2, self.pq.qsize())
+        self.assertEqual(
+            [p_item.id for p_item in expired],
+            [p_item.id for p_item in self.pq.pop_many(10)],
+        )
+
+        task = self.task_store.get_task_by_id(str(leased.id))
+        self.assertEqual(models.TaskStatus.DISPATCHED, task.status)
+
+    def test_requeue_expired_superseded(self):
+        """When an item with the same hash has been pushed onto the queue in
+        the meantime, the expired task should be failed instead of being put
+        back on the queue."""
+        now = datetime.now(timezone.utc)
+        p_item = self._push_task(priority=1)
+        self.pq.pop(lease_expires_at=now - timedelta(seconds=1))
+
+        new_item = functions.create_p_item(scheduler_id=self.pq.pq_id, priority=2, data=p_item.data)
+        new_item.hash = str(p_item.hash)
+        self.pq_store.push(self.pq.pq_id, new_item)
+
+        self.assertEqual(1, self.pq.requeue_expired(now, limit=10))
+        self.assertEqual(1, self.pq.qsize())
+        self.assertEqual(new_item.id, self.pq.peek(0).id)
+
+        task = self.task_store.get_task_by_id(str(p_item.id))
+        self.assertEqual(models.TaskStatus.FAILED, task.status)
+        self.assertIsNone(task.lease_expires_at)
+
+    def test_wait_for_space(self):
+        """Waiting for space should return as soon as an item is popped,
+        and not wait for the timeout."""
+        for i in range(self.pq.maxsize):
+            self.pq.push(functions.create_p_item(scheduler_id=self.pq.pq_id, priority=i))
+
+        self.assertFalse(self.pq.wait_for_space(timeout=0.1))
+
+        timer = threading.Timer(0.1, self.pq.pop)
+        timer.start()
+
+        start = time.monotonic()
+        self.assertTrue(self.pq.wait_for_space(timeout=10))
+        self.assertLess(time.monotonic() - start, 5)
+
+        timer.join()
+
+        # There is only space for one item
+        self.assertFalse(self.pq.wait_for_space(n=2, timeout=0))
+
+
+class MemoryPriorityQueueTestCase(PriorityQueueTestCase):
+    """Run the PriorityQueue tests against the in-memory PriorityQueueStore."""
+
+    def setUp(self) -> None:
+        self.path = tempfile.mkdtemp()
+        self.journal = memory.Journal(f"memory+journal://{self.path}")
+
+        self.datastore = sqlalchemy.SQLAlchemy("sqlite:///")
+        self.task_store = sqlalchemy.TaskStore(datastore=self.datastore)
+
+        self.pq_store = memory.PriorityQueueStore(journal=self.journal, task_store=self.task_store)
+
+        self.pq = TestPriorityQueue(
+            pq_id="test",
+            maxsize=10,
+            item_type=functions.TestModel,
+            pq_store=self.pq_store,
+        )
+
+        self._check_queue_empty()
+
+    def tearDown(self) -> None:
+        self.journal.stop()
+        shutil.rmtree(self.path)
+
+        del self.pq
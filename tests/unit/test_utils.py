@@ -1,4 +1,7 @@
+import threading
+import time
 import unittest
+from concurrent import futures
 from datetime import datetime, timedelta, timezone
 
 from scheduler import utils
@@ -16,3 +19,219 @@ class ExpiringDictTestCase(unittest.TestCase):
         ed["a"] = 1
 
         self.assertEqual(1, ed.get("a"))
+
+
+class ThreadRunnerTestCase(unittest.TestCase):
+    def test_wake(self):
+        """Waking the thread should run the target right away, instead of
+        after the interval."""
+        calls = threading.Semaphore(0)
+        runner = utils.ThreadRunner(target=calls.release, stop_event=threading.Event(), interval=60)
+        runner.start()
+
+        try:
+            self.assertTrue(calls.acquire(timeout=5))
+            self.assertFalse(calls.acquire(timeout=0.1))
+
+            runner.wake()
+            self.assertTrue(calls.acquire(timeout=5))
+        finally:
+            runner.join(5)
+
+        self.assertFalse(runner.is_alive())
+
+    def test_stop_event(self):
+        """Setting the shared stop event should stop a thread that waits for
+        its interval to pass."""
+        stop_event = threading.Event()
+        runner = utils.ThreadRunner(target=lambda: None, stop_event=stop_event, interval=60)
+        runner.STOP_CHECK_INTERVAL = 0.1
+        runner.start()
+
+        stop_event.set()
+
+        # NOTE: ThreadRunner.join would wake the thread up
+        threading.Thread.join(runner, 5)
+        self.assertFalse(runner.is_alive())
+
+
+class SingleFlightTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        self.single_flight = utils.SingleFlight()
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.calls = 0
+
+    def slow(self, value):
+        self.calls += 1
+        self.started.set()
+        self.release.wait(5)
+        if isinstance(value, Exception):
+            raise value
+
+        return value
+
+    def test_coalesce(self):
+        """Concurrent calls with the same key share one call."""
+        with futures.ThreadPoolExecutor(max_workers=4) as executor:
+            leader = executor.submit(self.single_flight.do, "key", self.slow, 1)
+            self.started.wait(5)
+
+            followers = [executor.submit(self.single_flight.do, "key", self.slow, 2) for _ in range(3)]
+            while self.single_flight.stats()["coalesced"] < 3:
+                time.sleep(0.01)
+
+            self.release.set()
+
+            self.assertEqual([1, 1, 1, 1], [f.result() for f in [leader] + followers])
+
+        self.assertEqual(1, self.calls)
+        self.assertEqual({"calls": 1, "coalesced": 3}, self.single_flight.stats())
+
+        # Calls after the call finished make a new call
+        self.assertEqual(3, self.single_flight.do("key", self.slow, 3))
+        self.assertEqual({"calls": 2, "coalesced": 3}, self.single_flight.stats())
+
+    def test_coalesce_error(self):
+        """The error of a call is raised for all callers that shared it."""
+        with futures.ThreadPoolExecutor(max_workers=2) as executor:
+            leader = executor.submit(self.single_flight.do, "key", self.slow, ValueError("failed"))
+            self.started.wait(5)
+
+            follower = executor.submit(self.single_flight.do, "key", self.slow, 2)
+            while self.single_flight.stats()["coalesced"] < 1:
+                time.sleep(0.01)
+
+            self.release.set()
+
+            for future in [leader, follower]:
+                with self.assertRaises(ValueError):
+                    future.result()
+
+        self.assertEqual(1, self.calls)
+        self.assertEqual({}, self.single_flight.in_flight)
+
+    def test_different_keys(self):
+        self.release.set()
+
+        self.assertEqual(1, self.single_flight.do("a", self.slow, 1))
+        self.assertEqual(2, self.single_flight.do("b", self.slow, 2))
+        self.assertEqual({"calls": 2, "coalesced": 0}, self.single_flight.stats())
+
+
+class CacheTestCase(unittest.TestCase):
+    def test_ttl(self):
+        cache = utils.Cache(ttl=60)
+        cache.set("a", 1)
+        cache.set("b", 2, ttl=-1)
+        cache.set("c", 3, ttl=None)
+
+        self.assertEqual(1, cache.get("a"))
+        self.assertIsNone(cache.get("b"))
+        self.assertNotIn("b", cache)
+        self.assertEqual(3, cache.get("c"))
+        self.assertEqual(1, cache.stats()["expirations"])
+
+    def test_maxsize(self):
+        """The least recently used entries are evicted."""
+        cache = utils.Cache(maxsize=2, stripes=1)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+
+        self.assertEqual(1, cache.get("a"))
+        self.assertNotIn("b", cache)
+        self.assertEqual(3, cache.get("c"))
+        self.assertEqual(1, cache.stats()["evictions"])
+
+    def test_maxbytes(self):
+        cache = utils.Cache(maxbytes=10, sizeof=len, stripes=1)
+        cache.set("a", "12345")
+        cache.set("b", "12345")
+        cache.set("c", "1")
+
+        self.assertNotIn("a", cache)
+        self.assertEqual(6, cache.stats()["bytes"])
+
+        # A value larger than the bound is kept, but evicts everything else
+        cache.set("d", "x" * 20)
+        self.assertEqual(1, len(cache))
+
+    def test_stats(self):
+        cache = utils.Cache()
+        cache.set("a", 1)
+        cache.get("a")
+        cache.get("b")
+
+        stats = cache.stats()
+        self.assertEqual(1, stats["hits"])
+        self.assertEqual(1, stats["misses"])
+        self.assertEqual(1, stats["entries"])
+
+    def test_get_or_load(self):
+        cache = utils.Cache()
+        calls = []
+
+        def loader():
+            calls.append(1)
+            return "value"
+
+        self.assertEqual("value", cache.get_or_load("a", loader))
+        self.assertEqual("value", cache.get_or_load("a", loader))
+        self.assertEqual(1, len(calls))
+
+    def test_negative_caching(self):
+        """A loader that doesn't find a value isn't called again until the
+        negative ttl has passed."""
+        cache = utils.Cache(negative_ttl=60)
+        calls = []
+
+        def loader():
+            calls.append(1)
+
+        self.assertIsNone(cache.get_or_load("a", loader))
+        self.assertIsNone(cache.get_or_load("a", loader))
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(1, len(calls))
+
+        # Without negative caching the loader is called on every miss
+        cache = utils.Cache()
+        cache.get_or_load("a", loader)
+        cache.get_or_load("a", loader)
+        self.assertEqual(3, len(calls))
+
+    def test_concurrent(self):
+        cache = utils.Cache(maxsize=64)
+
+        def worker(i):
+            for j in range(1000):
+                cache.set((i, j % 100), j)
+                cache.get((i, j % 100))
+
+        with futures.ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(worker, range(8)))
+
+        self.assertLessEqual(len(cache), 64)
+        self.assertEqual(8000, cache.stats()["hits"] + cache.stats()["misses"])
+
+
+class PhaseTimerTestCase(unittest.TestCase):
+    def test_phase(self):
+        timer = utils.PhaseTimer("startup")
+
+        with timer.phase("a"):
+            pass
+
+        with self.assertRaises(RuntimeError):
+            with timer.phase("b"):
+                raise RuntimeError("unavailable")
+
+        self.assertIsNone(timer.dict()["finished_at"])
+        timer.finish()
+
+        phases = timer.dict()["phases"]
+        self.assertEqual(["a", "b"], [phase["name"] for phase in phases])
+        self.assertEqual([None, "unavailable"], [phase["error"] for phase in phases])
+        self.assertTrue(all(phase["duration"] is not None for phase in phases))
+        self.assertIsNotNone(timer.dict()["finished_at"])